@@ -1,4 +1,5 @@
 import os 
+import tempfile
 from pathlib import Path
 from decouple import config
 
@@ -40,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'video_uploader.middleware.QueryProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'social_video_uploader.urls'
@@ -65,13 +67,38 @@ WSGI_APPLICATION = 'social_video_uploader.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite by default. WAL lets readers run alongside the single writer,
+# IMMEDIATE transactions take the write lock up front instead of failing
+# with "database is locked" when a read transaction later writes, and
+# writers wait up to SQLITE_BUSY_TIMEOUT seconds for the lock.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int),
+        },
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Setting POSTGRES_DB switches to PostgreSQL (requires psycopg), for many
+# concurrent upload workers
+if config('POSTGRES_DB', default=''):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': config('POSTGRES_DB'),
+        'USER': config('POSTGRES_USER', default='postgres'),
+        'PASSWORD': config('POSTGRES_PASSWORD', default=''),
+        'HOST': config('POSTGRES_HOST', default='localhost'),
+        'PORT': config('POSTGRES_PORT', default='5432'),
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,4 +156,139 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 VIMEO_ACCESS_TOKEN = 'IS SIMULATED'
 CLIENT_ID = config('YOUTUBE_CLIENT_ID')
 CLIENT_SECRET = config('YOUTUBE_CLIENT_SECRET')
-YOUTUBE_REDIRECT_URI = 'http://localhost:8192/oauth2callback'
\ No newline at end of file
+YOUTUBE_REDIRECT_URI = 'http://localhost:8192/oauth2callback'
+
+# UPLOAD WORKERS
+UPLOAD_WORKERS = config('UPLOAD_WORKERS', default=2, cast=int)
+UPLOAD_WORKER_POLL_INTERVAL = config('UPLOAD_WORKER_POLL_INTERVAL', default=1.0, cast=float)
+# Upload jobs running at once per user, unless the user's UploadShare sets
+# its own; 0 (None) for no cap. Jobs are otherwise shared out by UploadShare.weight.
+UPLOAD_FAIR_SHARE_MAX_RUNNING = config('UPLOAD_FAIR_SHARE_MAX_RUNNING', default=0, cast=int) or None
+# Workers renew the lease on their uploads every third of UPLOAD_LEASE_SECONDS.
+# Uploads of a crashed worker are recovered by the next worker to look, every
+# UPLOAD_REAP_INTERVAL seconds, so within UPLOAD_LEASE_SECONDS + UPLOAD_REAP_INTERVAL.
+# Running jobs are kept alive the same way through UploadJob.locked_at.
+UPLOAD_LEASE_SECONDS = config('UPLOAD_LEASE_SECONDS', default=90, cast=int)
+UPLOAD_REAP_INTERVAL = config('UPLOAD_REAP_INTERVAL', default=30, cast=int)
+
+# Scheduled publishing: due uploads are released in batches of
+# PUBLISH_BATCH_SIZE, PUBLISH_BATCH_INTERVAL seconds apart. The web processes
+# wake the dispatcher when they schedule a post (a NOTIFY on PostgreSQL, a
+# datagram to PUBLISH_WAKEUP_SOCKET with SQLite); as a fallback it re-reads
+# the next due time at least every PUBLISH_RECHECK_INTERVAL seconds.
+PUBLISH_BATCH_SIZE = config('PUBLISH_BATCH_SIZE', default=200, cast=int)
+PUBLISH_BATCH_INTERVAL = config('PUBLISH_BATCH_INTERVAL', default=5.0, cast=float)
+PUBLISH_RECHECK_INTERVAL = config('PUBLISH_RECHECK_INTERVAL', default=30.0, cast=float)
+PUBLISH_WAKEUP_SOCKET = config('PUBLISH_WAKEUP_SOCKET', default=str(BASE_DIR / 'publish-dispatcher.sock'))
+
+# Fan out a post's platform uploads on a thread pool instead of one by one
+UPLOAD_FANOUT_CONCURRENT = config('UPLOAD_FANOUT_CONCURRENT', default=True, cast=bool)
+UPLOAD_FANOUT_MAX_WORKERS = config('UPLOAD_FANOUT_MAX_WORKERS', default=4, cast=int)
+# Simultaneous uploads per platform within one process
+UPLOAD_PLATFORM_CONCURRENCY = {
+    'default': 4,
+    'youtube': 2,
+}
+# Seconds before an upload is marked failed and no longer waited on
+UPLOAD_SERVICE_TIMEOUTS = {
+    'default': 15 * 60,
+    'youtube': 6 * 60 * 60,
+}
+
+# YouTube resumable uploads, chunk size must be a multiple of 256 KiB
+YOUTUBE_UPLOAD_CHUNK_SIZE = config('YOUTUBE_UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+YOUTUBE_UPLOAD_NUM_RETRIES = config('YOUTUBE_UPLOAD_NUM_RETRIES', default=3, cast=int)
+
+# Upload progress is buffered and written for all uploads of a process at most this often, in seconds
+UPLOAD_PROGRESS_FLUSH_INTERVAL = config('UPLOAD_PROGRESS_FLUSH_INTERVAL', default=2.0, cast=float)
+
+# Block size in which platform services read videos from non-local storage
+MEDIA_SOURCE_BLOCK_SIZE = 4 * 1024 * 1024
+YOUTUBE_API_ENDPOINT = config('YOUTUBE_API_ENDPOINT', default='')
+
+# Resumable upload sessions copy request bodies to disk in blocks of this size
+UPLOAD_SESSION_BLOCK_SIZE = 1024 * 1024
+
+# Reuse the platform's existing copy when a file with the same content hash was already uploaded
+UPLOAD_DEDUPLICATE = config('UPLOAD_DEDUPLICATE', default=True, cast=bool)
+
+# In-process caches of YouTube credentials and built API clients
+YOUTUBE_CREDENTIAL_CACHE_SIZE = 256
+YOUTUBE_CREDENTIAL_CACHE_TTL = 60 * 60
+YOUTUBE_CLIENT_CACHE_SIZE = 256
+YOUTUBE_CLIENT_CACHE_TTL = 60 * 60
+# Idle API clients kept per user, one is needed per concurrent upload of that user
+YOUTUBE_CLIENT_POOL_SIZE = 4
+# Refresh access tokens this many seconds before they expire
+YOUTUBE_TOKEN_REFRESH_MARGIN = 5 * 60
+# Path to a YouTube discovery document; defaults to the copy bundled with googleapiclient
+YOUTUBE_DISCOVERY_DOCUMENT = config('YOUTUBE_DISCOVERY_DOCUMENT', default='')
+
+# Largest batch accepted by POST /api/video-posts/bulk_create/
+VIDEO_POST_BULK_MAX_ITEMS = 1000
+
+# Automatic retries of failed platform uploads, delays in seconds
+UPLOAD_RETRY_POLICY = {
+    'max_attempts': 5,
+    'base_delay': 30,
+    'max_delay': 60 * 60,
+    'jitter': True,
+}
+# Stop dispatching to a platform after this many consecutive failures
+UPLOAD_CIRCUIT_BREAKER = {
+    'failure_threshold': 5,
+    'reset_timeout': 5 * 60,
+}
+
+# Quota budgets per platform; platforms not listed are not metered.
+# YouTube charges about 1600 units per videos.insert against a daily cap per
+# API project, reset at midnight Pacific time. credential_limit optionally caps
+# the units spent through a single user's credentials in one window.
+UPLOAD_PLATFORM_QUOTAS = {
+    'youtube': {
+        'cost': 1600,
+        'limit': config('YOUTUBE_DAILY_QUOTA', default=10000, cast=int),
+        'credential_limit': None,
+        'window': 24 * 60 * 60,
+        'timezone': 'America/Los_Angeles',
+    },
+}
+# Delay before retrying an upload the platform rejected as rate limited, in seconds
+UPLOAD_RATE_LIMIT_BACKOFF = 60
+
+# Server-sent upload events, see video_uploader/streams.py
+UPLOAD_EVENTS_ENABLED = config('UPLOAD_EVENTS_ENABLED', default=True, cast=bool)
+# Events buffered per subscriber; a slow client loses the oldest ones first
+UPLOAD_EVENTS_BUFFER_SIZE = 100
+# How often a server process picks up events written by the upload workers, in seconds
+UPLOAD_EVENTS_RELAY_INTERVAL = 0.5
+# Events are kept this long for clients resuming with Last-Event-ID, in seconds
+UPLOAD_EVENTS_RETENTION = 10 * 60
+# Server processes with subscribers report so every UPLOAD_EVENTS_HEARTBEAT
+# seconds. Workers record progress events only while one reported within three
+# heartbeats, and status events while one did within UPLOAD_EVENTS_RETENTION.
+UPLOAD_EVENTS_HEARTBEAT = 5
+UPLOAD_EVENTS_KEEPALIVE = 15
+
+# Fetching video_url into local storage for platforms that only take file uploads
+REMOTE_FETCH_SEGMENTS = 4
+REMOTE_FETCH_MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+REMOTE_FETCH_BLOCK_SIZE = 1024 * 1024
+REMOTE_FETCH_TIMEOUT = 30
+REMOTE_FETCH_RETRIES = 3
+REMOTE_FETCH_MAX_BYTES = config('REMOTE_FETCH_MAX_BYTES', default=256 * 1024 ** 3, cast=int)
+REMOTE_FETCH_MAX_REDIRECTS = 5
+# Hosts resolving to private, loopback or link-local addresses are refused unless this is set
+REMOTE_FETCH_ALLOW_PRIVATE = config('REMOTE_FETCH_ALLOW_PRIVATE', default=False, cast=bool)
+
+# Metrics served at /metrics. Upload worker processes write snapshots to this
+# directory for the web process to merge; set it to '' to disable that.
+METRICS_MULTIPROCESS_DIR = config(
+    'METRICS_MULTIPROCESS_DIR', default=os.path.join(tempfile.gettempdir(), 'video_uploader_metrics'))
+METRICS_FLUSH_INTERVAL = 5
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Per-request query count, SQL time and repeated queries in the
+# X-Query-Profile header and the video_uploader.middleware log
+QUERY_PROFILING = config('QUERY_PROFILING', default=False, cast=bool)
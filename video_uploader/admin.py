@@ -1,17 +1,20 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import VideoPost, Platform, UploadStatus
+from .models import VideoPost, Platform, PlatformQuota, RemoteFetch, UploadShare, UploadStatus, UploadJob
 
 
 class PlatformAdmin(admin.ModelAdmin):
-    list_display = ['platform', 'is_active', 'api_endpoint']
+    list_display = ['platform', 'is_active', 'api_endpoint', 'circuit_failures', 'circuit_open_until']
     list_filter = ['is_active']
 
 admin.site.register(UploadStatus)
 class UploadStatusInline(admin.TabularInline):
     model = UploadStatus
     extra = 0
-    readonly_fields = ['status', 'external_id', 'uploaded_at', 'error_message']
+    readonly_fields = [
+        'status', 'external_id', 'uploaded_at', 'error_message',
+        'bytes_sent', 'total_bytes', 'throughput', 'attempts', 'next_retry_at'
+    ]
 
 
 class VideoPostAdmin(admin.ModelAdmin):
@@ -20,15 +23,19 @@ class VideoPostAdmin(admin.ModelAdmin):
     search_fields = ['title', 'description']
     inlines = [UploadStatusInline]
     
+    def get_queryset(self, request):
+        # Status and platforms for every row come from the changelist query itself
+        return super().get_queryset(request).with_overall_status().prefetch_related('platforms')
+    
     def save_model(self, request, obj, form, change):
         if not change:
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
         
-        # Trigger upload process only if platforms exist
+        # Queue upload process only if platforms exist
         if obj.platforms.exists():
-            from .services.upload_manager import VideoUploadManager
-            VideoUploadManager.upload_to_platforms(obj)
+            from .services.job_queue import UploadJobQueue
+            UploadJobQueue.enqueue(obj)
     
     def status_display(self, obj):
         status = obj.overall_status
@@ -45,11 +52,38 @@ class VideoPostAdmin(admin.ModelAdmin):
             status.title()
         )
     status_display.short_description = 'Upload Status'
+    status_display.admin_order_field = 'computed_status'
     
     def platform_list(self, obj):
         return ", ".join([p.platform for p in obj.platforms.all()])
     platform_list.short_description = 'Platforms'
 
 
+class UploadJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'video_post', 'user', 'status', 'attempts', 'available_at', 'start_tag', 'locked_by', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['user', 'start_tag', 'locked_by', 'locked_at', 'attempts', 'last_error', 'finished_at']
+
+
+class UploadShareAdmin(admin.ModelAdmin):
+    list_display = ['user', 'weight', 'max_running', 'last_finish_tag']
+    readonly_fields = ['last_finish_tag']
+
+
+class RemoteFetchAdmin(admin.ModelAdmin):
+    list_display = ['video_post', 'status', 'bytes_fetched', 'total_bytes', 'updated_at']
+    list_filter = ['status']
+    readonly_fields = ['total_bytes', 'bytes_fetched', 'validator', 'segments', 'content_hash', 'error_message']
+
+
+class PlatformQuotaAdmin(admin.ModelAdmin):
+    list_display = ['platform', 'credential', 'window_start', 'units_used', 'exhausted_at', 'updated_at']
+    list_filter = ['platform']
+
+
 admin.site.register(Platform, PlatformAdmin)
 admin.site.register(VideoPost, VideoPostAdmin)
+admin.site.register(UploadJob, UploadJobAdmin)
+admin.site.register(UploadShare, UploadShareAdmin)
+admin.site.register(PlatformQuota, PlatformQuotaAdmin)
+admin.site.register(RemoteFetch, RemoteFetchAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class VideoUploaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'video_uploader'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,17 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from video_uploader.services.youtube_service import YouTubeService
+
+
+class Command(BaseCommand):
+    help = "Authorize uploads to a user's YouTube channel through the OAuth flow in a browser"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+
+    def handle(self, *args, **options):
+        if not User.objects.filter(pk=options['user_id']).exists():
+            raise CommandError(f"No user {options['user_id']}")
+        YouTubeService().authorize(options['user_id'])
+        self.stdout.write(self.style.SUCCESS(f"Stored YouTube credentials for user {options['user_id']}"))
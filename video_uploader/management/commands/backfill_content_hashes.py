@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from video_uploader.models import VideoPost
+from video_uploader.storage import file_sha256
+
+
+class Command(BaseCommand):
+    help = 'Compute content hashes for stored videos that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 4,
+            help='Number of files hashed in parallel',
+        )
+        parser.add_argument(
+            '--relink', action='store_true',
+            help='Also move each file into the content-addressed layout, collapsing duplicates',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = (
+            VideoPost.objects.filter(content_hash='')
+            .exclude(video_file='').exclude(video_file__isnull=True)
+            .only('id', 'video_file')
+            .iterator(chunk_size=options['batch_size'])
+        )
+        self.storage = VideoPost._meta.get_field('video_file').storage
+        self.hashed = self.missing = self.failed = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            chunk = []
+            for post in posts:
+                chunk.append(post)
+                if len(chunk) == options['batch_size']:
+                    self.backfill(executor, chunk, options['relink'])
+                    chunk = []
+            if chunk:
+                self.backfill(executor, chunk, options['relink'])
+
+        if not (self.hashed or self.missing or self.failed):
+            self.stdout.write('Nothing to backfill')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Hashed {self.hashed} video(s), {self.missing} missing file(s), {self.failed} failed'
+        ))
+
+    def backfill(self, executor, chunk, relink):
+        """Hash one chunk of posts and save it, relinking its files first"""
+        futures = {}
+        for post in chunk:
+            path = self.storage.path(post.video_file.name)
+            if not os.path.exists(path):
+                self.missing += 1
+                self.stderr.write(f'Post {post.id}: missing file {post.video_file.name}')
+                continue
+            futures[executor.submit(file_sha256, path)] = post
+
+        hashed = []
+        for future in as_completed(futures):
+            post = futures[future]
+            try:
+                post.content_hash = future.result()
+            except OSError as e:
+                self.failed += 1
+                self.stderr.write(f'Post {post.id}: could not hash {post.video_file.name}: {e}')
+                continue
+            hashed.append(post)
+
+        update_fields = ['content_hash']
+        old_names = set()
+        if relink:
+            update_fields.append('video_file')
+            for post in hashed:
+                old_name = post.video_file.name
+                if self.storage.digest_from_name(old_name) == post.content_hash:
+                    continue
+                # The old file stays until no post points at it, so a failed
+                # update, or a later post sharing it, still finds it
+                post.video_file.name = self.storage.ingest(
+                    self.storage.path(old_name), old_name, post.content_hash, keep=True)
+                old_names.add(old_name)
+
+        with transaction.atomic():
+            VideoPost.objects.bulk_update(hashed, update_fields)
+        self.hashed += len(hashed)
+
+        if old_names:
+            still_used = set(VideoPost.objects.filter(video_file__in=old_names).values_list('video_file', flat=True))
+            for old_name in old_names - still_used:
+                self.storage.delete(old_name)
@@ -0,0 +1,196 @@
+import os
+import queue
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from video_uploader.models import Platform, UploadStatus, UserUploadStats, VideoPost
+from video_uploader.services.leases import lease_expiry, lease_owner
+from video_uploader.services.upload_manager import VideoUploadManager
+
+PLATFORMS = ['youtube', 'vimeo', 'dailymotion']
+
+
+def percentile(samples, pct):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure SQLite lock contention of concurrent upload status writes, with '
+        "SQLite's defaults and with the DATABASES profile from settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8, help='Threads writing status transitions')
+        parser.add_argument('--readers', type=int, default=2, help='Threads listing posts meanwhile')
+        parser.add_argument('--failure-rate', type=float, default=0.2)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_db_contention compares SQLite profiles; the database is not SQLite')
+
+        profiles = {
+            # Rollback journal, deferred transactions, 5 s busy timeout
+            'default': {'init_command': 'PRAGMA journal_mode=DELETE'},
+            'settings': dict(settings.DATABASES['default'].get('OPTIONS', {})),
+        }
+
+        fd, path = tempfile.mkstemp(prefix='bench_db_contention_', suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+        old_options = connection.settings_dict.get('OPTIONS', {})
+        old_databases = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(UPLOAD_CIRCUIT_BREAKER={'failure_threshold': 10 ** 9, 'reset_timeout': 0}):
+                results = {name: self._run_profile(options_, options) for name, options_ in profiles.items()}
+        finally:
+            connections.close_all()
+            connection.settings_dict['OPTIONS'] = old_options
+            teardown_databases(old_databases, verbosity=0)
+
+        self._report(results)
+
+    def _use_options(self, options):
+        # Every thread opens its connection from this settings dict
+        connections.close_all()
+        connection.settings_dict['OPTIONS'] = options
+        connection.ensure_connection()
+
+    def _run_profile(self, db_options, options):
+        self._use_options(db_options)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+
+        post_ids = self._seed(options['posts'])
+        work = queue.SimpleQueue()
+        for post_id in post_ids:
+            work.put(post_id)
+
+        write_latencies = []
+        lock_errors = []
+        reads = []
+        lock = threading.Lock()
+        writers_done = threading.Event()
+        rng = random.Random(options['seed'])
+        failures = {post_id: [rng.random() < options['failure_rate'] for _ in PLATFORMS] for post_id in post_ids}
+
+        def writer():
+            try:
+                while True:
+                    try:
+                        post_id = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    for platform, failed in zip(self.platforms, failures[post_id]):
+                        started = time.perf_counter()
+                        try:
+                            post = VideoPost.objects.get(pk=post_id)
+                            # The writes of one upload: claim the row, then record the outcome
+                            UploadStatus.objects.filter(video_post=post, platform=platform).update(
+                                status='uploading', leased_by=lease_owner(), lease_expires_at=lease_expiry())
+                            VideoUploadManager._finish(
+                                post, platform, success=not failed, external_id=f'bench-{post_id}',
+                                error='Simulated failure')
+                        except OperationalError as e:
+                            with lock:
+                                lock_errors.append(str(e))
+                            continue
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            write_latencies.append(elapsed * 1000)
+            finally:
+                connection.close()
+
+        def reader():
+            count = 0
+            try:
+                while not writers_done.is_set():
+                    try:
+                        list(VideoPost.objects.filter(created_by=self.user).with_overall_status()[:50])
+                        UserUploadStats.objects.filter(user=self.user).first()
+                        count += 1
+                    except OperationalError as e:
+                        with lock:
+                            lock_errors.append(str(e))
+            finally:
+                with lock:
+                    reads.append(count)
+                connection.close()
+
+        readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        writers = [threading.Thread(target=writer) for _ in range(max(1, options['workers']))]
+        for thread in readers:
+            thread.start()
+        started = time.perf_counter()
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        seconds = time.perf_counter() - started
+        writers_done.set()
+        for thread in readers:
+            thread.join()
+
+        write_latencies.sort()
+        summary = {
+            'journal_mode': journal_mode,
+            'writes': len(write_latencies),
+            'lock_errors': len(lock_errors),
+            'seconds': seconds,
+            'writes_per_second': len(write_latencies) / seconds if seconds else 0,
+            'reads_per_second': sum(reads) / seconds if seconds else 0,
+        }
+        if write_latencies:
+            summary.update({
+                'p50_ms': percentile(write_latencies, 50),
+                'p95_ms': percentile(write_latencies, 95),
+                'p99_ms': percentile(write_latencies, 99),
+            })
+        if lock_errors:
+            summary['first_error'] = lock_errors[0]
+        return summary
+
+    def _seed(self, posts):
+        VideoPost.objects.all().delete()
+        UserUploadStats.objects.all().delete()
+        self.user = User.objects.get_or_create(username='bench')[0]
+        self.platforms = [Platform.objects.get_or_create(platform=name)[0] for name in PLATFORMS]
+        post_ids = []
+        for index in range(posts):
+            post = VideoPost.objects.create(
+                title=f'Bench post {index}', description='Benchmark',
+                video_url=f'https://example.com/bench/{index}.mp4', created_by=self.user,
+            )
+            post.platforms.set(self.platforms)
+            post_ids.append(post.id)
+        return post_ids
+
+    def _report(self, results):
+        self.stdout.write(
+            f"{'profile':<10}{'journal':>9}{'writes':>8}{'locked':>8}{'writes/s':>10}{'reads/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        )
+        for name, result in results.items():
+            line = (
+                f"{name:<10}{result['journal_mode']:>9}{result['writes']:>8}{result['lock_errors']:>8}"
+                f"{result['writes_per_second']:>10.1f}{result['reads_per_second']:>9.1f}"
+            )
+            if result['writes']:
+                line += f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+            self.stdout.write(line)
+            if result['lock_errors']:
+                self.stdout.write(self.style.WARNING(f"  first error: {result['first_error']}"))
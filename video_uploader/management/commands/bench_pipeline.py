@@ -0,0 +1,270 @@
+import json
+import os
+import queue
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from video_uploader.models import Platform, VideoPost
+from video_uploader.services.fake_services import FakePlatformService
+from video_uploader.services.platform_services import PlatformServiceFactory
+from video_uploader.services.upload_manager import VideoUploadManager
+from video_uploader.views import VideoPostViewSet
+
+PHASES = ['create', 'upload', 'retry_upload', 'upload_stats']
+
+# Metrics compared against a baseline, and whether higher values are better
+COMPARED = {
+    'ops_per_second': True,
+    'p95_ms': False,
+    'queries_per_op': False,
+}
+
+
+def percentile(samples, pct):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the create -> upload -> retry -> stats pipeline against fake platform '
+        'services in a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads issuing operations')
+        parser.add_argument('--platforms', default='vimeo,dailymotion', help='Platforms each post goes to')
+        parser.add_argument('--latency', type=float, default=0.02, help='Fake upload latency in seconds')
+        parser.add_argument('--failure-rate', type=float, default=0.1)
+        parser.add_argument('--bandwidth', type=float, default=None, help='Fake upload bandwidth in bytes per second')
+        parser.add_argument('--video-size', type=int, default=0, help='Simulated video size in bytes')
+        parser.add_argument('--fanout', action='store_true',
+                            help='Upload to platforms concurrently; fan-out queries are then not counted')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results as a JSON baseline')
+        parser.add_argument('--baseline', metavar='PATH', help='Fail if results regress against this baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed relative regression against the baseline')
+
+    def handle(self, *args, **options):
+        config = {
+            key: options[key]
+            for key in ('posts', 'concurrency', 'platforms', 'latency', 'failure_rate',
+                        'bandwidth', 'video_size', 'fanout', 'seed')
+        }
+        names = [name.strip().lower() for name in options['platforms'].split(',') if name.strip()]
+        if not names:
+            raise CommandError('At least one platform is required')
+
+        old_services = {name: PlatformServiceFactory.registry.get(name) for name in names}
+        for index, name in enumerate(names):
+            PlatformServiceFactory.register(name, FakePlatformService(
+                name, latency=options['latency'], failure_rate=options['failure_rate'],
+                bandwidth=options['bandwidth'], video_size=options['video_size'],
+                seed=options['seed'] + index,
+            ))
+
+        old_databases = self._setup_database()
+        try:
+            # Every post is uploaded, however many failures the fakes produce
+            with override_settings(UPLOAD_CIRCUIT_BREAKER={'failure_threshold': 10 ** 9, 'reset_timeout': 0}):
+                results = self._run(names, options)
+        finally:
+            teardown_databases(old_databases, verbosity=0)
+            for name, target in old_services.items():
+                if target is None:
+                    PlatformServiceFactory.registry.pop(name, None)
+                    PlatformServiceFactory.services.pop(name, None)
+                else:
+                    PlatformServiceFactory.register(name, target)
+
+        results = {'config': config, **results}
+        self._report(results)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    def _setup_database(self):
+        if connection.vendor == 'sqlite':
+            # A file database, so that threads block on locks instead of
+            # failing as they do on a shared in-memory one
+            fd, path = tempfile.mkstemp(prefix='bench_pipeline_', suffix='.sqlite3')
+            os.close(fd)
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+        return setup_databases(verbosity=0, interactive=False, aliases={'default'})
+
+    def _run(self, names, options):
+        user = User.objects.create_user('bench', password='bench')
+        platforms = [Platform.objects.get_or_create(platform=name)[0] for name in names]
+        platform_ids = [platform.id for platform in platforms]
+        factory = APIRequestFactory()
+
+        def call(actions, request, **kwargs):
+            force_authenticate(request, user=user)
+            response = VideoPostViewSet.as_view(actions)(request, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f'HTTP {response.status_code}: {response.data}')
+            return response
+
+        created = []
+        created_lock = threading.Lock()
+
+        def create(index):
+            response = call({'post': 'create'}, factory.post('/api/video-posts/', {
+                'title': f'Bench post {index}',
+                'description': 'Benchmark',
+                'video_url': f'https://example.com/bench/{index}.mp4',
+                'platform_ids': platform_ids,
+            }, format='json'))
+            with created_lock:
+                created.append(response.data['id'])
+
+        def upload(post_id):
+            post = VideoPost.objects.select_related('created_by').get(pk=post_id)
+            VideoUploadManager.upload_to_platforms(post, concurrent=options['fanout'])
+
+        def retry(post_id):
+            call({'post': 'retry_upload'}, factory.post(f'/api/video-posts/{post_id}/retry_upload/'), pk=post_id)
+
+        def stats(_):
+            call({'get': 'upload_stats'}, factory.get('/api/video-posts/upload_stats/'))
+
+        concurrency = max(1, options['concurrency'])
+        phases = {}
+        phases['create'] = self._run_phase(range(options['posts']), create, concurrency)
+        phases['upload'] = self._run_phase(list(created), upload, concurrency)
+        failed = list(VideoPost.objects.filter(upload_statuses__status='failed').distinct().values_list('id', flat=True))
+        phases['retry_upload'] = self._run_phase(failed, retry, concurrency)
+        phases['upload_stats'] = self._run_phase(range(options['posts']), stats, concurrency)
+
+        pipeline_seconds = phases['create']['seconds'] + phases['upload']['seconds']
+        return {
+            'phases': phases,
+            'posts_per_second': len(created) / pipeline_seconds if pipeline_seconds else 0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def _run_phase(self, items, operation, concurrency):
+        """Run ``operation`` over ``items`` from ``concurrency`` threads and summarise it"""
+        work = queue.SimpleQueue()
+        for item in items:
+            work.put(item)
+        samples = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        item = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        try:
+                            operation(item)
+                            error = None
+                        except Exception as e:
+                            error = str(e)
+                        elapsed = time.perf_counter() - started
+                    with lock:
+                        samples.append((elapsed, len(queries)))
+                        if error:
+                            errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, name=f'bench-{index}') for index in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+
+        latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+        queries = [count for _, count in samples]
+        summary = {'ops': len(samples), 'errors': len(errors), 'seconds': seconds}
+        if samples:
+            summary.update({
+                'ops_per_second': len(samples) / seconds if seconds else 0,
+                'p50_ms': percentile(latencies, 50),
+                'p95_ms': percentile(latencies, 95),
+                'p99_ms': percentile(latencies, 99),
+                'queries_per_op': statistics.mean(queries),
+                'max_queries': max(queries),
+            })
+        if errors:
+            summary['first_error'] = errors[0]
+        return summary
+
+    def _report(self, results):
+        self.stdout.write(
+            f"{'phase':<14}{'ops':>6}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'queries':>9}{'max q':>7}"
+        )
+        for name in PHASES:
+            phase = results['phases'][name]
+            if not phase['ops']:
+                self.stdout.write(f"{name:<14}{0:>6}")
+                continue
+            self.stdout.write(
+                f"{name:<14}{phase['ops']:>6}{phase['errors']:>8}{phase['ops_per_second']:>10.1f}"
+                f"{phase['p50_ms']:>10.1f}{phase['p95_ms']:>10.1f}{phase['p99_ms']:>10.1f}"
+                f"{phase['queries_per_op']:>9.1f}{phase['max_queries']:>7}"
+            )
+            if phase['errors']:
+                self.stdout.write(self.style.WARNING(f"  first error: {phase['first_error']}"))
+        self.stdout.write(
+            f"Pipeline: {results['posts_per_second']:.1f} posts/s, peak RSS {results['peak_rss_mb']:.1f} MiB"
+        )
+
+    def _compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != results['config']:
+            self.stdout.write(self.style.WARNING('Baseline was recorded with a different configuration'))
+
+        regressions = []
+        for name in PHASES:
+            current = results['phases'][name]
+            previous = baseline.get('phases', {}).get(name, {})
+            for metric, higher_is_better in COMPARED.items():
+                if metric not in current or metric not in previous or not previous[metric]:
+                    continue
+                change = (current[metric] - previous[metric]) / previous[metric]
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f'{name}.{metric}: {previous[metric]:.2f} -> {current[metric]:.2f}')
+            if current.get('errors', 0) > previous.get('errors', 0):
+                regressions.append(f"{name}.errors: {previous.get('errors', 0)} -> {current['errors']}")
+
+        previous_rss = baseline.get('peak_rss_mb')
+        if previous_rss and (results['peak_rss_mb'] - previous_rss) / previous_rss > tolerance:
+            regressions.append(f"peak_rss_mb: {previous_rss:.1f} -> {results['peak_rss_mb']:.1f}")
+
+        if regressions:
+            raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'No regressions beyond {tolerance:.0%} against {path}'))
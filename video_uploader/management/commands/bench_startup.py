@@ -0,0 +1,70 @@
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SETUP = '''
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from video_uploader.services.upload_manager import VideoUploadManager
+'''
+
+SCENARIOS = [
+    (
+        'lazy registry (API, admin, migrate)',
+        SETUP,
+    ),
+    (
+        'first YouTube service',
+        SETUP + '''
+from video_uploader.services.platform_services import PlatformServiceFactory
+PlatformServiceFactory.get_service('youtube')
+''',
+    ),
+    (
+        'first YouTube client (bundled discovery)',
+        SETUP + '''
+import httplib2
+import googleapiclient.discovery
+from video_uploader.services.youtube_service import get_discovery_document
+googleapiclient.discovery.build_from_document(
+    get_discovery_document('youtube', 'v3'), http=httplib2.Http())
+''',
+    ),
+]
+
+
+class Command(BaseCommand):
+    help = 'Measure cold-start import time of the upload services in fresh interpreters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per scenario')
+
+    def _measure(self, code):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'social_video_uploader.settings'))
+        result = subprocess.run(
+            [sys.executable, '-c', code + '\nprint(time.perf_counter() - started)'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return float(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        runs = max(1, options['runs'])
+        medians = []
+        for label, code in SCENARIOS:
+            timings = [self._measure(code) for _ in range(runs)]
+            median = statistics.median(timings)
+            medians.append(median)
+            self.stdout.write(f'{label:<45} median {median * 1000:8.1f} ms  (min {min(timings) * 1000:.1f} ms)')
+
+        # Before the lazy registry every process paid for the YouTube service on import
+        gain = medians[1] - medians[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Processes that never upload to YouTube start {gain * 1000:.1f} ms faster'
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from video_uploader.models import VideoPost
+from video_uploader.services.media_probe import InvalidMedia, MediaProbe
+
+
+class Command(BaseCommand):
+    help = 'Probe stored MP4/MOV videos and rewrite those with moov after the media data to faststart layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='posts', help='Only this post (repeatable)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report which files would be rewritten')
+
+    def handle(self, *args, **options):
+        posts = VideoPost.objects.exclude(video_file='').exclude(video_file__isnull=True).order_by('id')
+        if options['posts']:
+            posts = posts.filter(id__in=options['posts'])
+
+        rewritten = invalid = 0
+        for post in posts.iterator():
+            try:
+                info = MediaProbe.ensure(post)
+            except (InvalidMedia, OSError) as e:
+                invalid += 1
+                self.stderr.write(f'Post {post.id}: {e}')
+                continue
+            if info.get('container') != 'iso-bmff' or info.get('faststart'):
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Post {post.id}: {post.video_file.name} is not faststart')
+            elif MediaProbe.make_faststart(post):
+                self.stdout.write(f'Post {post.id}: rewritten to {post.video_file.name}')
+            else:
+                continue
+            rewritten += 1
+
+        verb = 'To rewrite' if options['dry_run'] else 'Rewrote'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {rewritten} video(s), {invalid} invalid'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from video_uploader.services.leases import LeaseReaper
+
+
+class Command(BaseCommand):
+    help = 'Re-queue or fail uploads whose worker stopped renewing its lease, e.g. after a crash'
+
+    def handle(self, *args, **options):
+        requeued = failed = 0
+        while True:
+            batch = LeaseReaper.reap()
+            requeued += batch[0]
+            failed += batch[1]
+            if sum(batch) < LeaseReaper.BATCH_SIZE:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Re-queued {requeued} upload(s), failed {failed}'))
@@ -0,0 +1,55 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from video_uploader.models import UserUploadStats, VideoPost
+
+
+class Command(BaseCommand):
+    help = 'Rebuild denormalized post statuses and per-user upload stats from UploadStatus rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        counters = defaultdict(lambda: defaultdict(int))
+        stale = []
+
+        posts = VideoPost.objects.with_overall_status().values(
+            'id', 'created_by_id', 'status', 'status_flags', 'computed_status',
+            'status_pending', 'status_uploading', 'status_success', 'status_failed',
+        )
+        for post in posts.iterator(chunk_size=batch_size):
+            flags = 0
+            for status, bit in VideoPost.STATUS_FLAGS.items():
+                if post[f'status_{status}']:
+                    flags |= bit
+
+            user_counters = counters[post['created_by_id']]
+            user_counters['total_posts'] += 1
+            for status, counter in UserUploadStats.FLAG_COUNTERS.items():
+                if flags & VideoPost.STATUS_FLAGS[status]:
+                    user_counters[counter] += 1
+
+            if (post['status'], post['status_flags']) != (post['computed_status'], flags):
+                stale.append(VideoPost(id=post['id'], status=post['computed_status'], status_flags=flags))
+
+        fields = ['total_posts', *UserUploadStats.FLAG_COUNTERS.values()]
+        with transaction.atomic():
+            VideoPost.objects.bulk_update(stale, ['status', 'status_flags'], batch_size=batch_size)
+            UserUploadStats.objects.exclude(user_id__in=list(counters)).delete()
+            existing = set(UserUploadStats.objects.values_list('user_id', flat=True))
+            rows = [
+                UserUploadStats(user_id=user_id, **{field: values[field] for field in fields})
+                for user_id, values in counters.items()
+            ]
+            UserUploadStats.objects.bulk_update(
+                [row for row in rows if row.user_id in existing], fields, batch_size=batch_size)
+            UserUploadStats.objects.bulk_create(
+                [row for row in rows if row.user_id not in existing], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed {len(stale)} post status(es), rebuilt stats for {len(counters)} user(s)'
+        ))
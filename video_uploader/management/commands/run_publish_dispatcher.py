@@ -0,0 +1,25 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from video_uploader.services.metrics import registry
+from video_uploader.services.publishing import run_dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Queue scheduled video posts for upload as their publish time arrives'
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+
+        def shutdown(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        self.stdout.write(self.style.SUCCESS('Publish dispatcher started'))
+        run_dispatcher(stop_event=stop_event)
+        registry.retire()
+        self.stdout.write('Publish dispatcher stopped')
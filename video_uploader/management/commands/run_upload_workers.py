@@ -0,0 +1,91 @@
+import multiprocessing
+import signal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _worker_main(index, stop_event, poll_interval):
+    # Spawned children (macOS/Windows) start without a configured Django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from video_uploader.services.job_queue import default_worker_id, run_worker
+    from video_uploader.services.metrics import registry
+
+    # The supervisor handles Ctrl+C and signals the workers through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(default_worker_id(index), stop_event=stop_event, poll_interval=poll_interval)
+    registry.retire()
+
+
+def _dispatcher_main(stop_event):
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+    from video_uploader.services.metrics import registry
+    from video_uploader.services.publishing import run_dispatcher
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_dispatcher(stop_event=stop_event)
+    registry.retire()
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes that perform queued platform uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.UPLOAD_WORKERS,
+            help='Number of worker processes to start',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.UPLOAD_WORKER_POLL_INTERVAL,
+            help='Seconds to sleep when the queue is empty',
+        )
+        parser.add_argument(
+            '--no-dispatcher', action='store_true',
+            help='Do not start the publish dispatcher, e.g. when run_publish_dispatcher runs elsewhere',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+
+        # Never share the parent's DB connections with forked children
+        connections.close_all()
+        # Metrics of workers from an earlier run would otherwise be counted forever
+        from video_uploader.services.metrics import registry
+        registry.clear_snapshots()
+
+        stop_event = multiprocessing.Event()
+        processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(index, stop_event, poll_interval),
+                name=f'upload-worker-{index}',
+            )
+            for index in range(workers)
+        ]
+        if not options['no_dispatcher']:
+            # Queues scheduled posts when they are due
+            processes.append(multiprocessing.Process(
+                target=_dispatcher_main, args=(stop_event,), name='publish-dispatcher'))
+
+        def shutdown(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        for process in processes:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(f'Started {workers} upload worker(s)'))
+
+        for process in processes:
+            process.join()
+        self.stdout.write('Upload workers stopped')
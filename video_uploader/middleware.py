@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Literals that vary between otherwise identical queries
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def fingerprint(sql):
+    """Short id of a query's shape, the same for every set of parameters"""
+    shape = _STRING.sub('?', _NUMBER.sub('?', _IN_LIST.sub('(...)', sql)))
+    return hashlib.sha1(shape.encode()).hexdigest()[:10]
+
+
+class QueryProfile:
+    """
+    Records the queries run on every database connection of the current
+    thread while it is active::
+
+        with QueryProfile() as profile:
+            ...
+        profile.count, profile.duration, profile.duplicates()
+    """
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(connections)
+        self.queries = []
+        self._wrappers = []
+
+    def __enter__(self):
+        for alias in self.aliases:
+            wrapper = connections[alias].execute_wrapper(self._record)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(*exc_info)
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(elapsed for _, elapsed in self.queries)
+
+    def duplicates(self):
+        """{fingerprint: (times run, sample SQL)} of the queries run more than once"""
+        counts = Counter()
+        samples = {}
+        for sql, _ in self.queries:
+            key = fingerprint(sql)
+            counts[key] += 1
+            samples.setdefault(key, sql)
+        return {key: (count, samples[key]) for key, count in counts.items() if count > 1}
+
+
+def query_budget(view_class, action):
+    """Queries a DRF view action may run, declared in the view's ``query_budgets``"""
+    return getattr(view_class, 'query_budgets', {}).get(action)
+
+
+class QueryProfilingMiddleware:
+    """
+    Opt-in (QUERY_PROFILING) per-request query profile: count, total SQL time
+    and repeated query shapes. They are returned in the X-Query-Profile header
+    and logged, with a warning when the action's query budget is exceeded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_PROFILING:
+            return self.get_response(request)
+        request._query_budget = None
+        with QueryProfile() as profile:
+            response = self.get_response(request)
+
+        duplicates = profile.duplicates()
+        budget = request._query_budget
+        over_budget = budget is not None and profile.count > budget
+        header = f'count={profile.count}; time_ms={profile.duration * 1000:.2f}; duplicates={len(duplicates)}'
+        if budget is not None:
+            header += f'; budget={budget}'
+        response['X-Query-Profile'] = header
+
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            '%s %s ran %d queries in %.2fms', request.method, request.path, profile.count, profile.duration * 1000,
+            extra={'query_profile': {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': profile.count,
+                'time_ms': round(profile.duration * 1000, 3),
+                'budget': budget,
+                'over_budget': over_budget,
+                'duplicates': [
+                    {'fingerprint': key, 'count': count, 'sql': sql}
+                    for key, (count, sql) in duplicates.items()
+                ],
+            }},
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.QUERY_PROFILING:
+            return None
+        # DRF viewsets keep the method -> action map on the view function
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        view_class = getattr(view_func, 'cls', None)
+        if action and view_class:
+            request._query_budget = query_budget(view_class, action)
+        return None
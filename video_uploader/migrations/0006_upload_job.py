@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0005_alter_platform_platform_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videopost',
+            name='video_file',
+            field=models.FileField(blank=True, help_text='Required for YouTube uploads', null=True, upload_to='videos/'),
+        ),
+        migrations.AlterField(
+            model_name='videopost',
+            name='video_url',
+            field=models.URLField(blank=True, help_text='Alternative to video file, but not accepted for YouTube', null=True),
+        ),
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('video_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_jobs', to='video_uploader.videopost')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'available_at'], name='uploadjob_status_due_idx')],
+            },
+        ),
+    ]
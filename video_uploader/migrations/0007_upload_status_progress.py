@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0006_upload_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='bytes_sent',
+            field=models.BigIntegerField(default=0, help_text='Bytes acknowledged by the platform'),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='resumable_uri',
+            field=models.CharField(blank=True, help_text='Open resumable upload session, if any', max_length=2048),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='throughput',
+            field=models.FloatField(default=0, help_text='Upload rate of the latest attempt in bytes per second'),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
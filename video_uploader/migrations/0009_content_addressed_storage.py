@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:21
+
+import django.db.models.deletion
+import video_uploader.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0008_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videopost',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='SHA-256 of the video file', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='videopost',
+            name='video_file',
+            field=models.FileField(blank=True, help_text='Required for YouTube uploads', null=True, storage=video_uploader.storage.get_video_storage, upload_to='videos/'),
+        ),
+        migrations.CreateModel(
+            name='ContentUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('external_id', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('platform', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='video_uploader.platform')),
+                ('video_post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='video_uploader.videopost')),
+            ],
+            options={
+                'unique_together': {('content_hash', 'platform')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('video_uploader', '0009_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserUploadStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='upload_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_posts', models.PositiveIntegerField(default=0)),
+                ('successful_uploads', models.PositiveIntegerField(default=0, help_text='Posts with at least one successful upload')),
+                ('failed_uploads', models.PositiveIntegerField(default=0, help_text='Posts with at least one failed upload')),
+                ('pending_uploads', models.PositiveIntegerField(default=0, help_text='Posts with at least one pending upload')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='videopost',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('success', 'Success'), ('failed', 'Failed'), ('partial', 'Partial Success')], default='pending', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='videopost',
+            name='status_flags',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='Bit set of the upload statuses present on this post'),
+        ),
+    ]
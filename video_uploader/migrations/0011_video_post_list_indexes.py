@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0010_denormalized_post_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(fields=['platform', 'video_post'], name='uploadstatus_platform_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videopost',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='videopost_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videopost',
+            index=models.Index(fields=['created_by', 'status', '-created_at', '-id'], name='videopost_owner_status_idx'),
+        ),
+    ]
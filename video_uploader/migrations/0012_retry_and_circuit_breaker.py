@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0011_video_post_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='platform',
+            name='circuit_failures',
+            field=models.PositiveIntegerField(default=0, help_text='Consecutive failed uploads'),
+        ),
+        migrations.AddField(
+            model_name='platform',
+            name='circuit_open_until',
+            field=models.DateTimeField(blank=True, help_text='No uploads are dispatched before this time', null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, help_text='When a failed upload is retried automatically', null=True),
+        ),
+    ]
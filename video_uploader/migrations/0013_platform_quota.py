@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0012_retry_and_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlatformQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('credential', models.CharField(blank=True, max_length=100)),
+                ('window_start', models.DateTimeField()),
+                ('units_used', models.PositiveIntegerField(default=0)),
+                ('exhausted_at', models.DateTimeField(blank=True, help_text='Set when the platform reported the quota as exceeded', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('platform', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quotas', to='video_uploader.platform')),
+            ],
+            options={
+                'unique_together': {('platform', 'credential', 'window_start')},
+            },
+        ),
+    ]
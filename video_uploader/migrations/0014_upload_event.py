@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:34
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0013_platform_quota'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('origin', models.CharField(help_text='Process that published the event', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_events', to=settings.AUTH_USER_MODEL)),
+                ('video_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='video_uploader.videopost')),
+            ],
+        ),
+    ]
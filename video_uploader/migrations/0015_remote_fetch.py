@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:37
+
+import django.db.models.deletion
+import video_uploader.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0014_upload_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videopost',
+            name='video_file',
+            field=models.FileField(blank=True, null=True, storage=video_uploader.storage.get_video_storage, upload_to='videos/'),
+        ),
+        migrations.AlterField(
+            model_name='videopost',
+            name='video_url',
+            field=models.URLField(blank=True, help_text='Alternative to a video file; fetched first for platforms that only take file uploads', max_length=2048, null=True),
+        ),
+        migrations.CreateModel(
+            name='RemoteFetch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2048)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('fetching', 'Fetching'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('total_bytes', models.BigIntegerField(blank=True, help_text='Unknown when the server sends no length', null=True)),
+                ('bytes_fetched', models.BigIntegerField(default=0)),
+                ('validator', models.CharField(blank=True, help_text='ETag or Last-Modified of the remote file', max_length=255)),
+                ('segments', models.JSONField(blank=True, default=list, help_text='[start, end, position] of each byte range')),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video_post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='remote_fetch', to='video_uploader.videopost')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0015_remote_fetch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(fields=['video_post', 'status'], name='uploadstatus_post_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(fields=['platform', 'status', 'next_retry_at'], name='uploadstatus_plat_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(fields=['status', 'next_retry_at'], name='uploadstatus_status_retry_idx'),
+        ),
+    ]
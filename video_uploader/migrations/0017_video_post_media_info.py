@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0016_upload_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videopost',
+            name='media_info',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Duration, resolution, codecs and layout probed from the video file'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0017_video_post_media_info'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, help_text='Scheduled start of the upload; cleared when PublishDispatcher releases it', null=True),
+        ),
+        migrations.AddField(
+            model_name='videopost',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, help_text='Uploads start no earlier than this; empty to upload right away', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(condition=models.Q(('publish_at__isnull', False)), fields=['publish_at'], name='uploadstatus_publish_at_idx'),
+        ),
+    ]
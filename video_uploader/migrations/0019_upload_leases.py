@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0018_scheduled_publishing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='An upload whose worker stops renewing this is recovered by LeaseReaper', null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadstatus',
+            name='leased_by',
+            field=models.CharField(blank=True, help_text='Worker process running the upload', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='uploadstatus',
+            index=models.Index(condition=models.Q(('status', 'uploading')), fields=['lease_expires_at'], name='uploadstatus_lease_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:08
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('video_uploader', '0019_upload_leases'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadShare',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='upload_share', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('weight', models.FloatField(default=1.0, help_text='Share of the upload workers relative to other users with queued uploads', validators=[django.core.validators.MinValueValidator(0.01)])),
+                ('max_running', models.PositiveIntegerField(blank=True, help_text='Most upload jobs running at once; empty for UPLOAD_FAIR_SHARE_MAX_RUNNING', null=True)),
+                ('last_finish_tag', models.FloatField(default=0, editable=False, help_text="Finish tag of the user's latest job")),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='start_tag',
+            field=models.FloatField(default=0, help_text='Virtual start time, the claim order under fair sharing; see services.fair_share'),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='upload_jobs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='uploadjob',
+            index=models.Index(fields=['status', 'start_tag'], name='uploadjob_status_tag_idx'),
+        ),
+    ]
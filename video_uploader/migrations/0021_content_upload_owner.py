@@ -0,0 +1,39 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_owners(apps, schema_editor):
+    ContentUpload = apps.get_model('video_uploader', 'ContentUpload')
+    VideoPost = apps.get_model('video_uploader', 'VideoPost')
+    owners = VideoPost.objects.filter(pk__in=ContentUpload.objects.values('video_post_id')).values_list('id', 'created_by_id')
+    for post_id, user_id in owners:
+        ContentUpload.objects.filter(video_post_id=post_id).update(created_by_id=user_id)
+    # Uploads whose post is gone can no longer be attributed to an account
+    ContentUpload.objects.filter(created_by__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('video_uploader', '0020_fair_share'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentupload',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='content_uploads', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_owners, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='contentupload',
+            name='created_by',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='content_uploads', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentupload',
+            unique_together={('content_hash', 'platform', 'created_by')},
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0021_content_upload_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadEventListener',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(max_length=100, unique=True)),
+                ('last_seen_at', models.DateTimeField()),
+            ],
+        ),
+    ]
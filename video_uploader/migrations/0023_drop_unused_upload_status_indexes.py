@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_uploader', '0022_upload_event_listener'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='uploadstatus',
+            name='uploadstatus_post_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='uploadstatus',
+            name='uploadstatus_plat_status_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='uploadstatus',
+            name='uploadstatus_status_retry_idx',
+        ),
+    ]
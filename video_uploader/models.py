@@ -1,6 +1,14 @@
+import uuid
+from urllib.parse import urlsplit
+
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .storage import ContentAddressedStorage, get_video_storage
 
 class Platform(models.Model):
     PLATFORMS = (
@@ -16,11 +24,56 @@ class Platform(models.Model):
     platform = models.CharField(choices=PLATFORMS, max_length=50, unique=True)
     api_endpoint = models.URLField(blank=True)
     is_active = models.BooleanField(default=True)
+    # Circuit breaker state, see services.retry.CircuitBreaker
+    circuit_failures = models.PositiveIntegerField(default=0, help_text='Consecutive failed uploads')
+    circuit_open_until = models.DateTimeField(null=True, blank=True, help_text='No uploads are dispatched before this time')
     
     def __str__(self):
         return self.platform
 
 
+def aggregate_status(statuses):
+    """Overall status of a post from the statuses of its platform uploads"""
+    statuses = list(statuses)
+    if all(status == 'success' for status in statuses):
+        return 'success'
+    elif any(status == 'failed' for status in statuses):
+        return 'partial' if any(status == 'success' for status in statuses) else 'failed'
+    elif any(status == 'uploading' for status in statuses):
+        return 'uploading'
+    return 'pending'
+
+
+class VideoPostQuerySet(models.QuerySet):
+    def with_overall_status(self):
+        """
+        Annotate ``computed_status`` with the same rules as
+        ``VideoPost.overall_status``, in one aggregate query instead of one
+        query per post.
+        """
+        def count(status=None):
+            condition = models.Q(upload_statuses__status=status) if status else None
+            # distinct keeps the counts right when another filter joins the same relation
+            return models.Count('upload_statuses', filter=condition, distinct=True)
+
+        return self.annotate(
+            status_total=count(),
+            status_success=count('success'),
+            status_failed=count('failed'),
+            status_uploading=count('uploading'),
+            status_pending=count('pending'),
+        ).annotate(
+            computed_status=models.Case(
+                models.When(status_total=models.F('status_success'), then=models.Value('success')),
+                models.When(status_failed__gt=0, status_success__gt=0, then=models.Value('partial')),
+                models.When(status_failed__gt=0, then=models.Value('failed')),
+                models.When(status_uploading__gt=0, then=models.Value('uploading')),
+                default=models.Value('pending'),
+                output_field=models.CharField(),
+            )
+        )
+
+
 class VideoPost(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -32,12 +85,40 @@ class VideoPost(models.Model):
     
     title = models.CharField(max_length=200)
     description = models.TextField()
-    video_file = models.FileField(upload_to='videos/', blank=True, null=True, help_text='Required for YouTube uploads')
-    video_url = models.URLField(blank=True, null=True, help_text="Alternative to video file, but not accepted for YouTube")
+    video_file = models.FileField(upload_to='videos/', storage=get_video_storage, blank=True, null=True)
+    video_url = models.URLField(max_length=2048, blank=True, null=True, help_text='Alternative to a video file; fetched first for platforms that only take file uploads')
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False, help_text='SHA-256 of the video file')
+    media_info = models.JSONField(default=dict, blank=True, editable=False, help_text='Duration, resolution, codecs and layout probed from the video file')
+    publish_at = models.DateTimeField(null=True, blank=True, help_text='Uploads start no earlier than this; empty to upload right away')
     platforms = models.ManyToManyField(Platform, through='UploadStatus')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Denormalized from upload_statuses by StatusTracker on every transition
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', editable=False)
+    status_flags = models.PositiveSmallIntegerField(
+        default=0, editable=False, help_text='Bit set of the upload statuses present on this post')
+
+    # Bits of status_flags
+    STATUS_FLAGS = {
+        'pending': 1,
+        'uploading': 2,
+        'success': 4,
+        'failed': 8,
+    }
+
+    # Platforms whose API only takes file uploads; a URL post is fetched
+    # into video_file before it is sent to them
+    FILE_ONLY_PLATFORMS = {'youtube'}
+
+    objects = VideoPostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's posts, optionally filtered by status
+            models.Index(fields=['created_by', '-created_at', '-id'], name='videopost_owner_created_idx'),
+            models.Index(fields=['created_by', 'status', '-created_at', '-id'], name='videopost_owner_status_idx'),
+        ]
 
     def clean(self):
         """
@@ -53,32 +134,53 @@ class VideoPost(models.Model):
     def save(self, *args, **kwargs):
         # Call full_clean to enforce basic validation
         self.full_clean()
+        # Store the file first so its content hash is known for this insert
+        if self.video_file and not self.video_file._committed:
+            self.video_file.save(self.video_file.name, self.video_file.file, save=False)
+        if self.video_file:
+            self.content_hash = ContentAddressedStorage.digest_from_name(self.video_file.name) or self.content_hash
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The denormalized status is owned by StatusTracker, a stale
+            # instance must not write it back
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('status', 'status_flags')
+            ]
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        # Validate platforms after save when id is available
-        platforms = self.platforms.all()
-        if any(platform.platform.lower() == 'youtube' for platform in platforms):
-            if not self.video_file:
-                raise ValidationError({
-                    'video_file': 'A video file is required for YouTube uploads.'
-                })
-            if self.video_url:
+        # Validate platforms after save when id is available; a new post has none yet
+        if not adding:
+            self.validate_platforms(self.platforms.all())
+
+    def validate_platforms(self, platforms):
+        """Rules that depend on the platforms the post is sent to"""
+        if any(self.requires_fetch(platform) for platform in platforms):
+            if urlsplit(self.video_url).scheme not in ('http', 'https'):
                 raise ValidationError({
-                    'video_url': 'YouTube API does not accept video URLs. Please provide a video file.'
+                    'video_url': 'Only http and https video URLs can be fetched for YouTube uploads.'
                 })
 
+    def requires_fetch(self, platform):
+        """Whether video_url has to be downloaded before uploading to ``platform``"""
+        return (
+            not self.video_file and bool(self.video_url)
+            and platform.platform.lower() in self.FILE_ONLY_PLATFORMS
+        )
+
     def __str__(self):
         return self.title
     
     @property
     def overall_status(self):
-        statuses = self.upload_statuses.values_list('status', flat=True)
-        if all(status == 'success' for status in statuses):
-            return 'success'
-        elif any(status == 'failed' for status in statuses):
-            return 'partial' if any(status == 'success' for status in statuses) else 'failed'
-        elif any(status == 'uploading' for status in statuses):
-            return 'uploading'
-        return 'pending'
+        # Set by VideoPost.objects.with_overall_status()
+        computed = getattr(self, 'computed_status', None)
+        if computed is not None:
+            return computed
+        if 'upload_statuses' in getattr(self, '_prefetched_objects_cache', {}):
+            statuses = [upload_status.status for upload_status in self.upload_statuses.all()]
+        else:
+            statuses = self.upload_statuses.values_list('status', flat=True)
+        return aggregate_status(statuses)
 
 
 class UploadStatus(models.Model):
@@ -95,9 +197,221 @@ class UploadStatus(models.Model):
     external_id = models.CharField(max_length=200, blank=True)
     error_message = models.TextField(blank=True)
     uploaded_at = models.DateTimeField(null=True, blank=True, auto_now_add=True)
+    resumable_uri = models.CharField(max_length=2048, blank=True, help_text='Open resumable upload session, if any')
+    bytes_sent = models.BigIntegerField(default=0, help_text='Bytes acknowledged by the platform')
+    total_bytes = models.BigIntegerField(default=0)
+    throughput = models.FloatField(default=0, help_text='Upload rate of the latest attempt in bytes per second')
+    attempts = models.PositiveIntegerField(default=0)
+    next_retry_at = models.DateTimeField(null=True, blank=True, help_text='When a failed upload is retried automatically')
+    publish_at = models.DateTimeField(
+        null=True, blank=True, help_text='Scheduled start of the upload; cleared when PublishDispatcher releases it')
+    leased_by = models.CharField(max_length=200, blank=True, help_text='Worker process running the upload')
+    lease_expires_at = models.DateTimeField(
+        null=True, blank=True, help_text='An upload whose worker stops renewing this is recovered by LeaseReaper')
     
     class Meta:
+        # A post's statuses (StatusTracker, retries, transitions) are read
+        # through the unique (video_post, platform) index; no query scans
+        # statuses across posts except the dispatcher and LeaseReaper, which
+        # have the partial indexes below
         unique_together = ['video_post', 'platform']
+        indexes = [
+            # Filtering posts by platform
+            models.Index(fields=['platform', 'video_post'], name='uploadstatus_platform_post_idx'),
+            # Scheduled uploads that are not released yet, in due order; only
+            # those rows are indexed, so the dispatcher's lookups stay small
+            models.Index(
+                fields=['publish_at'], name='uploadstatus_publish_at_idx',
+                condition=models.Q(publish_at__isnull=False),
+            ),
+            # Uploads in flight by lease expiry, for LeaseReaper
+            models.Index(
+                fields=['lease_expires_at'], name='uploadstatus_lease_idx',
+                condition=models.Q(status='uploading'),
+            ),
+        ]
     
     def __str__(self):
-        return f"{self.video_post.title} - {self.platform.platform} - {self.status}"
\ No newline at end of file
+        return f"{self.video_post.title} - {self.platform.platform} - {self.status}"
+
+
+class UploadShare(models.Model):
+    """A user's share of the upload workers, see services.fair_share"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='upload_share')
+    weight = models.FloatField(
+        default=1.0, validators=[MinValueValidator(0.01)],
+        help_text='Share of the upload workers relative to other users with queued uploads')
+    max_running = models.PositiveIntegerField(
+        null=True, blank=True, help_text='Most upload jobs running at once; empty for UPLOAD_FAIR_SHARE_MAX_RUNNING')
+    last_finish_tag = models.FloatField(default=0, editable=False, help_text="Finish tag of the user's latest job")
+
+    def __str__(self):
+        return f"Upload share of {self.user}"
+
+
+class UserUploadStats(models.Model):
+    """Per-user post counters, kept in step with VideoPost.status_flags"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='upload_stats')
+    total_posts = models.PositiveIntegerField(default=0)
+    successful_uploads = models.PositiveIntegerField(default=0, help_text='Posts with at least one successful upload')
+    failed_uploads = models.PositiveIntegerField(default=0, help_text='Posts with at least one failed upload')
+    pending_uploads = models.PositiveIntegerField(default=0, help_text='Posts with at least one pending upload')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Counter for each status flag that upload_stats reports
+    FLAG_COUNTERS = {
+        'success': 'successful_uploads',
+        'failed': 'failed_uploads',
+        'pending': 'pending_uploads',
+    }
+
+    def __str__(self):
+        return f"Upload stats for {self.user}"
+
+
+class ContentUpload(models.Model):
+    """A file, by content hash, that already exists on a user's account on a platform"""
+    content_hash = models.CharField(max_length=64)
+    platform = models.ForeignKey(Platform, on_delete=models.CASCADE)
+    # Uploads go to the owner's own channel, so only their posts may reuse it
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='content_uploads')
+    external_id = models.CharField(max_length=200)
+    video_post = models.ForeignKey(VideoPost, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['content_hash', 'platform', 'created_by']
+
+    def __str__(self):
+        return f"{self.content_hash[:12]} - {self.platform.platform} - {self.external_id}"
+
+
+class UploadJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    video_post = models.ForeignKey(VideoPost, on_delete=models.CASCADE, related_name='upload_jobs')
+    # The post's owner, whose fair share the job is scheduled in
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    start_tag = models.FloatField(default=0, help_text='Virtual start time, the claim order under fair sharing; see services.fair_share')
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Serves the worker claim query: queued jobs ordered by due time
+            models.Index(fields=['status', 'available_at'], name='uploadjob_status_due_idx'),
+            # Claim order under fair sharing, and the lowest tag still queued
+            models.Index(fields=['status', 'start_tag'], name='uploadjob_status_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} - {self.video_post.title} - {self.status}"
+
+
+
+class UploadSession(models.Model):
+    """Resumable, chunked ingest of a video file that becomes a VideoPost once complete"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    upload_length = models.BigIntegerField(help_text='Total size of the file in bytes')
+    offset = models.BigIntegerField(default=0, help_text='Bytes received so far')
+    metadata = models.JSONField(default=dict, blank=True, help_text='Video post fields applied on completion')
+    video_post = models.OneToOneField(
+        VideoPost, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_name(self):
+        return f'videos/{self.id}.part'
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.upload_length
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.upload_length})"
+
+
+class PlatformQuota(models.Model):
+    """
+    Quota units spent on a platform within one quota window.
+
+    ``credential`` is empty for the platform-wide (API project) ledger and the
+    uploading user's id for the per-credential ledger.
+    """
+    platform = models.ForeignKey(Platform, on_delete=models.CASCADE, related_name='quotas')
+    credential = models.CharField(max_length=100, blank=True)
+    window_start = models.DateTimeField()
+    units_used = models.PositiveIntegerField(default=0)
+    exhausted_at = models.DateTimeField(null=True, blank=True, help_text='Set when the platform reported the quota as exceeded')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['platform', 'credential', 'window_start']
+
+    def __str__(self):
+        return f"{self.platform.platform} {self.credential or '*'} {self.window_start:%Y-%m-%d %H:%M} - {self.units_used}"
+
+
+class UploadEvent(models.Model):
+    """Status and progress event of an upload, relayed from the workers to streaming clients"""
+    video_post = models.ForeignKey(VideoPost, on_delete=models.CASCADE, related_name='events')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_events')
+    kind = models.CharField(max_length=20)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    origin = models.CharField(max_length=100, help_text='Process that published the event')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Event {self.pk} - post {self.video_post_id} - {self.kind}"
+
+
+class UploadEventListener(models.Model):
+    """A server process with event subscribers; workers only record events while one was seen lately"""
+    origin = models.CharField(max_length=100, unique=True)
+    last_seen_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.origin} - {self.last_seen_at}"
+
+
+class RemoteFetch(models.Model):
+    """Download of a post's video_url into local storage, resumable per byte range"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('fetching', 'Fetching'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    video_post = models.OneToOneField(VideoPost, on_delete=models.CASCADE, related_name='remote_fetch')
+    url = models.URLField(max_length=2048)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_bytes = models.BigIntegerField(null=True, blank=True, help_text='Unknown when the server sends no length')
+    bytes_fetched = models.BigIntegerField(default=0)
+    validator = models.CharField(max_length=255, blank=True, help_text='ETag or Last-Modified of the remote file')
+    segments = models.JSONField(default=list, blank=True, help_text='[start, end, position] of each byte range')
+    content_hash = models.CharField(max_length=64, blank=True)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_name(self):
+        return f'videos/.fetch/{self.video_post_id}.part'
+
+    def __str__(self):
+        return f"{self.url} ({self.bytes_fetched}/{self.total_bytes or '?'})"
@@ -1,5 +1,11 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
-from .models import VideoPost, Platform, UploadStatus
+from .models import VideoPost, Platform, UploadStatus, UploadSession, aggregate_status
+from .services.media_probe import InvalidMedia, probe_file
+from .services.publishing import PublishDispatcher
+from .services.status_tracker import status_flags
+from .services.status_transitions import create_statuses
 
 
 class PlatformSerializer(serializers.ModelSerializer):
@@ -13,11 +19,15 @@ class UploadStatusSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = UploadStatus
-        fields = ['platform', 'status', 'external_id', 'uploaded_at', 'error_message']
+        fields = [
+            'platform', 'status', 'external_id', 'uploaded_at', 'error_message',
+            'bytes_sent', 'total_bytes', 'throughput', 'attempts', 'next_retry_at', 'publish_at'
+        ]
 
 
 class VideoPostSerializer(serializers.ModelSerializer):
     upload_statuses = UploadStatusSerializer(many=True, read_only=True)
+    overall_status = serializers.CharField(read_only=True)
     platform_ids = serializers.ListField(
         child=serializers.IntegerField(),
         write_only=True,
@@ -28,23 +38,101 @@ class VideoPostSerializer(serializers.ModelSerializer):
         model = VideoPost
         fields = [
             'id', 'title', 'description', 'video_file', 'video_url',
-            'created_at', 'updated_at', 'upload_statuses', 'platform_ids'
+            'created_at', 'updated_at', 'overall_status', 'upload_statuses', 'platform_ids', 'media_info',
+            'publish_at'
         ]
-        read_only_fields = ['created_at', 'updated_at', 'created_by']
+        read_only_fields = ['created_at', 'updated_at', 'created_by', 'media_info']
+    
+    def validate(self, attrs):
+        # Reject broken files now rather than after uploading them to every platform
+        video_file = attrs.get('video_file')
+        if video_file:
+            try:
+                attrs['media_info'] = probe_file(video_file.name, fileobj=video_file)
+            except InvalidMedia as e:
+                raise serializers.ValidationError({'video_file': str(e)})
+        return attrs
     
     def create(self, validated_data):
         platform_ids = validated_data.pop('platform_ids', [])
-        video_post = VideoPost.objects.create(
-            created_by=self.context['request'].user,
-            **validated_data
-        )
+        platforms = list(Platform.objects.filter(id__in=platform_ids)) if platform_ids else []
+        video_post = VideoPost(created_by=self.context['request'].user, **validated_data)
+        # Checked before the transaction, as bulk_create does, so a rejected
+        # post neither leaves rows behind nor breaks an enclosing atomic block
+        try:
+            video_post.validate_platforms(platforms)
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.message_dict)
+        return self._insert(video_post, platforms)
+
+    @transaction.atomic(savepoint=False)
+    def _insert(self, video_post, platforms):
+        if platforms:
+            # Every upload starts pending, so the post is inserted with its
+            # final aggregate and needs no StatusTracker pass, as in bulk_create
+            statuses = ['pending'] * len(platforms)
+            video_post.status = aggregate_status(statuses)
+            video_post.status_flags = status_flags(statuses)
+        video_post.save(force_insert=True)
         
-        if platform_ids:
-            platforms = Platform.objects.filter(id__in=platform_ids)
-            video_post.platforms.set(platforms)
+        if platforms:
+            # A post scheduled for later is queued by PublishDispatcher when due
+            scheduled = PublishDispatcher.scheduled_time(video_post.publish_at)
+            create_statuses(video_post, platforms, publish_at=scheduled)
             
-            # Trigger upload process
-            from .services.upload_manager import VideoUploadManager
-            VideoUploadManager.upload_to_platforms(video_post)
+            if scheduled:
+                PublishDispatcher.notify()
+            else:
+                # Queue the upload; a worker from run_upload_workers picks it up
+                from .services.job_queue import UploadJobQueue
+                UploadJobQueue.enqueue(video_post, new_post=True)
         
-        return video_post
\ No newline at end of file
+        return video_post
+    
+    def update(self, instance, validated_data):
+        reschedule = 'publish_at' in validated_data and validated_data['publish_at'] != instance.publish_at
+        instance = super().update(instance, validated_data)
+        if reschedule:
+            PublishDispatcher.reschedule(instance)
+        return instance
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(write_only=True, max_length=200)
+    description = serializers.CharField(write_only=True)
+    platform_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False
+    )
+    publish_at = serializers.DateTimeField(write_only=True, required=False, allow_null=True)
+    
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'upload_length', 'offset', 'video_post',
+            'created_at', 'title', 'description', 'platform_ids', 'publish_at'
+        ]
+        read_only_fields = ['offset', 'video_post', 'created_at']
+    
+    def validate_upload_length(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Upload length must be positive.')
+        return value
+    
+    def create(self, validated_data):
+        from .services.upload_sessions import UploadSessionManager
+        metadata = {
+            'title': validated_data.pop('title'),
+            'description': validated_data.pop('description'),
+            'platform_ids': validated_data.pop('platform_ids', []),
+        }
+        publish_at = validated_data.pop('publish_at', None)
+        if publish_at:
+            metadata['publish_at'] = publish_at.isoformat()
+        return UploadSessionManager.start(
+            self.context['request'].user,
+            validated_data['filename'],
+            validated_data['upload_length'],
+            metadata
+        )
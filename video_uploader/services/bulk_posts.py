@@ -0,0 +1,89 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Platform, UploadJob, UploadStatus, VideoPost, aggregate_status
+from .fair_share import FairShare
+from .publishing import PublishDispatcher
+from .status_tracker import apply_deltas, status_flags
+
+
+class BulkVideoPostCreator:
+    """
+    Create many video posts at once.
+
+    Every item is validated on its own; the valid ones are inserted, together
+    with their UploadStatus rows and upload jobs, with one ``bulk_create`` per
+    table in a single transaction. Invalid items are reported by index and do
+    not stop the rest of the batch.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def validate(self, items):
+        from ..serializers import VideoPostSerializer
+
+        platform_ids = {
+            platform_id
+            for item in items if isinstance(item, dict)
+            for platform_id in item.get('platform_ids') or [] if isinstance(platform_id, int)
+        }
+        platforms = Platform.objects.in_bulk(platform_ids)
+
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            serializer = VideoPostSerializer(data=item, context={'request': self.request})
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+
+            data = dict(serializer.validated_data)
+            selected = [platforms[pk] for pk in dict.fromkeys(data.pop('platform_ids', [])) if pk in platforms]
+            post = VideoPost(created_by=self.request.user, **data)
+            try:
+                # created_by comes from the request; skipping it avoids a lookup per item
+                post.full_clean(exclude=['created_by'])
+                post.validate_platforms(selected)
+            except ValidationError as e:
+                errors.append({'index': index, 'errors': e.message_dict})
+                continue
+            valid.append((index, post, selected))
+        return valid, errors
+
+    @transaction.atomic
+    def save(self, valid):
+        for _, post, selected in valid:
+            statuses = ['pending'] * len(selected)
+            post.status = aggregate_status(statuses)
+            post.status_flags = status_flags(statuses)
+
+        posts = VideoPost.objects.bulk_create([post for _, post, _ in valid])
+
+        # Posts scheduled for later get no job; PublishDispatcher queues them when due
+        now = timezone.now()
+        scheduled = {post.pk: PublishDispatcher.scheduled_time(post.publish_at, now) for post in posts}
+        UploadStatus.objects.bulk_create([
+            UploadStatus(video_post=post, platform=platform, status='pending', publish_at=scheduled[post.pk])
+            for post, (_, _, selected) in zip(posts, valid)
+            for platform in selected
+        ], ignore_conflicts=True)
+        UploadJob.objects.bulk_create(FairShare.tag([
+            UploadJob(video_post=post, user=self.request.user)
+            for post, (_, _, selected) in zip(posts, valid) if selected and not scheduled[post.pk]
+        ]))
+        if any(scheduled.values()):
+            PublishDispatcher.notify()
+
+        # bulk_create sends no signals, so account for the new posts here
+        apply_deltas(self.request.user.id, {
+            'total_posts': len(posts),
+            'pending_uploads': sum(1 for _, _, selected in valid if selected),
+        })
+        return posts
+
+    def run(self, items):
+        valid, errors = self.validate(items)
+        posts = self.save(valid) if valid else []
+        created = [{'index': index, 'id': post.id} for (index, _, _), post in zip(valid, posts)]
+        return created, errors
@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Hits, misses, expirations and evictions are counted; a cache with a
+    ``name`` also records them in the /metrics counters.
+    """
+
+    def __init__(self, maxsize, ttl, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self._record(metrics.CACHE_EVICTIONS, reason='expired')
+                entry = None
+            if entry is None:
+                self.misses += 1
+                self._record(metrics.CACHE_REQUESTS, result='miss')
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            self._record(metrics.CACHE_REQUESTS, result='hit')
+            return entry[0]
+
+    def _record(self, counter, **labels):
+        if self.name:
+            counter.inc(cache=self.name, **labels)
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                self._record(metrics.CACHE_EVICTIONS, reason='evicted')
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,256 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ..models import UploadEvent, UploadEventListener, UploadStatus
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = [
+    'status', 'external_id', 'error_message', 'bytes_sent', 'total_bytes',
+    'throughput', 'attempts', 'next_retry_at',
+]
+
+
+def current_origin():
+    # Computed per call: worker processes are forked after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def topics(user_id, video_post_id):
+    return [f'user:{user_id}', f'post:{video_post_id}']
+
+
+class Subscription:
+    """
+    Bounded event buffer of one consumer. A consumer that falls behind loses
+    the oldest events and is told how many through ``dropped``.
+    """
+
+    def __init__(self, topics, loop, maxsize):
+        self.topics = topics
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def offer(self, message):
+        # Runs on the subscriber's event loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class EventBroker:
+    """
+    In-process pub/sub of upload events.
+
+    Publishers may run on any thread; each subscriber gets the event on its
+    own event loop. Events published by other processes, i.e. the upload
+    workers, are read from UploadEvent by a relay task that runs while this
+    process has subscribers, so one DB poll per process replaces a poll per
+    client.
+    """
+
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._relay = None
+
+    def subscribe(self, topics, maxsize=None):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(topics, loop, maxsize or settings.UPLOAD_EVENTS_BUFFER_SIZE)
+        with self._lock:
+            for topic in topics:
+                self._subscriptions.setdefault(topic, set()).add(subscription)
+            if self._relay is None or self._relay.done():
+                self._relay = loop.create_task(self._run_relay())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscriptions.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[topic]
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscriptions)
+
+    def publish(self, topics, message):
+        with self._lock:
+            subscriptions = {
+                subscription
+                for topic in topics
+                for subscription in self._subscriptions.get(topic, ())
+            }
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+    @staticmethod
+    def _fetch(after_id, limit=500):
+        return list(UploadEvent.objects.filter(id__gt=after_id).order_by('id')[:limit])
+
+    async def _run_relay(self):
+        last_id = await sync_to_async(
+            lambda: UploadEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        )()
+        loop = asyncio.get_running_loop()
+        next_prune = next_mark = loop.time()
+        while self.has_subscribers():
+            try:
+                if loop.time() >= next_mark:
+                    # Tell the workers someone is listening
+                    await sync_to_async(presence.mark)()
+                    next_mark = loop.time() + settings.UPLOAD_EVENTS_HEARTBEAT
+            except Exception:
+                logger.exception("Could not record upload event listener")
+            await asyncio.sleep(settings.UPLOAD_EVENTS_RELAY_INTERVAL)
+            try:
+                events = await sync_to_async(self._fetch)(last_id)
+                if loop.time() >= next_prune:
+                    await sync_to_async(prune)()
+                    next_prune = loop.time() + self.PRUNE_INTERVAL
+            except Exception:
+                logger.exception("Upload event relay failed")
+                continue
+            origin = current_origin()
+            for event in events:
+                last_id = event.id
+                # Events from this process were already delivered by publish()
+                if event.origin != origin:
+                    self.publish(topics(event.user_id, event.video_post_id), message(event))
+
+
+broker = EventBroker()
+
+
+class ListenerPresence:
+    """
+    Whether any server process has event subscribers, so that workers only
+    write events someone may read. Server processes with subscribers mark
+    themselves in UploadEventListener every UPLOAD_EVENTS_HEARTBEAT seconds;
+    other processes read the latest mark at most that often.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_seen = None
+        self._checked_at = None
+
+    def mark(self):
+        UploadEventListener.objects.update_or_create(
+            origin=current_origin(), defaults={'last_seen_at': timezone.now()})
+
+    def last_seen(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < settings.UPLOAD_EVENTS_HEARTBEAT:
+                return self._last_seen
+        last_seen = UploadEventListener.objects.aggregate(last_seen=Max('last_seen_at'))['last_seen']
+        with self._lock:
+            self._last_seen, self._checked_at = last_seen, now
+        return last_seen
+
+    def active_within(self, seconds):
+        """Whether a subscriber was connected, here or in another process, in the last ``seconds``"""
+        if broker.has_subscribers():
+            return True
+        last_seen = self.last_seen()
+        return last_seen is not None and last_seen >= timezone.now() - datetime.timedelta(seconds=seconds)
+
+
+presence = ListenerPresence()
+
+
+def prune(now=None):
+    """Delete events past UPLOAD_EVENTS_RETENTION and the marks of listeners gone since"""
+    cutoff = (now or timezone.now()) - datetime.timedelta(seconds=settings.UPLOAD_EVENTS_RETENTION)
+    UploadEvent.objects.filter(created_at__lt=cutoff).delete()
+    UploadEventListener.objects.filter(last_seen_at__lt=cutoff).delete()
+
+
+def message(event):
+    return {'id': event.id, 'event': event.kind, 'data': event.payload}
+
+
+def history(after_id, **filters):
+    """Stored events after ``after_id``, for clients resuming with Last-Event-ID"""
+    return [
+        message(event)
+        for event in UploadEvent.objects.filter(id__gt=after_id, **filters).order_by('id')
+    ]
+
+
+def emit(kind, video_post_id, user_id, payload):
+    """Store an upload event and deliver it to this process's subscribers once committed"""
+    if not settings.UPLOAD_EVENTS_ENABLED:
+        return
+    try:
+        event = UploadEvent.objects.create(
+            kind=kind, video_post_id=video_post_id, user_id=user_id,
+            payload=payload, origin=current_origin(),
+        )
+    except Exception:
+        # Events are best effort and must never fail an upload
+        logger.exception("Could not record %s event for post %s", kind, video_post_id)
+        return
+    transaction.on_commit(lambda: broker.publish(topics(user_id, video_post_id), message(event)))
+
+
+def publish_status(video_post_id, platform_id):
+    """
+    Emit the current state of one platform upload of a post. Only recorded
+    while a client may still resume with Last-Event-ID, i.e. a subscriber was
+    connected within UPLOAD_EVENTS_RETENTION.
+    """
+    if not (settings.UPLOAD_EVENTS_ENABLED and presence.active_within(settings.UPLOAD_EVENTS_RETENTION)):
+        return
+    row = UploadStatus.objects.filter(video_post_id=video_post_id, platform_id=platform_id).values(
+        *STATUS_FIELDS, 'platform__platform', 'video_post__status', 'video_post__created_by_id'
+    ).first()
+    if row is None:
+        return
+    payload = {field: row[field] for field in STATUS_FIELDS}
+    payload.update({
+        'post': video_post_id,
+        'platform': row['platform__platform'],
+        'overall_status': row['video_post__status'],
+    })
+    emit('status', video_post_id, row['video_post__created_by_id'], payload)
+
+
+def publish_progress(upload_status):
+    """Emit the byte progress of an upload in flight, if a subscriber is connected"""
+    if not (settings.UPLOAD_EVENTS_ENABLED and presence.active_within(3 * settings.UPLOAD_EVENTS_HEARTBEAT)):
+        return
+    video_post = upload_status.video_post
+    emit('progress', video_post.id, video_post.created_by_id, {
+        'post': video_post.id,
+        'platform': upload_status.platform.platform,
+        'bytes_sent': upload_status.bytes_sent,
+        'total_bytes': upload_status.total_bytes,
+        'throughput': upload_status.throughput,
+    })
@@ -0,0 +1,74 @@
+"""
+Weighted fair queuing of upload jobs between users (start-time fair queuing).
+
+Every job gets a virtual start tag when it is queued::
+
+    start = max(V, finish of the user's previous job)
+    finish = start + 1 / weight of the user
+
+where V is the lowest start tag of the due queued jobs. Jobs parked for later,
+by a retry backoff or a publish time, do not hold V back. Workers claim due jobs in start
+tag order, so every user with queued work gets a share of the workers
+proportional to their weight, however many jobs they queue: the 1000th job of
+a bulk post starts behind the first job of every other user. A user who was
+idle starts at V and cannot save up credit.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from ..models import UploadJob, UploadShare
+
+
+class FairShare:
+    @staticmethod
+    def tag(jobs):
+        """Set ``start_tag`` on unsaved UploadJobs, in order, from the ``user_id`` each is set to"""
+        if not jobs:
+            return jobs
+        with transaction.atomic(savepoint=False):
+            # A parked job's old tag would let new jobs start far behind the backlog
+            virtual_time = UploadJob.objects.filter(status='queued', available_at__lte=timezone.now()).aggregate(
+                virtual_time=Min('start_tag'))['virtual_time'] or 0
+            user_ids = {job.user_id for job in jobs if job.user_id}
+            shares = UploadShare.objects.select_for_update().in_bulk(user_ids)
+            # First jobs of a user get the default share
+            missing = [UploadShare(user_id=user_id) for user_id in user_ids - set(shares)]
+            if missing:
+                UploadShare.objects.bulk_create(missing, ignore_conflicts=True)
+                shares.update((share.user_id, share) for share in missing)
+
+            for job in jobs:
+                share = shares.get(job.user_id)
+                if share is None:
+                    job.start_tag = virtual_time
+                    continue
+                job.start_tag = max(virtual_time, share.last_finish_tag)
+                share.last_finish_tag = job.start_tag + 1 / share.weight
+            if shares:
+                UploadShare.objects.bulk_update(shares.values(), ['last_finish_tag'])
+        return jobs
+
+    @staticmethod
+    def capped_users():
+        """
+        Users running as many jobs as their cap allows. Workers claiming at
+        the same moment can each start one more, so a cap may briefly be
+        exceeded by the number of workers.
+        """
+        running = dict(
+            UploadJob.objects.filter(status='running', user__isnull=False)
+            .values_list('user_id').annotate(running=Count('id')).order_by()
+        )
+        if not running:
+            return set()
+        caps = dict(UploadShare.objects.filter(user_id__in=running).values_list('user_id', 'max_running'))
+        capped = set()
+        for user_id, count in running.items():
+            cap = caps.get(user_id)
+            if cap is None:
+                cap = settings.UPLOAD_FAIR_SHARE_MAX_RUNNING
+            if cap is not None and count >= cap:
+                capped.add(user_id)
+        return capped
@@ -0,0 +1,42 @@
+import random
+import threading
+import time
+import uuid
+
+from .platform_services import BasePlatformService
+
+
+class FakePlatformService(BasePlatformService):
+    """
+    Stand-in platform for benchmarks and tests. Each upload takes ``latency``
+    seconds plus the video size over ``bandwidth`` (bytes per second), and
+    fails with probability ``failure_rate``.
+    """
+
+    def __init__(self, name, latency=0.05, failure_rate=0.0, bandwidth=None, video_size=0, seed=None):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bandwidth = bandwidth
+        self.video_size = video_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def upload_video(self, video_post, platform, upload_status=None):
+        size = video_post.video_file.size if video_post.video_file else self.video_size
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            return {
+                'success': False,
+                'error': f'Simulated {self.name} failure'
+            }
+        return {
+            'success': True,
+            'external_id': f'{self.name}_{uuid.uuid4().hex[:12]}',
+            'message': f'Uploaded to fake {self.name}'
+        }
@@ -0,0 +1,168 @@
+import logging
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import UploadJob, VideoPost
+from . import events, metrics
+from .fair_share import FairShare
+from .leases import LeaseReaper, keeper
+
+logger = logging.getLogger(__name__)
+
+
+class UploadJobQueue:
+    """Durable upload queue backed by the UploadJob table.
+
+    Jobs are claimed with a conditional UPDATE on ``status='queued'``, so two
+    workers racing for the same row can never both win. This works the same
+    way on SQLite and PostgreSQL and needs no external broker. Due jobs are
+    claimed in FairShare order, skipping users at their concurrency cap.
+    """
+
+    CLAIM_BATCH_SIZE = 10
+
+    @staticmethod
+    def enqueue(video_post, available_at=None, new_post=False):
+        """
+        Queue an upload for a video post, reusing an already queued job.
+        ``new_post`` skips that lookup for a post that cannot have a job yet.
+        """
+        available_at = available_at or timezone.now()
+        job = None if new_post else UploadJob.objects.filter(video_post=video_post, status='queued').first()
+        if job:
+            # An earlier request to run wins, e.g. a manual retry before a scheduled one
+            if job.available_at > available_at:
+                UploadJob.objects.filter(pk=job.pk).update(available_at=available_at)
+                job.available_at = available_at
+            return job
+        job = UploadJob(video_post=video_post, user_id=video_post.created_by_id, available_at=available_at)
+        FairShare.tag([job])
+        job.save()
+        return job
+
+    @staticmethod
+    def enqueue_many(video_post_ids, available_at=None):
+        """Queue uploads for many posts with a fixed number of queries, reusing queued jobs"""
+        video_post_ids = set(video_post_ids)
+        if not video_post_ids:
+            return
+        available_at = available_at or timezone.now()
+        queued = set(
+            UploadJob.objects.filter(video_post_id__in=video_post_ids, status='queued')
+            .values_list('video_post_id', flat=True)
+        )
+        if queued:
+            UploadJob.objects.filter(
+                video_post_id__in=queued, status='queued', available_at__gt=available_at
+            ).update(available_at=available_at)
+        owners = VideoPost.objects.filter(pk__in=video_post_ids - queued).values_list('id', 'created_by_id')
+        UploadJob.objects.bulk_create(FairShare.tag([
+            UploadJob(video_post_id=post_id, user_id=user_id, available_at=available_at)
+            for post_id, user_id in sorted(owners)
+        ]))
+
+    @classmethod
+    def claim(cls, worker_id):
+        """Atomically claim the next due job for ``worker_id`` or return None"""
+        now = timezone.now()
+        candidates = list(
+            UploadJob.objects.filter(status='queued', available_at__lte=now)
+            .exclude(user_id__in=FairShare.capped_users())
+            .order_by('start_tag', 'id')
+            .values_list('id', flat=True)[:cls.CLAIM_BATCH_SIZE]
+        )
+        for job_id in candidates:
+            claimed = UploadJob.objects.filter(pk=job_id, status='queued').update(
+                status='running',
+                locked_by=worker_id,
+                locked_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                job = UploadJob.objects.select_related('video_post__created_by').get(pk=job_id)
+                metrics.QUEUE_WAIT.observe(max((now - job.available_at).total_seconds(), 0))
+                return job
+        return None
+
+    @classmethod
+    def complete(cls, job):
+        return cls._finish(job, status='done')
+
+    @classmethod
+    def fail(cls, job, error):
+        return cls._finish(job, status='failed', last_error=error)
+
+    @staticmethod
+    def _finish(job, **fields):
+        """
+        Record the end of a job while this worker's claim still stands. A job
+        LeaseReaper re-queued from a stalled worker, and maybe another worker
+        claimed since, is left alone. ``attempts`` tells the claims apart.
+        """
+        updated = UploadJob.objects.filter(
+            pk=job.pk, status='running', locked_by=job.locked_by, attempts=job.attempts,
+        ).update(finished_at=timezone.now(), **fields)
+        if not updated:
+            logger.warning("Dropped the %s result of job %s: its claim was lost", fields['status'], job.pk)
+        return bool(updated)
+
+    @classmethod
+    def process(cls, job):
+        """Run the platform uploads for a claimed job"""
+        from .retry import RetryScheduler
+        from .upload_manager import VideoUploadManager
+
+        try:
+            # The heartbeat keeps locked_at fresh so LeaseReaper leaves the job alone
+            with keeper.hold_job(job):
+                VideoUploadManager.upload_to_platforms(job.video_post)
+                RetryScheduler.schedule(job.video_post)
+        except Exception as e:
+            logger.exception("Upload job %s failed", job.pk)
+            if cls.fail(job, str(e)):
+                metrics.JOBS.inc(outcome='failed')
+        else:
+            if cls.complete(job):
+                metrics.JOBS.inc(outcome='done')
+
+
+def default_worker_id(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def run_worker(worker_id, stop_event=None, poll_interval=None):
+    """Claim and process jobs until ``stop_event`` is set"""
+    if poll_interval is None:
+        poll_interval = settings.UPLOAD_WORKER_POLL_INTERVAL
+
+    logger.info("Upload worker %s started", worker_id)
+    next_reap = next_prune = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        metrics.registry.flush()
+        if time.monotonic() >= next_reap:
+            # Every worker looks for uploads of crashed workers; the reaper's
+            # conditional updates make concurrent runs safe
+            LeaseReaper.reap()
+            next_reap = time.monotonic() + settings.UPLOAD_REAP_INTERVAL
+        if time.monotonic() >= next_prune:
+            # Old events go even while no client streams them
+            events.prune()
+            next_prune = time.monotonic() + events.EventBroker.PRUNE_INTERVAL
+        job = UploadJobQueue.claim(worker_id)
+        if job is None:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        logger.info("Worker %s processing job %s (post %s)", worker_id, job.pk, job.video_post_id)
+        UploadJobQueue.process(job)
+    metrics.registry.flush(force=True)
+    logger.info("Upload worker %s stopped", worker_id)
@@ -0,0 +1,232 @@
+"""
+Leases on uploads in flight.
+
+Claiming an upload leases its UploadStatus row to the worker process for
+UPLOAD_LEASE_SECONDS. A heartbeat thread renews the leases of every upload
+the process is running, in one UPDATE. When a process dies its leases run
+out, and LeaseReaper puts those uploads back in the queue, where they resume
+from the stored session, or fails them once they have used up their attempts.
+
+An upload that timed out keeps the lease while its thread is still running,
+so it is not claimed again, and sent twice, until that thread has stopped.
+
+The same heartbeat refreshes UploadJob.locked_at of the jobs the process is
+running. A job whose worker died outside any upload lease, e.g. while
+fetching the video, stops being refreshed and LeaseReaper re-queues it.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import UploadJob, UploadStatus
+from . import metrics
+from .events import publish_status
+from .retry import RetryPolicy
+from .status_tracker import StatusTracker
+
+logger = logging.getLogger(__name__)
+
+
+def lease_owner():
+    # Computed per call: worker processes are forked after import
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_expiry(now=None):
+    return (now or timezone.now()) + datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS)
+
+
+def unleased_filter(now=None):
+    """Uploads no live worker holds a lease on, which may be claimed"""
+    return Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now or timezone.now())
+
+
+class LeaseKeeper:
+    """Renews the leases of the uploads, and the locks of the jobs, running in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}
+        self._jobs = {}
+        self._thread = None
+        self._pid = None
+
+    def hold(self, upload_status):
+        """Keep ``upload_status``'s lease alive while the block runs"""
+        return self._holding(self._held, upload_status.pk)
+
+    def hold_job(self, job):
+        """Keep ``job``'s locked_at fresh while the block runs"""
+        return self._holding(self._jobs, job.pk)
+
+    @contextmanager
+    def _holding(self, held, pk):
+        with self._lock:
+            held[pk] = held.get(pk, 0) + 1
+            # A forked worker does not inherit the parent's thread
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='upload-lease-keeper', daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                held[pk] -= 1
+                if not held[pk]:
+                    del held[pk]
+
+    def renew(self):
+        """Extend every held lease and job lock; returns the number of rows renewed"""
+        with self._lock:
+            held, jobs = list(self._held), list(self._jobs)
+        now = timezone.now()
+        renewed = 0
+        if held:
+            # Whatever the row's status: a timed-out upload still holds its lease
+            renewed += UploadStatus.objects.filter(
+                pk__in=held, leased_by=lease_owner(), lease_expires_at__isnull=False
+            ).update(lease_expires_at=lease_expiry(now))
+        if jobs:
+            renewed += UploadJob.objects.filter(
+                pk__in=jobs, status='running', locked_by__startswith=f'{lease_owner()}:'
+            ).update(locked_at=now)
+        return renewed
+
+    def _run(self):
+        try:
+            while True:
+                time.sleep(settings.UPLOAD_LEASE_SECONDS / 3)
+                try:
+                    self.renew()
+                except Exception:
+                    logger.exception("Could not renew upload leases")
+        finally:
+            connection.close()
+
+
+keeper = LeaseKeeper()
+
+
+class LeaseReaper:
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def expired_filter(now=None):
+        """Uploads whose worker stopped renewing the lease; rows from before leases have none"""
+        now = now or timezone.now()
+        return Q(status='uploading') & (Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True))
+
+    @staticmethod
+    def stale_jobs_filter(now=None):
+        """Running jobs whose worker stopped refreshing locked_at"""
+        cutoff = (now or timezone.now()) - datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS)
+        return Q(status='running') & (Q(locked_at__lt=cutoff) | Q(locked_at__isnull=True))
+
+    @classmethod
+    def reap(cls, now=None):
+        """
+        Recover uploads with expired leases: back to pending and queued while
+        they have attempts left, failed otherwise. Returns (requeued, failed).
+        Stale running jobs are recovered as well, see reap_jobs.
+        """
+        now = now or timezone.now()
+        recovered = cls._reap_uploads(now)
+        cls.reap_jobs(now)
+        return recovered
+
+    @classmethod
+    def reap_jobs(cls, now=None):
+        """
+        Recover running jobs whose worker died, whatever their uploads' state:
+        queued again while they have attempts left and no other job is queued
+        for the post, failed otherwise. Returns (requeued, failed).
+        """
+        now = now or timezone.now()
+        stale = list(
+            UploadJob.objects.filter(cls.stale_jobs_filter(now))
+            .values_list('id', 'video_post_id', 'attempts')[:cls.BATCH_SIZE]
+        )
+        if not stale:
+            return 0, 0
+
+        max_attempts = RetryPolicy.max_attempts()
+        queued = set(
+            UploadJob.objects.filter(video_post_id__in={post_id for _, post_id, _ in stale}, status='queued')
+            .values_list('video_post_id', flat=True)
+        )
+        resume, give_up = [], []
+        for pk, post_id, attempts in stale:
+            if attempts < max_attempts and post_id not in queued:
+                resume.append(pk)
+                queued.add(post_id)
+            else:
+                give_up.append(pk)
+        with transaction.atomic():
+            # A worker that refreshed the lock meanwhile keeps the job
+            rows = UploadJob.objects.filter(cls.stale_jobs_filter(now))
+            requeued = rows.filter(pk__in=resume).update(
+                status='queued', available_at=now, locked_by='', locked_at=None,
+                last_error='Worker stopped responding')
+            failed = rows.filter(pk__in=give_up).update(
+                status='failed', last_error='Worker stopped responding', finished_at=now)
+        if requeued or failed:
+            logger.warning("Recovered %d stalled job(s), failed %d", requeued, failed)
+        return requeued, failed
+
+    @classmethod
+    def _reap_uploads(cls, now):
+        from .job_queue import UploadJobQueue
+
+        expired = list(
+            UploadStatus.objects.filter(cls.expired_filter(now))
+            .values('id', 'video_post_id', 'platform_id', 'platform__platform', 'attempts', 'leased_by')
+            [:cls.BATCH_SIZE]
+        )
+        if not expired:
+            return 0, 0
+
+        max_attempts = RetryPolicy.max_attempts()
+        for row in expired:
+            row['resume'] = row['attempts'] < max_attempts
+        post_ids = {row['video_post_id'] for row in expired}
+        lease_fields = {'leased_by': '', 'lease_expires_at': None, 'next_retry_at': None}
+        with transaction.atomic():
+            # A worker that renewed its lease meanwhile keeps the upload
+            rows = UploadStatus.objects.filter(cls.expired_filter(now))
+            requeued = rows.filter(pk__in=[row['id'] for row in expired if row['resume']]).update(
+                status='pending', error_message='Upload interrupted, its worker stopped responding',
+                **lease_fields)
+            failed = rows.filter(pk__in=[row['id'] for row in expired if not row['resume']]).update(
+                status='failed', error_message='Upload interrupted too many times, its worker stopped responding',
+                **lease_fields)
+            for post_id in post_ids:
+                StatusTracker.sync_post(post_id)
+            UploadJobQueue.enqueue_many(
+                {row['video_post_id'] for row in expired if row['resume']}, available_at=now)
+
+            # Jobs that were running in the dead processes will never finish
+            owners = {row['leased_by'] for row in expired if row['leased_by']}
+            if owners:
+                stale = Q()
+                for owner in owners:
+                    stale |= Q(locked_by__startswith=f'{owner}:')
+                UploadJob.objects.filter(stale, status='running', video_post_id__in=post_ids).update(
+                    status='failed', last_error='Worker stopped responding', finished_at=now)
+
+        for row in expired:
+            publish_status(row['video_post_id'], row['platform_id'])
+            metrics.OUTCOMES.inc(
+                platform=row['platform__platform'], outcome='requeued' if row['resume'] else 'failed',
+                error_class='lease_expired')
+        logger.warning("Recovered %d stalled upload(s), failed %d", requeued, failed)
+        return requeued, failed
@@ -0,0 +1,32 @@
+import threading
+from contextlib import contextmanager
+
+
+class KeyedLock:
+    """
+    One lock per key, e.g. per post or per user. A key's lock only exists
+    while a thread holds or waits for it, so the table stays as small as
+    the work in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @contextmanager
+    def __call__(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
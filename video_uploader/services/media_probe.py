@@ -0,0 +1,300 @@
+"""
+Pure-Python probe of ISO base media files (MP4, MOV, M4V, 3GP).
+
+The file is memory-mapped and only the box headers on the way to ``moov``
+and the few boxes inside it that describe the tracks are read, so probing a
+multi-gigabyte file touches a handful of pages.
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+from django.db import transaction
+from django.utils import timezone
+
+ISO_BMFF_EXTENSIONS = {'.mp4', '.m4v', '.mov', '.3gp', '.3g2'}
+# Box types that may open an ISO base media file
+TOP_LEVEL_TYPES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'moof', b'styp', b'uuid'}
+# Boxes between moov and the chunk offset tables
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class InvalidMedia(Exception):
+    """The file is not a complete, readable video container"""
+
+
+def _boxes(buf, start, end):
+    """(type, box start, payload start, box end) of each box in buf[start:end]"""
+    offset = start
+    while offset < end:
+        if end - offset < 8:
+            raise InvalidMedia(f'Truncated box header at byte {offset}')
+        size, kind = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            if end - offset < 16:
+                raise InvalidMedia(f'Truncated box header at byte {offset}')
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            # Extends to the end of the enclosing box or file
+            size = end - offset
+        if size < header:
+            raise InvalidMedia(f'Invalid size of {kind!r} box at byte {offset}')
+        if offset + size > end:
+            raise InvalidMedia(f'{kind.decode("latin-1")} box at byte {offset} is truncated')
+        yield kind, offset, offset + header, offset + size
+        offset += size
+
+
+def _child(buf, start, end, kind):
+    for child_kind, _, payload, child_end in _boxes(buf, start, end):
+        if child_kind == kind:
+            return payload, child_end
+    return None
+
+
+def _fixed_16_16(value):
+    return round(value / 65536)
+
+
+def _track(buf, start, end):
+    """Handler type, width, height and codec of the trak box in buf[start:end]"""
+    info = {}
+    tkhd = _child(buf, start, end, b'tkhd')
+    if tkhd:
+        payload, _ = tkhd
+        version = buf[payload]
+        # version/flags, times, track id, reserved, duration, reserved, layer,
+        # alternate group, volume, reserved, matrix; then width and height
+        offset = payload + (4 + 8 + 8 + 4 + 4 + 8 if version == 1 else 4 + 4 + 4 + 4 + 4 + 4) + 8 + 8 + 36
+        width, height = struct.unpack_from('>II', buf, offset)
+        info['width'], info['height'] = _fixed_16_16(width), _fixed_16_16(height)
+
+    mdia = _child(buf, start, end, b'mdia')
+    if mdia:
+        hdlr = _child(buf, *mdia, b'hdlr')
+        if hdlr:
+            info['handler'] = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+        minf = _child(buf, *mdia, b'minf')
+        stbl = minf and _child(buf, *minf, b'stbl')
+        stsd = stbl and _child(buf, *stbl, b'stsd')
+        if stsd and stsd[1] - stsd[0] >= 16:
+            # version/flags, entry count, then the first sample entry's header
+            info['codec'] = bytes(buf[stsd[0] + 12:stsd[0] + 16]).decode('latin-1').strip()
+    return info
+
+
+def probe_buffer(buf):
+    """Metadata of the ISO base media file in ``buf`` (bytes or mmap)"""
+    try:
+        return _probe(buf)
+    except struct.error:
+        raise InvalidMedia('A box is shorter than its contents require')
+
+
+def _probe(buf):
+    size = len(buf)
+    if size < 8:
+        raise InvalidMedia('The file is empty or too short to be a video')
+    if buf[4:8] not in TOP_LEVEL_TYPES:
+        raise InvalidMedia('Not an MP4/MOV file')
+
+    info = {'container': 'iso-bmff', 'size': size, 'brand': '', 'faststart': False}
+    moov = None
+    media_seen = False
+    for kind, _, payload, end in _boxes(buf, 0, size):
+        if kind == b'ftyp' and end - payload >= 4:
+            info['brand'] = bytes(buf[payload:payload + 4]).decode('latin-1').strip()
+        elif kind == b'moov' and moov is None:
+            moov = (payload, end)
+            info['faststart'] = not media_seen
+        elif kind in (b'mdat', b'moof'):
+            media_seen = True
+    if moov is None:
+        raise InvalidMedia('The file has no moov box; it is truncated or not finished')
+    if not media_seen:
+        raise InvalidMedia('The file has no media data')
+
+    mvhd = _child(buf, *moov, b'mvhd')
+    if mvhd is None:
+        raise InvalidMedia('The moov box has no movie header')
+    payload = mvhd[0]
+    if buf[payload] == 1:
+        timescale, duration = struct.unpack_from('>IQ', buf, payload + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', buf, payload + 12)
+    info['duration'] = round(duration / timescale, 3) if timescale else None
+
+    tracks = [_track(buf, start, end) for kind, _, start, end in _boxes(buf, *moov) if kind == b'trak']
+    info['tracks'] = len(tracks)
+    video = next((track for track in tracks if track.get('handler') == b'vide'), None)
+    audio = next((track for track in tracks if track.get('handler') == b'soun'), None)
+    if video:
+        info['width'] = video.get('width')
+        info['height'] = video.get('height')
+        info['video_codec'] = video.get('codec', '')
+    if audio:
+        info['audio_codec'] = audio.get('codec', '')
+    return info
+
+
+def probe_path(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise InvalidMedia('The file is empty')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return probe_buffer(mapped)
+
+
+def probe_file(name, fileobj=None, path=None):
+    """
+    Metadata of a video file, or ``{'container': 'other'}`` for containers
+    other than ISO base media. Raises InvalidMedia for broken MP4/MOV files.
+    """
+    if os.path.splitext(name or '')[1].lower() not in ISO_BMFF_EXTENSIONS:
+        return {'container': 'other'}
+    if path is None and hasattr(fileobj, 'temporary_file_path'):
+        path = fileobj.temporary_file_path()
+    if path is not None:
+        return probe_path(path)
+    # Small uploads are held in memory by Django
+    fileobj.seek(0)
+    try:
+        return probe_buffer(fileobj.read())
+    finally:
+        fileobj.seek(0)
+
+
+def _box_header(kind, payload_size):
+    size = payload_size + 8
+    if size > 0xFFFFFFFF:
+        return struct.pack('>I4sQ', 1, kind, payload_size + 16)
+    return struct.pack('>I4s', size, kind)
+
+
+def _rebuild_moov(buf, start, end, shift):
+    """Children of buf[start:end] with chunk offsets passed through ``shift``"""
+    parts = []
+    for kind, box_start, payload, box_end in _boxes(buf, start, end):
+        if kind in CONTAINERS:
+            body = _rebuild_moov(buf, payload, box_end, shift)
+            parts.append(_box_header(kind, len(body)) + body)
+        elif kind in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', buf, payload + 4)[0]
+            code = 'I' if kind == b'stco' else 'Q'
+            offsets = [shift(value) for value in struct.unpack_from(f'>{count}{code}', buf, payload + 8)]
+            # 32-bit tables that no longer fit become 64-bit ones
+            if kind == b'stco' and offsets and max(offsets) > 0xFFFFFFFF:
+                kind, code = b'co64', 'Q'
+            body = bytes(buf[payload:payload + 8]) + struct.pack(f'>{count}{code}', *offsets)
+            parts.append(_box_header(kind, len(body)) + body)
+        else:
+            parts.append(bytes(buf[box_start:box_end]))
+    return b''.join(parts)
+
+
+def _copy(buf, start, end, out):
+    for offset in range(start, end, COPY_BLOCK_SIZE):
+        out.write(buf[offset:min(offset + COPY_BLOCK_SIZE, end)])
+
+
+def rewrite_faststart(source, destination):
+    """
+    Write ``source`` to ``destination`` with moov moved in front of the
+    media data, so players and platforms can start before the whole file
+    has arrived. Only moov is held in memory; the media data is copied in
+    blocks. Returns False, writing nothing, if the file already has that
+    layout.
+    """
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        boxes = list(_boxes(buf, 0, len(buf)))
+        moov = next((box for box in boxes if box[0] == b'moov'), None)
+        first_media = next((box for box in boxes if box[0] in (b'mdat', b'moof')), None)
+        if moov is None or first_media is None:
+            raise InvalidMedia('The file has no moov box or no media data')
+        if moov[1] < first_media[1]:
+            return False
+
+        insert_at, moov_start, moov_end = first_media[1], moov[1], moov[3]
+        old_size = moov_size = moov_end - moov_start
+
+        def shift(offset):
+            if insert_at <= offset < moov_start:
+                return offset + moov_size
+            if offset >= moov_end:
+                return offset + moov_size - old_size
+            return offset
+
+        # Converting chunk offset tables to 64 bits grows moov, which shifts
+        # the media further; repeat until the size settles
+        while True:
+            body = _rebuild_moov(buf, moov[2], moov[3], shift)
+            new_moov = _box_header(b'moov', len(body)) + body
+            if len(new_moov) == moov_size:
+                break
+            moov_size = len(new_moov)
+
+        with open(destination, 'wb') as out:
+            for box in boxes:
+                if box is first_media:
+                    out.write(new_moov)
+                if box is not moov:
+                    _copy(buf, box[1], box[3], out)
+    return True
+
+
+class MediaProbe:
+    @staticmethod
+    def ensure(video_post):
+        """``video_post.media_info``, probing and saving it if missing. Raises InvalidMedia."""
+        from ..models import VideoPost
+
+        from .media_source import MediaSource
+
+        if video_post.media_info:
+            if video_post.media_info.get('error'):
+                raise InvalidMedia(video_post.media_info['error'])
+            return video_post.media_info
+        try:
+            if os.path.splitext(video_post.video_file.name)[1].lower() in ISO_BMFF_EXTENSIONS:
+                with MediaSource.open(video_post) as source:
+                    info = probe_buffer(source.buffer())
+            else:
+                info = {'container': 'other'}
+        except InvalidMedia as e:
+            info = {'error': str(e)}
+        VideoPost.objects.filter(pk=video_post.pk).update(media_info=info)
+        video_post.media_info = info
+        if info.get('error'):
+            raise InvalidMedia(info['error'])
+        return info
+
+    @staticmethod
+    def make_faststart(video_post):
+        """Replace the post's file with a faststart copy; False if it already was one"""
+        from ..models import VideoPost
+
+        storage = VideoPost._meta.get_field('video_file').storage
+        source = video_post.video_file.path
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(source))
+        os.close(fd)
+        try:
+            if not rewrite_faststart(source, tmp_path):
+                return False
+            info = probe_path(tmp_path)
+            name = storage.ingest(tmp_path, video_post.video_file.name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        digest = storage.digest_from_name(name)
+        with transaction.atomic():
+            VideoPost.objects.filter(pk=video_post.pk).update(
+                video_file=name, content_hash=digest, media_info=info, updated_at=timezone.now())
+        video_post.video_file = name
+        video_post.content_hash = digest
+        video_post.media_info = info
+        return True
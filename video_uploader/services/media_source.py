@@ -0,0 +1,166 @@
+import io
+import mmap
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class MediaSource:
+    """
+    Read-only access to a stored video for platform services, shared by all
+    uploads of the same file in this process.
+
+    A file on local disk is memory-mapped once. Any other storage backend is
+    streamed once, in MEDIA_SOURCE_BLOCK_SIZE blocks, into an anonymous spool
+    file that readers can use as soon as the bytes they need have arrived.
+    Get one with ``MediaSource.open(video_post)``.
+    """
+
+    _sources = {}
+    _sources_lock = threading.Lock()
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.refs = 0
+        self.size = storage.size(name)
+        self._map = None
+        self._fd = None
+        self._spool = None
+        self._error = None
+        self._closed = False
+        self._ready = threading.Condition()
+        try:
+            path = storage.path(name)
+        except NotImplementedError:
+            path = None
+        self.local = path is not None
+
+        if self.local:
+            self._fd = os.open(path, os.O_RDONLY)
+            if self.size:
+                self._map = mmap.mmap(self._fd, self.size, access=mmap.ACCESS_READ)
+            self._available = self.size
+        else:
+            self._spool = tempfile.TemporaryFile()
+            if self.size:
+                self._spool.truncate(self.size)
+                self._map = mmap.mmap(self._spool.fileno(), self.size)
+            self._available = 0
+            self._thread = threading.Thread(target=self._fill, name=f'media-source-{name}', daemon=True)
+            self._thread.start()
+
+    @classmethod
+    @contextmanager
+    def open(cls, video_post):
+        """The shared source of ``video_post.video_file``"""
+        name = video_post.video_file.name
+        with cls._sources_lock:
+            source = cls._sources.get(name)
+            if source is None:
+                source = cls._sources[name] = cls(video_post.video_file.storage, name)
+            source.refs += 1
+        try:
+            yield source
+        finally:
+            with cls._sources_lock:
+                source.refs -= 1
+                if source.refs == 0:
+                    del cls._sources[name]
+                    source.close()
+
+    def _fill(self):
+        position = 0
+        try:
+            with self.storage.open(self.name, 'rb') as f:
+                while position < self.size and not self._closed:
+                    block = f.read(min(settings.MEDIA_SOURCE_BLOCK_SIZE, self.size - position))
+                    if not block:
+                        raise OSError(f'{self.name} ended after {position} of {self.size} bytes')
+                    self._map[position:position + len(block)] = block
+                    position += len(block)
+                    with self._ready:
+                        self._available = position
+                        self._ready.notify_all()
+        except Exception as e:
+            with self._ready:
+                self._error = e
+                self._ready.notify_all()
+
+    def _wait(self, end):
+        if self._available >= end:
+            return
+        with self._ready:
+            while self._available < end and self._error is None and not self._closed:
+                self._ready.wait()
+            if self._available < end:
+                raise self._error or OSError(f'{self.name} was closed')
+
+    def read_at(self, offset, size):
+        """Up to ``size`` bytes from ``offset``, waiting for a remote file to deliver them"""
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b''
+        self._wait(end)
+        return self._map[offset:end]
+
+    def chunks(self, start=0, chunk_size=None):
+        chunk_size = chunk_size or settings.MEDIA_SOURCE_BLOCK_SIZE
+        for offset in range(start, self.size, chunk_size):
+            yield self.read_at(offset, chunk_size)
+
+    def buffer(self):
+        """The whole file as a read-only buffer (an mmap), once it is all available"""
+        if not self.size:
+            return b''
+        self._wait(self.size)
+        return self._map
+
+    def reader(self):
+        """A seekable file object over the source with its own position, e.g. for MediaIoBaseUpload"""
+        return _SourceReader(self)
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+        if self._spool is not None:
+            self._thread.join()
+        if self._map is not None:
+            self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+        if self._spool is not None:
+            self._spool.close()
+
+
+class _SourceReader(io.RawIOBase):
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read_at(self.position, len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.source.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
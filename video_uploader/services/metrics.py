@@ -0,0 +1,324 @@
+"""
+Prometheus-style counters and histograms, exposed as text at /metrics.
+
+Every thread records into its own shard, so the hot path takes no lock. A
+scrape merges the shards of this process with the snapshots that the upload
+worker processes write to METRICS_MULTIPROCESS_DIR. When a worker exits, its
+snapshot is folded into one retired file per host, so the directory holds a
+file per live process rather than one per process ever started.
+"""
+import bisect
+import fcntl
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+# 64 KiB/s up to 1 GiB/s
+THROUGHPUT_BUCKETS = tuple(float(2 ** power) for power in range(16, 31, 2))
+
+
+def _merge(into, values):
+    for key, slot in values.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = list(slot)
+        else:
+            for index, value in enumerate(slot):
+                current[index] += value
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {(name, tuple(labels)): slot for name, labels, slot in data}
+
+
+def _write_snapshot(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process
+        pass
+    return True
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Shard:
+    """Values recorded by one thread; only that thread writes to it"""
+
+    __slots__ = ('thread', 'values')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.values = {}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        # Values of threads that have finished
+        self._retired = {}
+        self._flushed_at = 0
+
+    def register(self, metric):
+        metric.registry = self
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        # Also runs in forked children, where another thread may have held the old lock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._flushed_at = 0
+
+    def values(self):
+        """The calling thread's shard"""
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+            return shard.values
+
+    def collect(self):
+        """Merged values of all threads of this process"""
+        with self._lock:
+            merged = {key: list(slot) for key, slot in self._retired.items()}
+            live = []
+            for shard in self._shards:
+                # dict.copy() is atomic, the owning thread may keep writing
+                values = shard.values.copy()
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    _merge(self._retired, values)
+                _merge(merged, values)
+            self._shards = live
+        return merged
+
+    @staticmethod
+    def _snapshot_path():
+        return os.path.join(settings.METRICS_MULTIPROCESS_DIR, f'{socket.gethostname()}-{os.getpid()}.json')
+
+    @staticmethod
+    @contextmanager
+    def _snapshot_lock(operation):
+        # Folding takes it exclusively, so a scrape never counts a snapshot
+        # both on its own and in the retired file, or in neither
+        os.makedirs(settings.METRICS_MULTIPROCESS_DIR, exist_ok=True)
+        with open(os.path.join(settings.METRICS_MULTIPROCESS_DIR, '.lock'), 'a') as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def flush(self, force=False):
+        """Write this process's values for the process serving /metrics, at most every METRICS_FLUSH_INTERVAL"""
+        if not settings.METRICS_MULTIPROCESS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        data = [[name, list(labels), slot] for (name, labels), slot in self.collect().items()]
+        path = self._snapshot_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_snapshot(path, data)
+
+    def retire(self):
+        """Fold this process's values into the retired file; call as the process exits"""
+        if not settings.METRICS_MULTIPROCESS_DIR:
+            return
+        self.flush(force=True)
+        self._fold(self._snapshot_path())
+
+    def _fold(self, path):
+        retired_path = os.path.join(settings.METRICS_MULTIPROCESS_DIR, f'{socket.gethostname()}-retired.json')
+        with self._snapshot_lock(fcntl.LOCK_EX):
+            snapshot = _read_snapshot(path)
+            if snapshot is None:
+                # Folded by another process meanwhile, or unreadable
+                return
+            retired = _read_snapshot(retired_path) or {}
+            _merge(retired, snapshot)
+            _write_snapshot(retired_path, [[name, list(labels), slot] for (name, labels), slot in retired.items()])
+            os.remove(path)
+
+    def _fold_dead(self):
+        """Fold the snapshots of processes on this host that exited without retiring, e.g. killed"""
+        prefix = os.path.join(settings.METRICS_MULTIPROCESS_DIR, f'{socket.gethostname()}-')
+        for path in glob.glob(f'{prefix}*.json'):
+            pid = path[len(prefix):-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+                self._fold(path)
+
+    def clear_snapshots(self):
+        """Remove the snapshots left by earlier processes on this host"""
+        if not settings.METRICS_MULTIPROCESS_DIR:
+            return
+        for path in glob.glob(os.path.join(settings.METRICS_MULTIPROCESS_DIR, f'{socket.gethostname()}-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def collect_all(self):
+        """Values of this process plus the latest snapshots of the other processes"""
+        merged = self.collect()
+        if settings.METRICS_MULTIPROCESS_DIR:
+            self._fold_dead()
+            own = self._snapshot_path()
+            with self._snapshot_lock(fcntl.LOCK_SH):
+                for path in glob.glob(os.path.join(settings.METRICS_MULTIPROCESS_DIR, '*.json')):
+                    if path != own:
+                        _merge(merged, _read_snapshot(path) or {})
+        return merged
+
+    def expose(self):
+        """All metrics in the Prometheus text format"""
+        merged = self.collect_all()
+        by_metric = {}
+        for (name, labels), slot in merged.items():
+            by_metric.setdefault(name, []).append((labels, slot))
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render(sorted(by_metric.get(metric.name, []))))
+        return '\n'.join(lines) + '\n'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = None
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(name, '')) for name in self.labelnames))
+
+    def render(self, samples):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, slot in samples:
+            lines.extend(self._render_sample(list(zip(self.labelnames, labels)), slot))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.values()
+        key = self._key(labels)
+        slot = values.get(key)
+        if slot is None:
+            slot = values[key] = [0]
+        slot[0] += amount
+
+    def _render_sample(self, pairs, slot):
+        return [f'{self.name}{_format_labels(pairs)} {_format_value(slot[0])}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = self.registry.values()
+        key = self._key(labels)
+        slot = values.get(key)
+        if slot is None:
+            # A count per bucket plus +Inf, then the sum
+            slot = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        slot[bisect.bisect_left(self.buckets, value)] += 1
+        slot[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, pairs, slot):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), slot[:-1]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels(pairs + [("le", _format_value(bound))])} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(pairs)} {_format_value(slot[-1])}')
+        lines.append(f'{self.name}_count{_format_labels(pairs)} {cumulative}')
+        return lines
+
+
+registry = Registry()
+# Forked worker processes start counting from zero
+os.register_at_fork(after_in_child=registry.reset)
+
+QUEUE_WAIT = registry.register(Histogram(
+    'upload_queue_wait_seconds', 'Time upload jobs waited between becoming due and being claimed'))
+JOBS = registry.register(Counter(
+    'upload_jobs_total', 'Upload jobs processed by outcome', ['outcome']))
+STAGE_SECONDS = registry.register(Histogram(
+    'upload_stage_seconds', 'Time spent in a stage of an upload', ['platform', 'stage']))
+UPLOAD_SECONDS = registry.register(Histogram(
+    'upload_seconds', 'Duration of platform upload calls', ['platform']))
+UPLOAD_BYTES = registry.register(Counter(
+    'upload_bytes_total', 'Bytes acknowledged by platforms', ['platform']))
+UPLOAD_THROUGHPUT = registry.register(Histogram(
+    'upload_throughput_bytes_per_second', 'Transfer rate of finished platform uploads', ['platform'],
+    buckets=THROUGHPUT_BUCKETS))
+STATUS_WRITE_SECONDS = registry.register(Histogram(
+    'upload_status_write_seconds', 'Time to record an UploadStatus transition', ['status']))
+OUTCOMES = registry.register(Counter(
+    'upload_outcomes_total', 'Platform upload attempts by outcome and error class',
+    ['platform', 'outcome', 'error_class']))
+PUBLISH_RELEASED = registry.register(Counter(
+    'upload_publish_released_total', 'Scheduled uploads released by the publish dispatcher'))
+CACHE_REQUESTS = registry.register(Counter(
+    'upload_cache_requests_total', 'Lookups in the in-process credential and client caches', ['cache', 'result']))
+CACHE_EVICTIONS = registry.register(Counter(
+    'upload_cache_evictions_total', 'Entries dropped from the in-process caches, by reason', ['cache', 'reason']))
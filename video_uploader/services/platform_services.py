@@ -1,135 +1,33 @@
 from django.conf import settings
-
-import google_auth_oauthlib.flow
-import googleapiclient.discovery
-import googleapiclient.errors 
-import googleapiclient.http 
+from django.utils.module_loading import import_string
 
 from abc import ABC, abstractmethod
-import os
-import pickle
+from importlib.metadata import entry_points
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 
 class BasePlatformService(ABC):
     @abstractmethod
-    def upload_video(self, video_post, platform):
-        pass
-
-class YouTubeService(BasePlatformService):
-    def __init__(self):
-        self.scopes = ['https://www.googleapis.com/auth/youtube.upload']
-        self.api_service_name = 'youtube'
-        self.api_version = 'v3'
-        self.client_id = settings.CLIENT_ID
-        self.client_secret = settings.CLIENT_SECRET
-        self.redirect_uri = settings.YOUTUBE_REDIRECT_URI
-        self.credentials = {}
-
-    def get_authenticated_service(self, user_id):
-        credentials_file = f'youtube_credentials_{user_id}.pickle'
-        
-        # Try loading existing credentials
-        if os.path.exists(credentials_file):
-            try:
-                with open(credentials_file, 'rb') as token:
-                    self.credentials[user_id] = pickle.load(token)
-            except Exception as e:
-                print(f"Error loading credentials for user {user_id}: {str(e)}")
-                os.remove(credentials_file)
-
-        # If no valid credentials, run OAuth flow
-        if user_id not in self.credentials or not self.credentials[user_id].valid:
-            flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_config(
-                {
-                    'installed': {
-                        'client_id': self.client_id,
-                        'client_secret': self.client_secret,
-                        'redirect_uris': [self.redirect_uri],
-                        'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
-                        'token_uri': 'https://oauth2.googleapis.com/token'
-                    }
-                },
-                self.scopes
-            )
-            flow.redirect_uri = self.redirect_uri
-            try:
-                self.credentials[user_id] = flow.run_local_server(
-                    port=8192,
-                    open_browser=True,
-                    redirect_uri_mismatch_message="Mismatch in redirect URI. Please ensure http://localhost:8192/oauth2callback is added to Google Cloud Console."
-                )
-                print(f"Successfully obtained credentials for user {user_id}")
-            except Exception as e:
-                print(f"OAuth flow failed for user {user_id}: {str(e)}")
-                raise
-            
-            # Save credentials
-            try:
-                with open(credentials_file, 'wb') as token:
-                    pickle.dump(self.credentials[user_id], token)
-            except Exception as e:
-                print(f"Error saving credentials for user {user_id}: {str(e)}")
-        
-        return googleapiclient.discovery.build(
-            self.api_service_name, self.api_version, credentials=self.credentials[user_id])
-
-    def upload_video(self, video_post, platform):
-        try:
-            user_id = video_post.created_by.id
-            youtube = self.get_authenticated_service(user_id)
-            
-            request_body = {
-                'snippet': {
-                    'title': video_post.title,
-                    'description': video_post.description,
-                    'tags': ['video', 'upload'],
-                    'categoryId': '22'  # People & Blogs
-                },
-                'status': {
-                    'privacyStatus': 'public'
-                }
-            }
-            
-            if not video_post.video_file:
-                raise Exception("Video file is required for YouTube upload")
-            
-            media = googleapiclient.http.MediaFileUpload(
-                video_post.video_file.path,
-                chunksize=-1,
-                resumable=True
-            )
-            
-            videos_insert_request = youtube.videos().insert(
-                part='snippet,status',
-                body=request_body,
-                media_body=media
-            )
-            
-            response = videos_insert_request.execute()
-            
-            return {
-                'success': True,
-                'external_id': response.get('id', f'youtube_video_{video_post.id}'),
-                'message': 'Successfully uploaded to YouTube'
-            }
-        
-        except googleapiclient.errors.HttpError as e:
-            print(f"YouTube API error: {str(e)}")
-            return {
-                'success': False,
-                'error': f"YouTube API error: {str(e)}"
-            }
-        except Exception as e:
-            print(f"General error in upload_video: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e)
-            }
+    def upload_video(self, video_post, platform, upload_status=None):
+        """
+        Upload ``video_post`` to ``platform``. Services that support resumable
+        uploads keep their session state and progress on ``upload_status``.
 
+        A failed result may set ``quota_exceeded`` or ``retry_after`` (seconds)
+        when the platform refused the call for quota or rate limits; the upload
+        is then deferred instead of counted as a failure.
 
+        Read the video through ``MediaSource.open(video_post)`` rather than
+        ``video_file.path``, so any storage backend works and concurrent
+        platform uploads share one read of the file.
+        """
+        pass
 
 class VimeoService(BasePlatformService):
-    def upload_video(self, video_post, platform):
+    def upload_video(self, video_post, platform, upload_status=None):
         try:
             # Simulated Vimeo upload
             headers = {
@@ -138,7 +36,7 @@ class VimeoService(BasePlatformService):
             }
             
             # In real implementation I will use Vimeo API
-            print(f"Uploading {video_post.title} to Vimeo...")
+            logger.info("Uploading post %s to Vimeo", video_post.id)
             
             return {
                 'success': True,
@@ -152,10 +50,10 @@ class VimeoService(BasePlatformService):
             }
 
 class DailymotionService(BasePlatformService):
-    def upload_video(self, video_post, platform):
+    def upload_video(self, video_post, platform, upload_status=None):
         try:
             # Simulated Dailymotion upload
-            print(f"Uploading {video_post.title} to Dailymotion...")
+            logger.info("Uploading post %s to Dailymotion", video_post.id)
             
             return {
                 'success': True,
@@ -170,12 +68,64 @@ class DailymotionService(BasePlatformService):
 
 # Interface for platform services
 class PlatformServiceFactory:
-    services = {
-        'youtube': YouTubeService(),
-        'vimeo': VimeoService(),
-        'dailymotion': DailymotionService(),
+    """
+    Lazy registry of platform services.
+
+    ``registry`` maps platform names to dotted class paths; a service module is
+    only imported, and its service built, on the first ``get_service`` call for
+    that platform. Third-party packages can add platforms through the
+    ``video_uploader.platforms`` entry point group, and projects through the
+    ``UPLOAD_PLATFORM_SERVICES`` setting.
+    """
+    ENTRY_POINT_GROUP = 'video_uploader.platforms'
+    
+    registry = {
+        'youtube': 'video_uploader.services.youtube_service.YouTubeService',
+        'vimeo': 'video_uploader.services.platform_services.VimeoService',
+        'dailymotion': 'video_uploader.services.platform_services.DailymotionService',
     }
+    services = {}
+    _lock = threading.Lock()
+    _discovered = False
+    
+    @classmethod
+    def register(cls, platform_name, target):
+        """Register a dotted path, class or ready-made instance for a platform"""
+        with cls._lock:
+            cls.registry[platform_name.lower()] = target
+            cls.services.pop(platform_name.lower(), None)
+    
+    @classmethod
+    def _discover(cls):
+        for entry_point in entry_points(group=cls.ENTRY_POINT_GROUP):
+            cls.registry.setdefault(entry_point.name.lower(), entry_point)
+        for name, target in getattr(settings, 'UPLOAD_PLATFORM_SERVICES', {}).items():
+            cls.registry[name.lower()] = target
+        cls._discovered = True
+    
+    @staticmethod
+    def _build(target):
+        if isinstance(target, str):
+            target = import_string(target)
+        elif hasattr(target, 'load'):
+            target = target.load()
+        return target() if isinstance(target, type) else target
     
     @classmethod
     def get_service(cls, platform_name):
-        return cls.services.get(platform_name.lower())
\ No newline at end of file
+        name = platform_name.lower()
+        service = cls.services.get(name)
+        if service is not None:
+            return service
+        
+        with cls._lock:
+            if name in cls.services:
+                return cls.services[name]
+            if not cls._discovered:
+                cls._discover()
+            target = cls.registry.get(name)
+            if target is None:
+                return None
+            service = cls.services[name] = cls._build(target)
+            return service
+
@@ -0,0 +1,211 @@
+"""
+Scheduled publishing.
+
+An upload scheduled for later keeps its time in UploadStatus.publish_at and
+gets no upload job. The dispatcher looks up the earliest publish_at through a
+partial index that only holds scheduled rows, sleeps until it is due and then
+releases the due uploads in batches: publish_at is cleared and their posts are
+queued for the workers.
+
+Deadlines are scheduled by the web processes, which wake the dispatcher
+through DispatcherWakeup once the scheduling transaction commits. A wakeup
+that is lost, e.g. while the dispatcher restarts, is made up for by a poll:
+the dispatcher re-reads the next due time at least every
+PUBLISH_RECHECK_INTERVAL seconds.
+"""
+import contextlib
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from ..models import UploadStatus
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherWakeup:
+    """
+    Signal from the web processes to a sleeping dispatcher.
+
+    On PostgreSQL the dispatcher LISTENs on a channel that the web processes
+    NOTIFY. SQLite has no notifications, but its processes share one host:
+    the dispatcher binds a datagram socket at PUBLISH_WAKEUP_SOCKET and the
+    web processes send it a byte.
+    """
+    CHANNEL = 'video_uploader_publish'
+    # How often a sleeping dispatcher checks its stop event
+    STOP_CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self._listener = None
+
+    @classmethod
+    def send(cls):
+        try:
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'NOTIFY {cls.CHANNEL}')
+            elif hasattr(socket, 'AF_UNIX'):
+                with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+                    sock.setblocking(False)
+                    sock.sendto(b'!', str(settings.PUBLISH_WAKEUP_SOCKET))
+        except OSError:
+            # No dispatcher is listening, or a wakeup is already pending
+            pass
+        except DatabaseError:
+            logger.warning("Could not wake the publish dispatcher", exc_info=True)
+
+    def listen(self):
+        if connection.vendor == 'postgresql':
+            # A connection of its own, as the dispatcher's is closed between passes
+            self._listener = connection.get_new_connection(connection.get_connection_params())
+            self._listener.autocommit = True
+            self._listener.execute(f'LISTEN {self.CHANNEL}')
+        elif hasattr(socket, 'AF_UNIX'):
+            path = str(settings.PUBLISH_WAKEUP_SOCKET)
+            with contextlib.suppress(FileNotFoundError):
+                # Left behind by a dispatcher that did not stop cleanly
+                os.unlink(path)
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._listener.setblocking(False)
+            self._listener.bind(path)
+
+    def close(self):
+        if self._listener is None:
+            return
+        self._listener.close()
+        if isinstance(self._listener, socket.socket):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(str(settings.PUBLISH_WAKEUP_SOCKET))
+        self._listener = None
+
+    def wait(self, timeout, stop_event):
+        """Sleep up to ``timeout`` seconds or until woken or stopped; True if woken"""
+        deadline = time.monotonic() + timeout
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._listener is None:
+                stop_event.wait(remaining)
+                return False
+            if self._receive(min(remaining, self.STOP_CHECK_INTERVAL)):
+                return True
+        return False
+
+    def _receive(self, timeout):
+        if not isinstance(self._listener, socket.socket):
+            return any(True for _ in self._listener.notifies(timeout=timeout, stop_after=1))
+        if not select.select([self._listener], [], [], timeout)[0]:
+            return False
+        # One pass serves every edit signalled so far
+        with contextlib.suppress(BlockingIOError):
+            while self._listener.recv(16):
+                pass
+        return True
+
+
+class PublishDispatcher:
+    @staticmethod
+    def scheduled_time(publish_at, now=None):
+        """``publish_at`` if it is still in the future, else None: the upload can start right away"""
+        if publish_at is not None and publish_at > (now or timezone.now()):
+            return publish_at
+        return None
+
+    @staticmethod
+    def notify():
+        """Wake the dispatcher once the current transaction commits, to re-read the next due time"""
+        transaction.on_commit(DispatcherWakeup.send)
+
+    @staticmethod
+    def reschedule(video_post):
+        """
+        Move the post's unreleased uploads to ``video_post.publish_at``, or
+        release them now if it is empty or past. Uploads that were already
+        released are left alone.
+        """
+        from .job_queue import UploadJobQueue
+
+        publish_at = PublishDispatcher.scheduled_time(video_post.publish_at)
+        updated = UploadStatus.objects.filter(
+            video_post=video_post, publish_at__isnull=False
+        ).update(publish_at=publish_at)
+        if updated and publish_at:
+            PublishDispatcher.notify()
+        elif updated:
+            UploadJobQueue.enqueue(video_post)
+        return updated
+
+    @staticmethod
+    def next_due():
+        """Earliest publish_at of the unreleased uploads, an index lookup"""
+        return UploadStatus.objects.filter(publish_at__isnull=False).aggregate(next_due=Min('publish_at'))['next_due']
+
+    @staticmethod
+    def release_due(now=None, limit=None):
+        """Release up to ``limit`` due uploads, earliest first; returns how many were released"""
+        now = now or timezone.now()
+        limit = limit or settings.PUBLISH_BATCH_SIZE
+        due = list(
+            UploadStatus.objects.filter(publish_at__isnull=False, publish_at__lte=now)
+            .order_by('publish_at', 'id')
+            .values_list('id', 'video_post_id')[:limit]
+        )
+        if not due:
+            return 0
+
+        from .job_queue import UploadJobQueue
+
+        post_ids = {post_id for _, post_id in due}
+        with transaction.atomic():
+            released = UploadStatus.objects.filter(
+                pk__in=[pk for pk, _ in due], publish_at__isnull=False
+            ).update(publish_at=None)
+            UploadJobQueue.enqueue_many(post_ids, available_at=now)
+        metrics.PUBLISH_RELEASED.inc(released)
+        logger.info("Released %d scheduled upload(s) of %d post(s)", released, len(post_ids))
+        return released
+
+
+def run_dispatcher(stop_event=None, wakeup=None):
+    """
+    Release scheduled uploads as they become due until ``stop_event`` is set.
+
+    After a full batch the dispatcher pauses PUBLISH_BATCH_INTERVAL seconds,
+    so a large backlog reaches the workers, and the platforms, at a steady
+    rate. Otherwise it sleeps until the next due time, or until ``wakeup``
+    reports an earlier deadline, re-reading it at least every
+    PUBLISH_RECHECK_INTERVAL seconds.
+    """
+    stop_event = stop_event or threading.Event()
+    if wakeup is None:
+        wakeup = DispatcherWakeup()
+        wakeup.listen()
+    logger.info("Publish dispatcher started")
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            if PublishDispatcher.release_due() >= settings.PUBLISH_BATCH_SIZE:
+                stop_event.wait(settings.PUBLISH_BATCH_INTERVAL)
+                continue
+
+            next_due = PublishDispatcher.next_due()
+            timeout = settings.PUBLISH_RECHECK_INTERVAL
+            if next_due is not None:
+                timeout = min(timeout, max((next_due - timezone.now()).total_seconds(), 0))
+            metrics.registry.flush()
+            wakeup.wait(timeout, stop_event)
+    finally:
+        wakeup.close()
+    metrics.registry.flush(force=True)
+    logger.info("Publish dispatcher stopped")
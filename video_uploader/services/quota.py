@@ -0,0 +1,173 @@
+import datetime
+import math
+import zoneinfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import PlatformQuota, UploadStatus
+from .retry import RetryPolicy
+
+
+class QuotaExhausted(Exception):
+    """No quota is left on a platform before ``retry_at``"""
+
+    def __init__(self, platform, retry_at):
+        self.platform = platform
+        self.retry_at = retry_at
+        super().__init__(f"{platform.platform} quota exhausted until {retry_at.isoformat()}")
+
+
+class QuotaLedger:
+    """
+    Per-platform and per-credential quota ledgers persisted in PlatformQuota,
+    so every worker draws from the same budget.
+
+    Units are reserved from all of an upload's ledgers with one conditional
+    UPDATE before the platform is called. Without budget the upload is
+    deferred to the next window instead of being sent only to fail with a
+    quota error.
+    """
+
+    @staticmethod
+    def config(platform):
+        return settings.UPLOAD_PLATFORM_QUOTAS.get(platform.platform)
+
+    @staticmethod
+    def window(config, now=None):
+        """Start and end of the quota window containing ``now``; windows are aligned to local midnight"""
+        tz = zoneinfo.ZoneInfo(config.get('timezone', 'UTC'))
+        local = (now or timezone.now()).astimezone(tz)
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        length = datetime.timedelta(seconds=config['window'])
+        start = midnight + length * ((local - midnight) // length)
+        return start.astimezone(datetime.timezone.utc), (start + length).astimezone(datetime.timezone.utc)
+
+    @staticmethod
+    def _ledgers(config, credential):
+        """(credential key, unit limit) of every ledger an upload draws from"""
+        ledgers = [('', config['limit'])]
+        if credential is not None:
+            ledgers.append((str(credential), config.get('credential_limit')))
+        return ledgers
+
+    @classmethod
+    def reserve(cls, platform, credential=None):
+        """Take one upload's units from the platform's ledgers or raise QuotaExhausted"""
+        config = cls.config(platform)
+        if not config:
+            return
+        start, end = cls.window(config)
+        ledgers = cls._ledgers(config, credential)
+        if cls._take(platform, config, start, ledgers):
+            return
+        # The first upload of a window creates its ledgers
+        PlatformQuota.objects.bulk_create([
+            PlatformQuota(platform=platform, credential=key, window_start=start) for key, _ in ledgers
+        ], ignore_conflicts=True)
+        if not cls._take(platform, config, start, ledgers):
+            raise QuotaExhausted(platform, end)
+
+    @staticmethod
+    def _take(platform, config, start, ledgers):
+        """Take one upload's units from every ledger in one UPDATE, or from none of them"""
+        budget = Q()
+        for key, limit in ledgers:
+            room = Q(credential=key)
+            if limit is not None:
+                room &= Q(units_used__lte=limit - config['cost'])
+            budget |= room
+        with transaction.atomic():
+            taken = PlatformQuota.objects.filter(
+                budget, platform=platform, window_start=start, exhausted_at__isnull=True
+            ).update(units_used=F('units_used') + config['cost'], updated_at=timezone.now())
+            if taken == len(ledgers):
+                return True
+            # A ledger is missing or out of budget: give back what the others took
+            transaction.set_rollback(True)
+        return False
+
+    @classmethod
+    def refund(cls, platform, credential=None):
+        """Give back the units of a call the platform did not charge, e.g. a rate-limited one"""
+        config = cls.config(platform)
+        if not config:
+            return
+        start, _ = cls.window(config)
+        PlatformQuota.objects.filter(
+            platform=platform,
+            credential__in=[key for key, _ in cls._ledgers(config, credential)],
+            window_start=start,
+            units_used__gte=config['cost'],
+        ).update(units_used=F('units_used') - config['cost'], updated_at=timezone.now())
+
+    @classmethod
+    def exhaust(cls, platform):
+        """
+        Record that the platform refused a call for quota. Nothing more is
+        sent to it in this window; returns when the quota resets.
+        """
+        config = cls.config(platform)
+        if not config:
+            return timezone.now() + datetime.timedelta(seconds=settings.UPLOAD_RATE_LIMIT_BACKOFF)
+        start, end = cls.window(config)
+        ledger, _ = PlatformQuota.objects.get_or_create(platform=platform, credential='', window_start=start)
+        PlatformQuota.objects.filter(pk=ledger.pk, exhausted_at__isnull=True).update(
+            exhausted_at=timezone.now(), updated_at=timezone.now())
+        return end
+
+    @staticmethod
+    def projected_drain_at(uploads, remaining, config, window_end, now=None):
+        """When the quota will have allowed ``uploads`` more calls, or None if it never will"""
+        now = now or timezone.now()
+        fits_now = remaining // config['cost']
+        if uploads <= fits_now:
+            return now
+        per_window = config['limit'] // config['cost']
+        if not per_window:
+            return None
+        windows = math.ceil((uploads - fits_now) / per_window)
+        return window_end + datetime.timedelta(seconds=config['window']) * (windows - 1)
+
+    @classmethod
+    def report(cls, platform, credential=None, now=None):
+        """Remaining budget of ``platform`` and when its queued uploads will have drained"""
+        now = now or timezone.now()
+        queued = UploadStatus.objects.filter(RetryPolicy.outstanding_filter(), platform=platform).count()
+        report = {'platform': platform.platform, 'metered': False, 'queued_uploads': queued}
+        config = cls.config(platform)
+        if not config:
+            return report
+
+        start, end = cls.window(config, now)
+        ledgers = {
+            ledger['credential']: ledger
+            for ledger in PlatformQuota.objects.filter(
+                platform=platform, window_start=start,
+                credential__in=[key for key, _ in cls._ledgers(config, credential)],
+            ).values('credential', 'units_used', 'exhausted_at')
+        }
+        project = ledgers.get('', {'units_used': 0, 'exhausted_at': None})
+        remaining = 0 if project['exhausted_at'] else max(config['limit'] - project['units_used'], 0)
+        report.update({
+            'metered': True,
+            'cost_per_upload': config['cost'],
+            'limit': config['limit'],
+            'used': project['units_used'],
+            'remaining': remaining,
+            'exhausted': project['exhausted_at'] is not None,
+            'window_start': start,
+            'resets_at': end,
+            'projected_drain_at': cls.projected_drain_at(queued, remaining, config, end, now),
+        })
+        if credential is not None:
+            limit = config.get('credential_limit')
+            used = ledgers.get(str(credential), {'units_used': 0})['units_used']
+            report['credential'] = {
+                'limit': limit,
+                'used': used,
+                'remaining': None if limit is None else max(limit - used, 0),
+            }
+        return report
@@ -0,0 +1,398 @@
+import hashlib
+import ipaddress
+import os
+import posixpath
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import unquote, urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util import connection as urllib3_connection
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import RemoteFetch, VideoPost
+from .events import emit
+from .locks import KeyedLock
+
+# Seconds between progress writes to the RemoteFetch row
+SAVE_INTERVAL = 1.0
+
+# One fetch per post at a time in this process
+_post_lock = KeyedLock()
+
+
+class RemoteFetchError(Exception):
+    """The remote video could not be fetched"""
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class _RemoteChanged(RemoteFetchError):
+    pass
+
+
+def check_address(host, address):
+    """Refuse a private, loopback, link-local or otherwise non-public address of ``host``"""
+    if settings.REMOTE_FETCH_ALLOW_PRIVATE:
+        return
+    ip = ipaddress.ip_address(address.partition('%')[0])
+    ip = getattr(ip, 'ipv4_mapped', None) or ip
+    if not ip.is_global:
+        raise RemoteFetchError(f'{host} resolves to a non-public address ({ip})')
+
+
+def check_url(url):
+    """
+    Refuse URLs that are not http(s) or whose host resolves to a non-public
+    address, so a post cannot make the worker fetch from the internal
+    network. Returns the host's vetted addresses, to connect to with
+    PinnedAdapter, or None when REMOTE_FETCH_ALLOW_PRIVATE is set.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise RemoteFetchError(f'Only http and https URLs can be fetched: {url}')
+    if settings.REMOTE_FETCH_ALLOW_PRIVATE:
+        return None
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError) as e:
+        raise RemoteFetchError(f'Could not resolve {parts.hostname}: {e}')
+    addresses = list(dict.fromkeys(sockaddr[0] for *_, sockaddr in addresses))
+    for address in addresses:
+        check_address(parts.hostname, address)
+    return addresses
+
+
+class PinnedAdapter(HTTPAdapter):
+    """
+    Connects to the addresses check_url vetted for each host instead of
+    resolving the name again, so a host cannot pass the check and then
+    rebind to an internal address. The Host header, SNI and certificate
+    still use the hostname, and each connected address is checked again.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_cls.__name__, (pool_cls,), {
+                'ConnectionCls': _pinned_connection(pool_cls.ConnectionCls, self.addresses)})
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+def _pinned_connection(connection_cls, addresses):
+    class PinnedConnection(connection_cls):
+        def _new_conn(self):
+            if self.host not in addresses:
+                raise RemoteFetchError(f'{self.host} was not checked before connecting')
+            error = None
+            for address in addresses[self.host]:
+                try:
+                    sock = urllib3_connection.create_connection(
+                        (address, self.port), self.timeout,
+                        source_address=self.source_address, socket_options=self.socket_options)
+                except OSError as e:
+                    error = e
+                    continue
+                try:
+                    check_address(self.host, sock.getpeername()[0])
+                except RemoteFetchError:
+                    sock.close()
+                    raise
+                return sock
+            raise NewConnectionError(self, f'Failed to establish a new connection: {error}')
+
+    return PinnedConnection
+
+
+def _session(addresses):
+    """A requests session that only connects to ``addresses``, when given"""
+    session = requests.Session()
+    if addresses is not None:
+        # Proxies would resolve the name themselves
+        session.trust_env = False
+        adapter = PinnedAdapter(addresses)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    return session
+
+
+class _PrefixHasher:
+    """
+    SHA-256 of a file written out of order by several segments. It advances
+    over the contiguous prefix written so far, re-reading those bytes while
+    they are still in the page cache, so memory use stays at one block.
+    """
+
+    def __init__(self, path, block_size):
+        self.path = path
+        self.block_size = block_size
+        self.offset = 0
+        self.digest = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    def advance(self, boundary, wait=False):
+        # Only one thread hashes at a time; the others leave it to catch up
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            if boundary <= self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                while self.offset < boundary:
+                    block = f.read(min(self.block_size, boundary - self.offset))
+                    if not block:
+                        break
+                    self.digest.update(block)
+                    self.offset += len(block)
+        finally:
+            self._lock.release()
+
+
+class RemoteFetcher:
+    """
+    Streams a post's video_url into the video storage in fixed-size blocks.
+
+    When the server supports byte ranges the file is split into segments
+    fetched in parallel, each resuming from its last written byte after a
+    dropped connection. Segment positions are saved on RemoteFetch, so a
+    later attempt continues where an interrupted worker stopped, as long as
+    the remote file's ETag or Last-Modified is unchanged.
+    """
+
+    def __init__(self, video_post):
+        self.video_post = video_post
+        self.block_size = settings.REMOTE_FETCH_BLOCK_SIZE
+        self.timeout = settings.REMOTE_FETCH_TIMEOUT
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def ensure(video_post):
+        """Fetch ``video_post.video_url`` into ``video_file`` unless that is already done"""
+        with _post_lock(video_post.id):
+            if not video_post.video_file:
+                stored = VideoPost.objects.filter(pk=video_post.pk).values('video_file', 'content_hash').first()
+                if stored and stored['video_file']:
+                    video_post.video_file = stored['video_file']
+                    video_post.content_hash = stored['content_hash']
+                else:
+                    RemoteFetcher(video_post).run()
+        return video_post.video_file.name
+
+    def _probe(self, url):
+        """Final URL after redirects, total size, byte range support and validator of the remote file"""
+        headers = {'Range': 'bytes=0-0'}
+        # Redirects are followed by hand so every hop is checked before it is requested
+        for _ in range(settings.REMOTE_FETCH_MAX_REDIRECTS + 1):
+            addresses = check_url(url)
+            self.addresses = None if addresses is None else {urlsplit(url).hostname: addresses}
+            with _session(self.addresses) as session, session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers['Location'])
+                    continue
+                response.raise_for_status()
+                etag = response.headers.get('ETag', '')
+                # Weak validators cannot be used with If-Range
+                validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified', '')
+                if response.status_code == 206:
+                    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                    if total.isdigit():
+                        return url, int(total), True, validator
+                length = response.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() and response.status_code == 200 else None
+                return url, total, False, validator
+        raise RemoteFetchError(f'More than {settings.REMOTE_FETCH_MAX_REDIRECTS} redirects fetching {url}')
+
+    @staticmethod
+    def plan(total, ranges):
+        """[start, end, position] of each segment; a single open-ended one without range support"""
+        if not ranges or not total:
+            return [[0, total, 0]]
+        count = max(1, min(settings.REMOTE_FETCH_SEGMENTS, total // settings.REMOTE_FETCH_MIN_SEGMENT_SIZE))
+        size = -(-total // count)
+        return [[start, min(start + size, total), start] for start in range(0, total, size)]
+
+    def run(self):
+        post = self.video_post
+        fetch, _ = RemoteFetch.objects.get_or_create(video_post=post, defaults={'url': post.video_url})
+        self.fetch = fetch
+        path = default_storage.path(fetch.partial_name)
+        try:
+            url, total, ranges, validator = self._probe(post.video_url)
+        except requests.RequestException as e:
+            self._fail(f'Could not reach {post.video_url}: {e}')
+        except RemoteFetchError as e:
+            self._fail(str(e))
+
+        if total is not None and total > settings.REMOTE_FETCH_MAX_BYTES:
+            self._fail(f'Remote file is {total} bytes, more than REMOTE_FETCH_MAX_BYTES')
+
+        resumable = (
+            ranges and validator and fetch.url == post.video_url and fetch.segments
+            and fetch.total_bytes == total and fetch.validator == validator
+            and os.path.exists(path)
+        )
+        if not resumable:
+            fetch.segments = self.plan(total, ranges)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                if total:
+                    f.truncate(total)
+        fetch.url = post.video_url
+        fetch.total_bytes = total
+        fetch.validator = validator
+        fetch.status = 'fetching'
+        fetch.error_message = ''
+        fetch.save()
+
+        self.url = url
+        self.ranged = ranges
+        self.segments = fetch.segments
+        self.hasher = _PrefixHasher(path, self.block_size)
+        self.path = path
+
+        # Segment threads only write the file; progress is saved from here
+        todo = [index for index, (_, end, position) in enumerate(self.segments) if end is None or position < end]
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, len(todo)), thread_name_prefix=f'fetch-post-{post.id}') as executor:
+            pending = {executor.submit(self._download, index) for index in todo}
+            while pending:
+                done, pending = wait(pending, timeout=SAVE_INTERVAL)
+                for future in done:
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        self._stop.set()
+                self._save()
+        if errors:
+            if isinstance(errors[0], _RemoteChanged):
+                # The stored segments no longer fit the remote file
+                RemoteFetch.objects.filter(pk=fetch.pk).update(segments=[])
+            self._fail(str(errors[0]))
+
+        size = self._contiguous()
+        if total is None:
+            # Length only known now that the stream has ended
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        self.hasher.advance(size, wait=True)
+        digest = self.hasher.digest.hexdigest()
+
+        storage = VideoPost._meta.get_field('video_file').storage
+        name = storage.ingest(path, self._filename(), digest)
+        with transaction.atomic():
+            VideoPost.objects.filter(pk=post.pk).update(video_file=name, content_hash=digest, updated_at=timezone.now())
+            RemoteFetch.objects.filter(pk=fetch.pk).update(
+                status='done', total_bytes=size, bytes_fetched=size, content_hash=digest,
+                segments=[], updated_at=timezone.now())
+        post.video_file = name
+        post.content_hash = digest
+        return name
+
+    def _filename(self):
+        name = posixpath.basename(unquote(urlsplit(self.url).path))
+        return name if os.path.splitext(name)[1] else f'{name or "video"}.mp4'
+
+    def _fail(self, message):
+        RemoteFetch.objects.filter(pk=self.fetch.pk).update(
+            status='failed', error_message=message, updated_at=timezone.now())
+        raise RemoteFetchError(message)
+
+    def _contiguous(self):
+        """End of the prefix of the file that is completely written"""
+        for start, end, position in self.segments:
+            if end is None or position < end:
+                return position
+        return self.segments[-1][1]
+
+    def _advance(self, index, position):
+        with self._lock:
+            self.segments[index][2] = position
+            boundary = self._contiguous()
+        self.hasher.advance(boundary)
+
+    def _save(self):
+        with self._lock:
+            segments = [list(segment) for segment in self.segments]
+        fetched = sum(position - start for start, _, position in segments)
+        RemoteFetch.objects.filter(pk=self.fetch.pk).update(
+            segments=segments, bytes_fetched=fetched, updated_at=timezone.now())
+        emit('fetch', self.video_post.id, self.video_post.created_by_id, {
+            'post': self.video_post.id,
+            'bytes_fetched': fetched,
+            'total_bytes': self.fetch.total_bytes,
+        })
+
+    def _download(self, index):
+        start, end, position = self.segments[index]
+        failures = 0
+        with _session(self.addresses) as session:
+            while not self._stop.is_set() and (end is None or position < end):
+                headers = {}
+                if self.ranged:
+                    headers['Range'] = f'bytes={position}-{end - 1}'
+                    headers['If-Range'] = self.fetch.validator
+                try:
+                    position = self._stream(session, headers, index, position, end)
+                    if not self.ranged:
+                        # Without ranges the stream cannot be continued, only restarted
+                        if end is not None and position < end and not self._stop.is_set():
+                            raise RemoteFetchError(f'Remote file ended after {position} of {end} bytes')
+                        return
+                except (requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError, _RetryableError) as e:
+                    failures += 1
+                    if not self.ranged or failures > settings.REMOTE_FETCH_RETRIES:
+                        raise RemoteFetchError(f'Fetching bytes {position}-{end} failed: {e}')
+                    time.sleep(min(2 ** failures, 30))
+                    position = self.segments[index][2]
+
+    def _stream(self, session, headers, index, position, end):
+        with session.get(self.url, headers=headers, stream=True, timeout=self.timeout,
+                         allow_redirects=False) as response:
+            if response.is_redirect:
+                raise RemoteFetchError('The remote file moved during the download')
+            if response.status_code == 429 or response.status_code >= 500:
+                raise _RetryableError(f'HTTP {response.status_code}')
+            response.raise_for_status()
+            if self.ranged and response.status_code != 206:
+                # If-Range failed: the file changed since the segments were planned
+                raise _RemoteChanged('The remote file changed during the download')
+
+            received = 0
+            with open(self.path, 'r+b') as f:
+                f.seek(position)
+                for block in response.iter_content(self.block_size):
+                    if self._stop.is_set():
+                        break
+                    if end is not None:
+                        block = block[:end - position]
+                    elif position + len(block) > settings.REMOTE_FETCH_MAX_BYTES:
+                        # No length was announced, so the limit is enforced on what arrives
+                        raise RemoteFetchError('Remote file is larger than REMOTE_FETCH_MAX_BYTES')
+                    f.write(block)
+                    position += len(block)
+                    received += len(block)
+                    f.flush()
+                    self._advance(index, position)
+                    if end is not None and position >= end:
+                        break
+            if self.ranged and position < end and not received and not self._stop.is_set():
+                raise _RetryableError('Empty response')
+        return position
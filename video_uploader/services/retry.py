@@ -0,0 +1,126 @@
+import datetime
+import random
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import Platform, UploadStatus
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped by UPLOAD_RETRY_POLICY"""
+
+    @staticmethod
+    def max_attempts():
+        return settings.UPLOAD_RETRY_POLICY['max_attempts']
+
+    @staticmethod
+    def next_retry_at(attempts, now=None):
+        """When to retry after ``attempts`` failed attempts, or None once exhausted"""
+        policy = settings.UPLOAD_RETRY_POLICY
+        if attempts >= policy['max_attempts']:
+            return None
+        ceiling = min(policy['max_delay'], policy['base_delay'] * 2 ** max(attempts - 1, 0))
+        delay = random.uniform(0, ceiling) if policy.get('jitter', True) else ceiling
+        return (now or timezone.now()) + datetime.timedelta(seconds=delay)
+
+    @staticmethod
+    def retryable_filter(now=None):
+        """UploadStatus rows that are due to be uploaded (again)"""
+        now = now or timezone.now()
+        # Pending rows with next_retry_at were deferred, e.g. for quota
+        due = Q(status='pending', next_retry_at__isnull=True) | Q(
+            status='pending',
+            next_retry_at__lte=now,
+        ) | Q(
+            status='failed',
+            next_retry_at__lte=now,
+            attempts__lt=RetryPolicy.max_attempts(),
+        )
+        from .leases import unleased_filter
+
+        # Scheduled uploads wait for their publish time, timed-out ones
+        # for the thread still sending them
+        return due & (Q(publish_at__isnull=True) | Q(publish_at__lte=now)) & unleased_filter(now)
+
+    @staticmethod
+    def outstanding_filter():
+        """UploadStatus rows that still need an upload, now or later"""
+        return Q(status='pending') | Q(
+            status='failed',
+            next_retry_at__isnull=False,
+            attempts__lt=RetryPolicy.max_attempts(),
+        )
+
+
+class CircuitBreaker:
+    """
+    Per-platform circuit breaker persisted on Platform, so it is shared by all
+    workers.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and the
+    platform gets no uploads for ``reset_timeout`` seconds. After that a single
+    trial upload is let through: success closes the circuit, failure opens it
+    again.
+    """
+
+    @staticmethod
+    def allow(platform):
+        now = timezone.now()
+        opened_until = platform.circuit_open_until
+        if opened_until is None:
+            return True
+        if opened_until > now:
+            return False
+        # Half-open: the first worker to push the deadline forward gets the trial
+        trial_until = now + datetime.timedelta(seconds=settings.UPLOAD_CIRCUIT_BREAKER['reset_timeout'])
+        claimed = Platform.objects.filter(
+            pk=platform.pk, circuit_open_until=opened_until
+        ).update(circuit_open_until=trial_until)
+        platform.circuit_open_until = trial_until if claimed else opened_until
+        return bool(claimed)
+
+    @staticmethod
+    def record_success(platform):
+        Platform.objects.filter(pk=platform.pk).exclude(
+            circuit_failures=0, circuit_open_until__isnull=True
+        ).update(circuit_failures=0, circuit_open_until=None)
+
+    @staticmethod
+    def record_failure(platform):
+        config = settings.UPLOAD_CIRCUIT_BREAKER
+        Platform.objects.filter(pk=platform.pk).update(circuit_failures=F('circuit_failures') + 1)
+        Platform.objects.filter(
+            pk=platform.pk, circuit_failures__gte=config['failure_threshold']
+        ).update(circuit_open_until=timezone.now() + datetime.timedelta(seconds=config['reset_timeout']))
+
+
+class RetryScheduler:
+    @staticmethod
+    def next_run_at(video_post):
+        """Earliest time a deferred upload of ``video_post`` becomes due, if any"""
+        candidates = []
+        rows = UploadStatus.objects.filter(
+            RetryPolicy.outstanding_filter(), video_post=video_post
+        ).select_related('platform')
+        for upload_status in rows:
+            # A row is due once its own retry time, the platform's circuit and
+            # any lease left by a timed-out upload allow it
+            times = [
+                t for t in (upload_status.next_retry_at, upload_status.platform.circuit_open_until,
+                            upload_status.lease_expires_at) if t
+            ]
+            if times:
+                candidates.append(max(times))
+        return min(candidates) if candidates else None
+
+    @staticmethod
+    def schedule(video_post):
+        """Queue a follow-up job for uploads that were deferred or failed retryably"""
+        from .job_queue import UploadJobQueue
+
+        run_at = RetryScheduler.next_run_at(video_post)
+        if run_at is not None:
+            return UploadJobQueue.enqueue(video_post, available_at=max(run_at, timezone.now()))
+        return None
@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models import F
+
+from ..models import UploadStatus, UserUploadStats, VideoPost, aggregate_status
+
+
+def status_flags(statuses):
+    flags = 0
+    for status in statuses:
+        flags |= VideoPost.STATUS_FLAGS[status]
+    return flags
+
+
+def counter_deltas(old_flags, new_flags):
+    """Change of each UserUploadStats counter when a post goes from old_flags to new_flags"""
+    deltas = {}
+    for status, counter in UserUploadStats.FLAG_COUNTERS.items():
+        bit = VideoPost.STATUS_FLAGS[status]
+        if (old_flags & bit) != (new_flags & bit):
+            deltas[counter] = 1 if new_flags & bit else -1
+    return deltas
+
+
+def apply_deltas(user_id, deltas):
+    if not deltas:
+        return
+    values = {counter: F(counter) + delta for counter, delta in deltas.items()}
+    # The row exists after the user's first post, so this is usually one UPDATE
+    if not UserUploadStats.objects.filter(user_id=user_id).update(**values):
+        UserUploadStats.objects.bulk_create([UserUploadStats(user_id=user_id)], ignore_conflicts=True)
+        UserUploadStats.objects.filter(user_id=user_id).update(**values)
+
+
+class StatusTracker:
+    """
+    Keeps VideoPost.status/status_flags and the owner's UserUploadStats in
+    step with the post's UploadStatus rows.
+
+    Call ``sync_post`` after changing UploadStatus rows with ``update()`` or
+    ``bulk_create``; saves and deletes of single rows are picked up by signals.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    @staticmethod
+    def sync_post(video_post_id):
+        # Callers usually hold a transaction already; nothing here needs a savepoint of its own
+        with transaction.atomic(savepoint=False):
+            for _ in range(StatusTracker.MAX_ATTEMPTS):
+                # The statuses and the post's stored aggregate in one query
+                rows = list(
+                    UploadStatus.objects.filter(video_post_id=video_post_id).values_list(
+                        'status', 'video_post__status', 'video_post__status_flags', 'video_post__created_by_id')
+                )
+                if rows:
+                    post = dict(zip(['status', 'status_flags', 'created_by_id'], rows[0][1:]))
+                else:
+                    post = VideoPost.objects.filter(pk=video_post_id).values(
+                        'status', 'status_flags', 'created_by_id').first()
+                    if post is None:
+                        return None
+                statuses = [row[0] for row in rows]
+                new_status = aggregate_status(statuses)
+                new_flags = status_flags(statuses)
+                if (new_status, new_flags) == (post['status'], post['status_flags']):
+                    return new_status
+
+                # Compare-and-set on the old flags so two concurrent syncs of the
+                # same post can't both apply their counter deltas
+                updated = VideoPost.objects.filter(
+                    pk=video_post_id, status_flags=post['status_flags'], status=post['status']
+                ).update(status=new_status, status_flags=new_flags)
+                if updated:
+                    apply_deltas(post['created_by_id'], counter_deltas(post['status_flags'], new_flags))
+                    return new_status
+        return None
+
+    @staticmethod
+    def post_created(video_post):
+        # A post may be created with its statuses' aggregate already set
+        deltas = counter_deltas(0, video_post.status_flags)
+        deltas['total_posts'] = 1
+        apply_deltas(video_post.created_by_id, deltas)
+
+    @staticmethod
+    def post_deleted(video_post):
+        deltas = counter_deltas(video_post.status_flags, 0)
+        deltas['total_posts'] = -1
+        UserUploadStats.objects.filter(user_id=video_post.created_by_id).update(
+            **{counter: F(counter) + delta for counter, delta in deltas.items()}
+        )
@@ -0,0 +1,100 @@
+"""
+Writes of UploadStatus rows on the upload path.
+
+A post's rows are created with one INSERT. Status changes are conditional
+UPDATEs of only the columns that change, guarded by the status the caller
+expects, so a row is never moved out of a state another worker or path has
+already changed. Byte progress is buffered in memory and written for all
+uploads of the process in one statement every UPLOAD_PROGRESS_FLUSH_INTERVAL
+seconds.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import UploadStatus
+from . import metrics
+from .events import publish_progress, publish_status
+from .status_tracker import StatusTracker
+
+
+def create_statuses(video_post, platforms, **defaults):
+    """The post's pending upload rows, in one INSERT; rows that already exist are left as they are"""
+    UploadStatus.objects.bulk_create([
+        UploadStatus(video_post=video_post, platform=platform, status='pending', **defaults)
+        for platform in platforms
+    ], ignore_conflicts=True)
+
+
+def transition(video_post, platform, expected, status, condition=None, **fields):
+    """
+    Move the upload of ``video_post`` to ``platform`` from one of the
+    ``expected`` statuses to ``status``, writing only ``fields`` besides the
+    status. ``condition`` is a Q the row must also match. Returns False
+    without writing when the row is in another status.
+    """
+    if isinstance(expected, str):
+        expected = [expected]
+    if 'uploading' in expected and status != 'uploading':
+        # The upload is over, its lease with it
+        fields.setdefault('leased_by', '')
+        fields.setdefault('lease_expires_at', None)
+    # Nothing here catches errors, so a caller's transaction needs no savepoint for this
+    with metrics.STATUS_WRITE_SECONDS.time(status=status), transaction.atomic(savepoint=False):
+        rows = UploadStatus.objects.filter(video_post=video_post, platform=platform, status__in=expected)
+        if condition is not None:
+            rows = rows.filter(condition)
+        updated = rows.update(status=status, **fields)
+        if updated:
+            StatusTracker.sync_post(video_post.id)
+    if updated:
+        publish_status(video_post.id, platform.id)
+    return bool(updated)
+
+
+class ProgressBuffer:
+    """
+    Latest byte progress of the uploads in flight in this process.
+
+    ``record`` keeps a snapshot per row and writes all pending snapshots at
+    once when the flush interval has passed; progress events go out with the
+    write. Flushes are serialized, so a row's newer snapshot is never
+    overwritten by an older one.
+    """
+
+    FIELDS = ['resumable_uri', 'bytes_sent', 'total_bytes', 'throughput']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, upload_status, flush=False):
+        """Buffer the progress fields of ``upload_status``; ``flush`` writes them now"""
+        with self._lock:
+            self._pending[upload_status.pk] = (
+                upload_status, {name: getattr(upload_status, name) for name in self.FIELDS})
+            due = flush or time.monotonic() - self._last_flush >= settings.UPLOAD_PROGRESS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered progress in one UPDATE; returns the number of rows"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+            if not pending:
+                return 0
+            with metrics.STATUS_WRITE_SECONDS.time(status='progress'):
+                UploadStatus.objects.bulk_update(
+                    [UploadStatus(pk=pk, **values) for pk, (_, values) in pending.items()], self.FIELDS)
+        for upload_status, _ in pending.values():
+            publish_progress(upload_status)
+        return len(pending)
+
+
+progress = ProgressBuffer()
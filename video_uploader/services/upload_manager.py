@@ -1,61 +1,378 @@
+import datetime
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
 from django.utils import timezone
-from ..models import UploadStatus
+from ..models import ContentUpload, UploadStatus
+from . import metrics
+from .leases import keeper as lease_keeper, lease_expiry, lease_owner, unleased_filter
+from .media_probe import InvalidMedia, MediaProbe
+from .media_source import MediaSource
 from .platform_services import PlatformServiceFactory
+from .quota import QuotaExhausted, QuotaLedger
+from .remote_fetch import RemoteFetcher
+from .retry import CircuitBreaker, RetryPolicy
+from .status_transitions import transition
+
+logger = logging.getLogger(__name__)
+
+_platform_semaphores = {}
+_platform_semaphores_lock = threading.Lock()
+
+
+def get_platform_semaphore(platform_name):
+    """Process-wide cap on simultaneous uploads to one platform"""
+    with _platform_semaphores_lock:
+        semaphore = _platform_semaphores.get(platform_name)
+        if semaphore is None:
+            limits = settings.UPLOAD_PLATFORM_CONCURRENCY
+            semaphore = threading.BoundedSemaphore(limits.get(platform_name, limits['default']))
+            _platform_semaphores[platform_name] = semaphore
+        return semaphore
+
+
+def get_service_timeout(platform_name):
+    timeouts = settings.UPLOAD_SERVICE_TIMEOUTS
+    return timeouts.get(platform_name, timeouts['default'])
+
 
 class VideoUploadManager:
+    # Most queries upload_to_platform may run for a metered platform,
+    # enforced by QueryBudgetTests: the dedupe lookup; the claim transaction
+    # (2) with its transition (3) and quota reserve (3); the finishing
+    # transition (3) and stats; the circuit reset; the content record. The
+    # first upload of a quota window also creates its ledgers (+5).
+    query_budget = 1 + 2 + 3 + 3 + 3 + 1 + 1 + 1 + 5
+
     @staticmethod
-    def upload_to_platforms(video_post):
+    def upload_to_platforms(video_post, concurrent=None):
         """Upload video to all selected platforms"""
-        results = []
-        
-        for platform in video_post.platforms.all():
-            # Get or create upload status
-            upload_status, created = UploadStatus.objects.get_or_create(
-                video_post=video_post,
-                platform=platform,
-                defaults={'status': 'pending'}
-            )
-            
-            # Update status to uploading
-            upload_status.status = 'uploading'
-            upload_status.save()
-            
-            # Get platform service
-            service = PlatformServiceFactory.get_service(platform.platform)
-            if not service:
-                upload_status.status = 'failed'
-                upload_status.error_message = f'No service available for {platform.paltform}'
-                upload_status.save()
-                continue
-            
-            # Attempt upload
-            try:
-                result = service.upload_video(video_post, platform)
-                
-                if result['success']:
-                    upload_status.status = 'success'
-                    upload_status.external_id = result.get('external_id', '')
-                    upload_status.uploaded_at = timezone.now()
+        if concurrent is None:
+            concurrent = settings.UPLOAD_FANOUT_CONCURRENT
+
+        # Only platforms that still need an upload: pending ones and failed ones
+        # whose retry is due. Platforms with an open circuit are skipped and
+        # picked up again by RetryScheduler.
+        due = video_post.upload_statuses.filter(RetryPolicy.retryable_filter()).select_related('platform')
+        due = [upload_status for upload_status in due if CircuitBreaker.allow(upload_status.platform)]
+        if not due:
+            return []
+        with ExitStack() as stack:
+            if video_post.video_file:
+                # Holding the media source open lets every platform upload share one read of the file
+                try:
+                    stack.enter_context(MediaSource.open(video_post))
+                except OSError:
+                    # Each platform reports the missing file
+                    pass
                 else:
-                    upload_status.status = 'failed'
-                    upload_status.error_message = result.get('error', 'Unknown error')
-                
-                upload_status.save()
-                results.append({
-                    'platform': platform.platform,
-                    'status': upload_status.status,
-                    'message': result.get('message', result.get('error', ''))
-                })
-                
+                    # A broken file fails every platform at once instead of after each transfer
+                    try:
+                        with metrics.STAGE_SECONDS.time(platform='', stage='probe'):
+                            MediaProbe.ensure(video_post)
+                    except InvalidMedia as e:
+                        return [
+                            VideoUploadManager._reject(video_post, upload_status.platform, str(e))
+                            for upload_status in due
+                        ]
+            if concurrent and len(due) > 1:
+                return VideoUploadManager._upload_concurrently(video_post, due)
+            return [
+                VideoUploadManager.upload_to_platform(video_post, upload_status.platform, upload_status)
+                for upload_status in due
+            ]
+
+    @staticmethod
+    def _upload_concurrently(video_post, upload_statuses):
+        """Fan out one thread per platform, each bounded by its own timeout"""
+        platforms = [upload_status.platform for upload_status in upload_statuses]
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(platforms), settings.UPLOAD_FANOUT_MAX_WORKERS),
+            thread_name_prefix=f'upload-post-{video_post.id}',
+        )
+        started = time.monotonic()
+        futures = {}
+        for upload_status in upload_statuses:
+            platform = upload_status.platform
+            future = executor.submit(VideoUploadManager._upload_in_thread, video_post, platform, upload_status)
+            futures[future] = (platform, started + get_service_timeout(platform.platform))
+
+        results = {}
+        pending = set(futures)
+        try:
+            while pending:
+                next_deadline = min(futures[future][1] for future in pending)
+                done, pending = wait(
+                    pending,
+                    timeout=max(0, next_deadline - time.monotonic()),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    platform = futures[future][0]
+                    try:
+                        results[platform.id] = future.result()
+                    except Exception as e:
+                        results[platform.id] = VideoUploadManager._finish(
+                            video_post, platform, success=False, error=str(e), error_class=type(e).__name__)
+
+                now = time.monotonic()
+                for future in [f for f in pending if futures[f][1] <= now]:
+                    pending.discard(future)
+                    future.cancel()
+                    platform = futures[future][0]
+                    timeout = get_service_timeout(platform.platform)
+                    results[platform.id] = VideoUploadManager._finish(
+                        video_post, platform, success=False,
+                        error=f'Upload to {platform.platform} timed out after {timeout}s',
+                        error_class='timeout', keep_lease=True)
+        finally:
+            # A hung service keeps its thread, but must not hold up this post
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return [results[platform.id] for platform in platforms]
+
+    @staticmethod
+    def _upload_in_thread(video_post, platform, upload_status):
+        semaphore = get_platform_semaphore(platform.platform)
+        try:
+            with semaphore:
+                return VideoUploadManager.upload_to_platform(video_post, platform, upload_status)
+        finally:
+            # Each fan-out thread opens its own DB connection
+            connection.close()
+
+    @staticmethod
+    def upload_to_platform(video_post, platform, upload_status=None):
+        """
+        Upload video to a single platform and record its status.
+        ``upload_status`` is the row as loaded by the caller, if it has it.
+        """
+        if upload_status is None:
+            upload_status = UploadStatus.objects.get(video_post=video_post, platform=platform)
+
+        # Skip the transfer if this exact file is already on the platform
+        existing = VideoUploadManager.find_existing_upload(video_post, platform)
+
+        # Get platform service
+        service = None if existing else PlatformServiceFactory.get_service(platform.platform)
+
+        # Claim and lease the upload, and spend its quota, in one transaction.
+        # A row another worker already took, or a timed-out thread is still
+        # sending, is left to it. Without budget the claim is rolled back and
+        # the upload waits for the next quota window instead of failing.
+        try:
+            with transaction.atomic():
+                claimed = transition(
+                    video_post, platform, ['pending', 'failed'], 'uploading', condition=unleased_filter(),
+                    attempts=F('attempts') + 1, next_retry_at=None,
+                    leased_by=lease_owner(), lease_expires_at=lease_expiry())
+                if claimed and service:
+                    QuotaLedger.reserve(platform, video_post.created_by_id)
+        except QuotaExhausted as e:
+            return VideoUploadManager._defer(video_post, platform, e.retry_at, str(e), error_class='quota')
+        if not claimed:
+            return VideoUploadManager._result(video_post, platform, 'pending')
+        upload_status.status = 'uploading'
+        upload_status.attempts += 1
+        upload_status.next_retry_at = None
+
+        # The heartbeat keeps the lease while this worker is alive; if it dies
+        # mid-upload, LeaseReaper recovers the row
+        with lease_keeper.hold(upload_status):
+            return VideoUploadManager._upload_claimed(video_post, platform, upload_status, service, existing)
+
+    @staticmethod
+    def _upload_claimed(video_post, platform, upload_status, service, existing):
+        """The rest of upload_to_platform, once the upload is claimed"""
+        if existing:
+            return VideoUploadManager._finish(
+                video_post, platform, success=True, external_id=existing.external_id,
+                message=f'Reused existing {platform.platform} upload {existing.external_id}',
+                platform_outcome=False)
+
+        if not service:
+            return VideoUploadManager._finish(
+                video_post, platform, success=False,
+                error=f'No service available for {platform.platform}',
+                platform_outcome=False, error_class='no_service')
+
+        # Platforms that only take files get the remote video downloaded first
+        if video_post.requires_fetch(platform):
+            try:
+                with metrics.STAGE_SECONDS.time(platform=platform.platform, stage='fetch'):
+                    RemoteFetcher.ensure(video_post)
             except Exception as e:
-                upload_status.status = 'failed'
-                upload_status.error_message = str(e)
-                upload_status.save()
-                
-                results.append({
-                    'platform': platform.platform,
-                    'status': 'failed',
-                    'message': str(e)
-                })
-        
-        return results
\ No newline at end of file
+                QuotaLedger.refund(platform, video_post.created_by_id)
+                return VideoUploadManager._finish(
+                    video_post, platform, success=False,
+                    error=f'Could not fetch {video_post.video_url}: {e}',
+                    platform_outcome=False, error_class='fetch')
+            try:
+                MediaProbe.ensure(video_post)
+            except InvalidMedia as e:
+                QuotaLedger.refund(platform, video_post.created_by_id)
+                return VideoUploadManager._reject(video_post, platform, str(e))
+            existing = VideoUploadManager.find_existing_upload(video_post, platform)
+            if existing:
+                QuotaLedger.refund(platform, video_post.created_by_id)
+                return VideoUploadManager._finish(
+                    video_post, platform, success=True, external_id=existing.external_id,
+                    message=f'Reused existing {platform.platform} upload {existing.external_id}',
+                    platform_outcome=False)
+
+        # Attempt upload
+        try:
+            with metrics.UPLOAD_SECONDS.time(platform=platform.platform):
+                result = service.upload_video(video_post, platform, upload_status=upload_status)
+        except Exception as e:
+            return VideoUploadManager._finish(
+                video_post, platform, success=False, error=str(e), error_class=type(e).__name__)
+
+        if not result['success'] and result.get('quota_exceeded'):
+            return VideoUploadManager._defer(
+                video_post, platform, QuotaLedger.exhaust(platform),
+                result.get('error', 'Quota exceeded'), attempted=True, error_class='quota')
+        if not result['success'] and result.get('retry_after') is not None:
+            # A rate-limited call is not charged against the quota
+            QuotaLedger.refund(platform, video_post.created_by_id)
+            return VideoUploadManager._defer(
+                video_post, platform, timezone.now() + datetime.timedelta(seconds=result['retry_after']),
+                result.get('error', 'Rate limited'), attempted=True, error_class='rate_limit')
+
+        return VideoUploadManager._finish(
+            video_post, platform,
+            success=result['success'],
+            external_id=result.get('external_id', ''),
+            error=result.get('error', 'Unknown error'),
+            message=result.get('message'),
+        )
+
+    @staticmethod
+    def find_existing_upload(video_post, platform):
+        if not (settings.UPLOAD_DEDUPLICATE and video_post.content_hash):
+            return None
+        return ContentUpload.objects.filter(
+            content_hash=video_post.content_hash, platform=platform, created_by_id=video_post.created_by_id
+        ).first()
+
+    @staticmethod
+    def _defer(video_post, platform, retry_at, reason, attempted=False, error_class=''):
+        """
+        Put an upload back to pending until ``retry_at`` without counting a
+        failed attempt or tripping the circuit breaker, e.g. while the
+        platform's quota is exhausted. ``attempted`` is set when the platform
+        was already called.
+        """
+        fields = {'next_retry_at': retry_at, 'error_message': reason}
+        if attempted:
+            expected = ['uploading']
+            fields['attempts'] = F('attempts') - 1
+        else:
+            expected = ['pending', 'failed']
+
+        if transition(video_post, platform, expected, 'pending', **fields):
+            metrics.OUTCOMES.inc(platform=platform.platform, outcome='deferred', error_class=error_class)
+
+        return {
+            'platform': platform.platform,
+            'status': 'pending',
+            'message': reason,
+        }
+
+    @staticmethod
+    def _reject(video_post, platform, reason):
+        """Fail an upload for good, e.g. because the file is broken; no retry is scheduled"""
+        if transition(
+                video_post, platform, ['pending', 'uploading', 'failed'], 'failed',
+                error_message=reason, next_retry_at=None):
+            metrics.OUTCOMES.inc(platform=platform.platform, outcome='failed', error_class='invalid_media')
+
+        return {
+            'platform': platform.platform,
+            'status': 'failed',
+            'message': reason,
+        }
+
+    @staticmethod
+    def _finish(video_post, platform, success, external_id='', error='', message=None, platform_outcome=True,
+                error_class='service_error', keep_lease=False):
+        """
+        Record the final state while this process still holds the upload's
+        lease. Once the lease is lost, e.g. LeaseReaper re-queued the upload
+        and another worker claimed it, the result is dropped.
+        Failures get their next retry time from RetryPolicy, and when
+        ``platform_outcome`` is set the result feeds the platform's circuit
+        breaker. ``error_class`` labels failures in the outcome metrics.
+
+        A timeout fails the upload with ``keep_lease``: the thread sending it
+        cannot be stopped, so the row stays leased and is not retried until
+        that thread is done. Its result then replaces the timeout.
+        """
+        if success:
+            status = 'success'
+            fields = {'external_id': external_id, 'uploaded_at': timezone.now()}
+        else:
+            attempts = UploadStatus.objects.filter(
+                video_post=video_post, platform=platform
+            ).values_list('attempts', flat=True).first() or 0
+            status = 'failed'
+            fields = {'error_message': error, 'next_retry_at': RetryPolicy.next_retry_at(attempts)}
+
+        if keep_lease:
+            fields.update(leased_by=F('leased_by'), lease_expires_at=F('lease_expires_at'))
+        updated = transition(
+            video_post, platform, ['uploading', 'failed', 'pending'], status,
+            condition=Q(leased_by=lease_owner(), lease_expires_at__isnull=False),
+            **fields)
+        if updated:
+            if success:
+                # Successes without a platform call reused an earlier upload
+                outcome, error_class = ('success' if platform_outcome else 'deduplicated'), ''
+            else:
+                outcome = 'failed'
+            metrics.OUTCOMES.inc(platform=platform.platform, outcome=outcome, error_class=error_class)
+
+        if updated and platform_outcome:
+            if success:
+                CircuitBreaker.record_success(platform)
+            else:
+                CircuitBreaker.record_failure(platform)
+
+        if updated and success and external_id and video_post.content_hash:
+            # An earlier upload of the same file is kept, as get_or_create would, in one INSERT
+            ContentUpload.objects.bulk_create([ContentUpload(
+                content_hash=video_post.content_hash,
+                platform=platform,
+                created_by_id=video_post.created_by_id,
+                external_id=external_id,
+                video_post=video_post,
+            )], ignore_conflicts=True)
+
+        message = message or (error if not success else '')
+        if not updated:
+            logger.warning('Dropped the %s result for post %s on %s: lost the lease',
+                           status, video_post.pk, platform.platform)
+            return VideoUploadManager._result(video_post, platform, status, message)
+        return {
+            'platform': platform.platform,
+            'status': status,
+            'message': message,
+        }
+
+    @staticmethod
+    def _result(video_post, platform, default_status, message=''):
+        """Result of an upload whose row another path changed first, with the row's current status"""
+        status = UploadStatus.objects.filter(
+            video_post=video_post, platform=platform
+        ).values_list('status', flat=True).first()
+        return {
+            'platform': platform.platform,
+            'status': status or default_status,
+            'message': message,
+        }
@@ -0,0 +1,129 @@
+import fcntl
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from ..models import UploadSession, VideoPost
+from .media_probe import InvalidMedia, probe_file
+
+# Running SHA-256 per session, so the digest is computed while chunks stream
+# in. A session whose chunks land on different processes is rehashed on
+# completion instead.
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def _take_digest(session_id, offset):
+    with _digests_lock:
+        state = _digests.pop(session_id, None)
+    if state and state[0] == offset:
+        return state[1]
+    return hashlib.sha256() if offset == 0 else None
+
+
+def _keep_digest(session_id, offset, digest):
+    if digest is not None:
+        with _digests_lock:
+            _digests[session_id] = (offset, digest)
+
+
+class OffsetMismatch(Exception):
+    """The client's offset does not match what the server has stored"""
+
+    def __init__(self, expected):
+        super().__init__(f'Expected offset {expected}')
+        self.expected = expected
+
+
+class UploadSessionManager:
+    @staticmethod
+    def start(user, filename, upload_length, metadata):
+        session = UploadSession.objects.create(
+            created_by=user,
+            filename=os.path.basename(filename),
+            upload_length=upload_length,
+            metadata=metadata,
+        )
+        path = default_storage.path(session.partial_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        return session
+
+    @staticmethod
+    def append(session, offset, stream, length=None):
+        """
+        Stream a chunk from ``stream`` into the session's partial file at
+        ``offset``. Data is copied in fixed-size blocks, so memory use does not
+        depend on the chunk or file size. Returns the new offset.
+        """
+        if offset != session.offset:
+            raise OffsetMismatch(session.offset)
+
+        remaining = session.upload_length - offset
+        if length is not None:
+            remaining = min(remaining, length)
+
+        block_size = settings.UPLOAD_SESSION_BLOCK_SIZE
+        written = 0
+        with open(default_storage.path(session.partial_name), 'r+b') as partial:
+            # One writer per session at a time. A PATCH racing for the same
+            # offset waits here, then finds the offset already moved on.
+            fcntl.flock(partial, fcntl.LOCK_EX)
+            session.refresh_from_db(fields=['offset'])
+            if offset != session.offset:
+                raise OffsetMismatch(session.offset)
+            digest = _take_digest(session.pk, offset)
+            partial.seek(offset)
+            while written < remaining:
+                block = stream.read(min(block_size, remaining - written))
+                if not block:
+                    break
+                partial.write(block)
+                if digest is not None:
+                    digest.update(block)
+                written += len(block)
+            # Anything past the last acknowledged byte belongs to no one
+            partial.truncate(offset + written)
+
+            new_offset = offset + written
+            UploadSession.objects.filter(pk=session.pk).update(offset=new_offset)
+            session.offset = new_offset
+            _keep_digest(session.pk, new_offset, digest)
+        return new_offset
+
+    @staticmethod
+    def finalize(session, request):
+        """Move the completed file into place and create its VideoPost"""
+        from ..serializers import VideoPostSerializer
+
+        from rest_framework.exceptions import ValidationError
+
+        serializer = VideoPostSerializer(data=session.metadata, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        path = default_storage.path(session.partial_name)
+        try:
+            media_info = probe_file(session.filename, path=path)
+        except InvalidMedia as e:
+            raise ValidationError({'video_file': str(e)})
+
+        digest = _take_digest(session.pk, session.offset)
+        storage = VideoPost._meta.get_field('video_file').storage
+        name = storage.ingest(path, session.filename, digest.hexdigest() if digest is not None else None)
+
+        with transaction.atomic():
+            video_post = serializer.save(video_file=name, media_info=media_info)
+            session.video_post = video_post
+            session.save(update_fields=['video_post', 'updated_at'])
+        return video_post
+
+    @staticmethod
+    def discard(session):
+        _take_digest(session.pk, None)
+        if default_storage.exists(session.partial_name):
+            default_storage.delete(session.partial_name)
+        session.delete()
@@ -0,0 +1,366 @@
+from django.conf import settings
+
+import google.auth.exceptions
+import google.auth.transport.requests
+import google_auth_oauthlib.flow
+import googleapiclient.discovery
+import googleapiclient.discovery_cache
+import googleapiclient.errors 
+import googleapiclient.http 
+
+import datetime
+import logging
+import mimetypes
+import os
+import pickle
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+from . import metrics
+from .cache import TTLCache
+from .locks import KeyedLock
+from .media_source import MediaSource
+from .platform_services import BasePlatformService
+from .status_transitions import progress
+
+
+logger = logging.getLogger(__name__)
+
+# Error reasons YouTube reports for an exhausted daily quota and for rate limiting
+QUOTA_ERROR_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+_discovery_documents = {}
+_discovery_lock = threading.Lock()
+
+
+class YouTubeAuthError(Exception):
+    """A user has no usable YouTube credentials; they must authorize again with authorize_youtube"""
+
+
+def get_discovery_document(api_service_name, api_version):
+    """
+    Discovery document for building API clients without a network round-trip.
+
+    Read once per process from ``YOUTUBE_DISCOVERY_DOCUMENT`` when set, or
+    else from the copy bundled with googleapiclient.
+    """
+    key = (api_service_name, api_version)
+    with _discovery_lock:
+        document = _discovery_documents.get(key)
+        if document is None:
+            if settings.YOUTUBE_DISCOVERY_DOCUMENT:
+                with open(settings.YOUTUBE_DISCOVERY_DOCUMENT) as f:
+                    document = f.read()
+            else:
+                document = googleapiclient.discovery_cache.get_static_doc(api_service_name, api_version)
+            if document is None:
+                raise RuntimeError(f"No discovery document for {api_service_name} {api_version}")
+            _discovery_documents[key] = document
+        return document
+
+
+class YouTubeService(BasePlatformService):
+    def __init__(self):
+        self.scopes = ['https://www.googleapis.com/auth/youtube.upload']
+        self.api_service_name = 'youtube'
+        self.api_version = 'v3'
+        self.client_id = settings.CLIENT_ID
+        self.client_secret = settings.CLIENT_SECRET
+        self.redirect_uri = settings.YOUTUBE_REDIRECT_URI
+        # Credentials per user, and a pool of idle clients per user: the
+        # httplib2 transport underneath a client is not thread-safe, so each
+        # client is used by one thread at a time
+        self.credentials = TTLCache(
+            settings.YOUTUBE_CREDENTIAL_CACHE_SIZE, settings.YOUTUBE_CREDENTIAL_CACHE_TTL, name='youtube_credentials')
+        self.clients = TTLCache(settings.YOUTUBE_CLIENT_CACHE_SIZE, settings.YOUTUBE_CLIENT_CACHE_TTL)
+        self._clients_lock = threading.Lock()
+        # Only users with a refresh in progress have a lock
+        self._user_lock = KeyedLock()
+
+    def _load_credentials(self, credentials_file, user_id):
+        if not os.path.exists(credentials_file):
+            return None
+        try:
+            with open(credentials_file, 'rb') as token:
+                return pickle.load(token)
+        except Exception as e:
+            logger.warning("Discarding unreadable YouTube credentials of user %s: %s", user_id, e)
+            os.remove(credentials_file)
+            return None
+
+    def _save_credentials(self, credentials_file, credentials, user_id):
+        try:
+            with open(credentials_file, 'wb') as token:
+                pickle.dump(credentials, token)
+        except Exception as e:
+            logger.error("Could not save YouTube credentials of user %s: %s", user_id, e)
+
+    def _expires_soon(self, credentials):
+        if credentials.expiry is None:
+            return False
+        # google-auth keeps expiry as a naive UTC datetime
+        margin = datetime.timedelta(seconds=settings.YOUTUBE_TOKEN_REFRESH_MARGIN)
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return credentials.expiry - margin <= now
+
+    def _refresh(self, credentials, credentials_file, user_id):
+        """Refresh through the refresh token; returns False if that is not possible"""
+        if not getattr(credentials, 'refresh_token', None):
+            return False
+        try:
+            credentials.refresh(google.auth.transport.requests.Request())
+        except google.auth.exceptions.RefreshError as e:
+            logger.warning("YouTube token refresh failed for user %s: %s", user_id, e)
+            return False
+        self._save_credentials(credentials_file, credentials, user_id)
+        return True
+
+    def _run_oauth_flow(self, user_id):
+        flow = google_auth_oauthlib.flow.InstalledAppFlow.from_client_config(
+            {
+                'installed': {
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'redirect_uris': [self.redirect_uri],
+                    'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+                    'token_uri': 'https://oauth2.googleapis.com/token'
+                }
+            },
+            self.scopes
+        )
+        flow.redirect_uri = self.redirect_uri
+        try:
+            credentials = flow.run_local_server(
+                port=8192,
+                open_browser=True,
+                redirect_uri_mismatch_message="Mismatch in redirect URI. Please ensure http://localhost:8192/oauth2callback is added to Google Cloud Console."
+            )
+            logger.info("Obtained YouTube credentials for user %s", user_id)
+        except Exception as e:
+            logger.error("YouTube OAuth flow failed for user %s: %s", user_id, e)
+            raise
+        return credentials
+
+    def authorize(self, user_id):
+        """Run the interactive OAuth flow for ``user_id`` and store the credentials"""
+        credentials = self._run_oauth_flow(user_id)
+        self._save_credentials(f'youtube_credentials_{user_id}.pickle', credentials, user_id)
+        self.credentials.set(user_id, credentials)
+        return credentials
+
+    def get_credentials(self, user_id):
+        """
+        Return valid credentials for ``user_id``, from the in-process cache
+        when possible. Tokens close to expiry are refreshed ahead of time with
+        the refresh token. Without usable credentials this raises
+        YouTubeAuthError: the interactive OAuth flow would block a worker
+        thread, it only runs through ``authorize``.
+        """
+        credentials = self.credentials.get(user_id)
+        if credentials is not None and credentials.valid and not self._expires_soon(credentials):
+            return credentials
+
+        # One refresh per user at a time, concurrent uploads wait for it
+        with metrics.STAGE_SECONDS.time(platform='youtube', stage='credentials'), self._user_lock(user_id):
+            credentials = self.credentials.get(user_id)
+            if credentials is not None and credentials.valid and not self._expires_soon(credentials):
+                return credentials
+
+            credentials_file = f'youtube_credentials_{user_id}.pickle'
+            if credentials is None:
+                credentials = self._load_credentials(credentials_file, user_id)
+
+            if credentials is not None and (not credentials.valid or self._expires_soon(credentials)):
+                if not self._refresh(credentials, credentials_file, user_id) and not credentials.valid:
+                    credentials = None
+
+            if credentials is None:
+                raise YouTubeAuthError(
+                    f"No valid YouTube credentials for user {user_id}; "
+                    f"run 'python manage.py authorize_youtube {user_id}'")
+
+            self.credentials.set(user_id, credentials)
+            return credentials
+
+    @contextmanager
+    def authenticated_service(self, user_id):
+        """A client for ``user_id``, taken from the user's pool for the duration of the block"""
+        credentials = self.get_credentials(user_id)
+        with self._clients_lock:
+            idle = self.clients.get(user_id) or []
+            # A client stays valid while it wraps the cached credentials
+            # object, refreshes update that object in place; clients of
+            # replaced credentials are dropped
+            idle[:] = [entry for entry in idle if entry[0] is credentials]
+            client = idle.pop()[1] if idle else None
+        metrics.CACHE_REQUESTS.inc(cache='youtube_clients', result='miss' if client is None else 'hit')
+        if client is None:
+            client = self._build_client(credentials)
+        try:
+            yield client
+        finally:
+            with self._clients_lock:
+                idle = self.clients.get(user_id)
+                if idle is None:
+                    idle = []
+                    self.clients.set(user_id, idle)
+                if len(idle) < settings.YOUTUBE_CLIENT_POOL_SIZE:
+                    idle.append((credentials, client))
+
+    def _build_client(self, credentials):
+        # YOUTUBE_API_ENDPOINT points the client at a stand-in server when testing
+        client_options = {'api_endpoint': settings.YOUTUBE_API_ENDPOINT} if settings.YOUTUBE_API_ENDPOINT else None
+        with metrics.STAGE_SECONDS.time(platform='youtube', stage='client'):
+            return googleapiclient.discovery.build_from_document(
+                get_discovery_document(self.api_service_name, self.api_version),
+                credentials=credentials,
+                client_options=client_options)
+
+    def _insert_request(self, youtube, request_body, media):
+        request = youtube.videos().insert(
+            part='snippet,status',
+            body=request_body,
+            media_body=media
+        )
+        if settings.YOUTUBE_API_ENDPOINT:
+            # googleapiclient only swaps the host of media URLs, keep the endpoint's scheme too
+            endpoint = urllib.parse.urlparse(settings.YOUTUBE_API_ENDPOINT)
+            request.uri = urllib.parse.urlparse(request.uri)._replace(
+                scheme=endpoint.scheme, netloc=endpoint.netloc).geturl()
+        return request
+
+    def _send_chunks(self, request, upload_status=None):
+        """
+        Drive a resumable upload chunk by chunk, recording the session URI and
+        acknowledged offset on ``upload_status`` so a later attempt can resume.
+        """
+        if upload_status and upload_status.resumable_uri:
+            # Resume the session of a previous attempt. Flagging the request as
+            # errored makes the first next_chunk() ask the server for the last
+            # byte it acknowledged instead of trusting our stored offset.
+            request.resumable_uri = upload_status.resumable_uri
+            request.resumable_progress = upload_status.bytes_sent
+            request._in_error_state = True
+
+        total_bytes = request.resumable.size()
+        # Bytes acknowledged before this run don't count towards throughput
+        start_offset = request.resumable_progress
+        started_at = time.monotonic()
+        response = None
+        acknowledged = start_offset
+        try:
+            while response is None:
+                status, response = request.next_chunk(num_retries=settings.YOUTUBE_UPLOAD_NUM_RETRIES)
+                bytes_sent = status.resumable_progress if status else total_bytes
+                elapsed = time.monotonic() - started_at
+                metrics.UPLOAD_BYTES.inc(max(bytes_sent - acknowledged, 0), platform='youtube')
+                acknowledged = bytes_sent
+                self._save_progress(
+                    upload_status,
+                    resumable_uri=request.resumable_uri if response is None else '',
+                    bytes_sent=bytes_sent,
+                    total_bytes=total_bytes,
+                    throughput=(bytes_sent - start_offset) / elapsed if elapsed > 0 else 0,
+                )
+        finally:
+            # The final offset is what a later attempt resumes from
+            if upload_status is not None:
+                progress.flush()
+        elapsed = time.monotonic() - started_at
+        if elapsed > 0:
+            metrics.UPLOAD_THROUGHPUT.observe((total_bytes - start_offset) / elapsed, platform='youtube')
+        return response
+
+    @staticmethod
+    def _save_progress(upload_status, flush=False, **fields):
+        if upload_status is None:
+            return
+        # A new session URI is written at once, so a crashed worker's upload can still resume
+        new_session = fields.get('resumable_uri', upload_status.resumable_uri) != upload_status.resumable_uri
+        for name, value in fields.items():
+            setattr(upload_status, name, value)
+        progress.record(upload_status, flush=flush or new_session)
+
+    @staticmethod
+    def _error_reasons(error):
+        details = getattr(error, 'error_details', None)
+        if not isinstance(details, list):
+            return set()
+        return {detail.get('reason') for detail in details if isinstance(detail, dict)}
+
+    @staticmethod
+    def _retry_after(error):
+        try:
+            return max(int(error.resp.get('retry-after', '')), 1)
+        except ValueError:
+            return settings.UPLOAD_RATE_LIMIT_BACKOFF
+
+    def upload_video(self, video_post, platform, upload_status=None):
+        try:
+            user_id = video_post.created_by.id
+            
+            request_body = {
+                'snippet': {
+                    'title': video_post.title,
+                    'description': video_post.description,
+                    'tags': ['video', 'upload'],
+                    'categoryId': '22'  # People & Blogs
+                },
+                'status': {
+                    'privacyStatus': 'public'
+                }
+            }
+            
+            if not video_post.video_file:
+                raise Exception("Video file is required for YouTube upload")
+            
+            with self.authenticated_service(user_id) as youtube:
+                # Read through the post's shared media source, which works with any
+                # storage backend and is read once for all platforms
+                with MediaSource.open(video_post) as source:
+                    media = googleapiclient.http.MediaIoBaseUpload(
+                        source.reader(),
+                        mimetype=mimetypes.guess_type(source.name)[0] or 'application/octet-stream',
+                        chunksize=settings.YOUTUBE_UPLOAD_CHUNK_SIZE,
+                        resumable=True
+                    )
+                    
+                    videos_insert_request = self._insert_request(youtube, request_body, media)
+                    
+                    try:
+                        response = self._send_chunks(videos_insert_request, upload_status)
+                    except googleapiclient.errors.HttpError as e:
+                        if not (upload_status and upload_status.resumable_uri and e.resp.status in (404, 410)):
+                            raise
+                        # The stored session expired on Google's side, start a fresh one
+                        self._save_progress(upload_status, flush=True, resumable_uri='', bytes_sent=0)
+                        videos_insert_request = self._insert_request(youtube, request_body, media)
+                        response = self._send_chunks(videos_insert_request, upload_status)
+            
+            return {
+                'success': True,
+                'external_id': response.get('id', f'youtube_video_{video_post.id}'),
+                'message': 'Successfully uploaded to YouTube'
+            }
+        
+        except googleapiclient.errors.HttpError as e:
+            logger.warning("YouTube API error uploading post %s: %s", video_post.id, e)
+            result = {
+                'success': False,
+                'error': f"YouTube API error: {str(e)}"
+            }
+            reasons = self._error_reasons(e)
+            if reasons & QUOTA_ERROR_REASONS:
+                result['quota_exceeded'] = True
+            elif reasons & RATE_LIMIT_REASONS or e.resp.status == 429:
+                result['retry_after'] = self._retry_after(e)
+            return result
+        except Exception as e:
+            logger.exception("YouTube upload of post %s failed", video_post.id)
+            return {
+                'success': False,
+                'error': str(e)
+            }
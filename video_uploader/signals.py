@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import UploadStatus, VideoPost
+from .services.events import publish_status
+from .services.status_tracker import StatusTracker
+
+
+@receiver(post_save, sender=VideoPost)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        StatusTracker.post_created(instance)
+
+
+@receiver(post_delete, sender=VideoPost)
+def uncount_deleted_post(sender, instance, **kwargs):
+    StatusTracker.post_deleted(instance)
+
+
+@receiver(post_save, sender=UploadStatus)
+def sync_post_status(sender, instance, raw=False, **kwargs):
+    # Deleted rows are not synced: they only go away with their post, which
+    # uncount_deleted_post already accounts for
+    if not raw:
+        StatusTracker.sync_post(instance.video_post_id)
+        publish_status(instance.video_post_id, instance.platform_id)
@@ -0,0 +1,114 @@
+import hashlib
+import mmap
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def file_sha256(path):
+    """SHA-256 of a local file, read through mmap in large windows"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                # hashlib releases the GIL for large buffers, so several of
+                # these can run in parallel threads
+                for start in range(0, size, HASH_BLOCK_SIZE):
+                    digest.update(view[start:start + HASH_BLOCK_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage that names every file after the SHA-256 of its content.
+
+    Files land at ``<prefix>/<ab>/<digest><ext>``; saving content that is
+    already stored returns the existing name without writing a second copy.
+    """
+
+    def __init__(self, prefix='videos', **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def content_name(self, digest, original_name):
+        ext = os.path.splitext(original_name)[1].lower()
+        return posixpath.join(self.prefix, digest[:2], f'{digest}{ext}')
+
+    @staticmethod
+    def digest_from_name(name):
+        """Content hash encoded in a stored name, or '' for legacy names"""
+        digest = os.path.splitext(posixpath.basename(name or ''))[0]
+        return digest if _DIGEST_RE.match(digest) else ''
+
+    def _tmp_dir(self):
+        path = self.path(posixpath.join(self.prefix, '.tmp'))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            from django.core.files import File
+            content = File(content, name)
+
+        # Hash while streaming into a temp file next to the final location
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir())
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            return self.ingest(tmp_path, name, digest.hexdigest())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def ingest(self, path, original_name, digest=None, keep=False):
+        """
+        Move a local file into the store, dropping it if already stored.
+        With ``keep`` the file is linked, or copied, and left in place.
+        """
+        if digest is None:
+            digest = file_sha256(path)
+        name = self.content_name(digest, original_name)
+        target = self.path(name)
+        if os.path.exists(target):
+            if not keep:
+                os.remove(path)
+        elif keep:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except OSError:
+                # Other filesystem, or no hard links: copy, then rename into place
+                fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir())
+                os.close(fd)
+                try:
+                    shutil.copyfile(path, tmp_path)
+                    os.replace(tmp_path, target)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        return name
+
+
+def get_video_storage():
+    return ContentAddressedStorage()
@@ -0,0 +1,102 @@
+"""
+Server-sent event streams of upload status and progress.
+
+These are plain async Django views rather than DRF views so that a stream
+holds no thread while it waits; serve the project with an ASGI server.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+
+from .models import VideoPost
+from .services.events import broker, history
+
+
+async def _authenticate(request):
+    """Session user, or the owner of an ``Authorization: Token <key>`` header"""
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword == 'Token' and key.strip():
+        token = await Token.objects.select_related('user').filter(key=key.strip()).afirst()
+        if token and token.user.is_active:
+            return token.user
+    return None
+
+
+def _last_event_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format(message):
+    data = json.dumps(message['data'], cls=DjangoJSONEncoder)
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {data}\n\n"
+
+
+async def _event_stream(topics, last_event_id, filters):
+    # Subscribe before reading the history so no event falls in between
+    subscription = broker.subscribe(topics)
+    try:
+        yield 'retry: 3000\n\n'
+        last_id = 0
+        if last_event_id is not None:
+            for message in await sync_to_async(history)(last_event_id, **filters):
+                last_id = message['id']
+                yield _format(message)
+
+        while True:
+            try:
+                message = await subscription.get(timeout=settings.UPLOAD_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if subscription.dropped:
+                # The client fell behind; it should refetch the post to catch up
+                yield f"event: lagged\ndata: {json.dumps({'dropped': subscription.dropped})}\n\n"
+                subscription.dropped = 0
+            if message['id'] <= last_id:
+                continue
+            last_id = message['id']
+            yield _format(message)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def _stream_response(topics, last_event_id, filters):
+    response = StreamingHttpResponse(
+        _event_stream(topics, last_event_id, filters), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _unauthorized():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+
+async def user_events(request):
+    """Events of all the current user's posts"""
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    return _stream_response([f'user:{user.id}'], _last_event_id(request), {'user_id': user.id})
+
+
+async def post_events(request, pk):
+    """Events of one of the current user's posts"""
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    if not await VideoPost.objects.filter(pk=pk, created_by=user).aexists():
+        return JsonResponse({'detail': 'No VideoPost matches the given query.'}, status=404)
+    return _stream_response([f'post:{pk}'], _last_event_id(request), {'video_post_id': pk})
@@ -1,3 +1,1863 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import fcntl
+import glob
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.metadata import EntryPoint
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from google.oauth2.credentials import Credentials
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from .middleware import QueryProfile, query_budget
+from .models import (
+    Platform, RemoteFetch, UploadEvent, UploadEventListener, UploadJob, UploadSession, UploadShare, UploadStatus,
+    UserUploadStats, VideoPost,
+)
+from .services.events import ListenerPresence, broker, message, prune, topics
+from .services.job_queue import UploadJobQueue
+from .services.leases import LeaseReaper, keeper, lease_expiry, lease_owner
+from .services.media_probe import InvalidMedia, _boxes, _child, probe_path, rewrite_faststart
+from .services.media_source import MediaSource
+from .services.metrics import Counter, Histogram, Registry, registry
+from .services.platform_services import DailymotionService, PlatformServiceFactory, VimeoService
+from .services.publishing import PublishDispatcher, run_dispatcher
+from .services import remote_fetch
+from .services.remote_fetch import PinnedAdapter, RemoteFetchError, RemoteFetcher, check_url
+from .services.upload_sessions import OffsetMismatch, UploadSessionManager
+from .services.quota import QuotaExhausted, QuotaLedger
+from .services.retry import CircuitBreaker, RetryPolicy, RetryScheduler
+from .services.status_tracker import StatusTracker, counter_deltas
+from .services.status_transitions import ProgressBuffer, create_statuses, transition
+from .services.upload_manager import VideoUploadManager
+from .services.youtube_service import YouTubeAuthError, YouTubeService
+from .storage import file_sha256
+from .views import PlatformViewSet, VideoPostViewSet
+
+
+def make_post(user, platforms=(), **fields):
+    """A post by ``user``, pending on ``platforms``"""
+    fields = {'title': 'Post', 'description': 'Description', 'video_url': 'https://example.com/video.mp4', **fields}
+    post = VideoPost.objects.create(created_by=user, **fields)
+    if platforms:
+        create_statuses(post, platforms)
+    return post
+
+
+class VideoPostOverallStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube = Platform.objects.create(platform='youtube')
+        cls.vimeo = Platform.objects.create(platform='vimeo')
+
+    def make_post(self, *statuses):
+        post = make_post(self.user)
+        for platform, status in zip([self.youtube, self.vimeo], statuses):
+            UploadStatus.objects.create(video_post=post, platform=platform, status=status)
+        return post
+
+    def test_annotation_matches_property(self):
+        cases = [
+            (), ('success', 'success'), ('success', 'failed'), ('failed', 'pending'),
+            ('uploading', 'pending'), ('pending', 'success'), ('uploading', 'success'),
+        ]
+        posts = [self.make_post(*statuses) for statuses in cases]
+
+        annotated = VideoPost.objects.with_overall_status().in_bulk([post.pk for post in posts])
+        for post in posts:
+            with self.subTest(statuses=[s.status for s in post.upload_statuses.all()]):
+                self.assertEqual(annotated[post.pk].overall_status, VideoPost.objects.get(pk=post.pk).overall_status)
+
+
+class UploadJobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.posts = [make_post(cls.user, title=f'Post {index}') for index in range(2)]
+
+    def test_racing_claimers_get_different_jobs(self):
+        first, second = [UploadJobQueue.enqueue(post) for post in self.posts]
+        update = QuerySet.update
+        rival = []
+
+        def racing_update(queryset, **kwargs):
+            if not rival:
+                # Another worker claims between this worker's read and its update
+                rival.append(None)
+                rival[0] = UploadJobQueue.claim('rival')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            job = UploadJobQueue.claim('worker')
+        self.assertEqual(rival[0].pk, first.pk)
+        self.assertEqual(job.pk, second.pk)
+        self.assertEqual(
+            dict(UploadJob.objects.values_list('pk', 'locked_by')), {first.pk: 'rival', second.pk: 'worker'})
+        self.assertIsNone(UploadJobQueue.claim('late'))
+
+    def test_stalled_worker_cannot_finish_a_reclaimed_job(self):
+        UploadJobQueue.enqueue(self.posts[0])
+        stalled = UploadJobQueue.claim('worker')
+        UploadJob.objects.filter(pk=stalled.pk).update(
+            locked_at=timezone.now() - datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS + 1))
+        with self.assertLogs('video_uploader.services.leases', 'WARNING'):
+            self.assertEqual(LeaseReaper.reap_jobs(), (1, 0))
+        self.assertEqual(UploadJobQueue.claim('rival').pk, stalled.pk)
+
+        with self.assertLogs('video_uploader.services.job_queue', 'WARNING'):
+            self.assertFalse(UploadJobQueue.complete(stalled))
+            self.assertFalse(UploadJobQueue.fail(stalled, 'late'))
+        job = UploadJob.objects.get(pk=stalled.pk)
+        self.assertEqual((job.status, job.locked_by, job.finished_at), ('running', 'rival', None))
+        self.assertTrue(UploadJobQueue.complete(job))
+
+    def test_future_job_is_not_claimed(self):
+        later = timezone.now() + datetime.timedelta(minutes=5)
+        job = UploadJobQueue.enqueue(self.posts[0], available_at=later)
+        self.assertIsNone(UploadJobQueue.claim('worker'))
+
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(UploadJobQueue.claim('worker').pk, job.pk)
+
+
+@override_settings(UPLOAD_SERVICE_TIMEOUTS={'default': 5, 'youtube': 0.2}, UPLOAD_EVENTS_ENABLED=False)
+class UploadFanoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube, cls.vimeo = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+        cls.post = make_post(cls.user, [cls.youtube, cls.vimeo])
+
+    def test_hung_platform_times_out_and_keeps_its_lease(self):
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+
+        def upload(video_post, platform, upload_status=None):
+            if platform == self.youtube:
+                # Claimed, then the service stops answering
+                hung.wait(5)
+            return {'platform': platform.platform, 'status': 'success', 'message': ''}
+
+        transition(self.post, self.youtube, 'pending', 'uploading', attempts=1,
+                   leased_by=lease_owner(), lease_expires_at=lease_expiry())
+        statuses = list(self.post.upload_statuses.select_related('platform').order_by('platform'))
+        with mock.patch.object(VideoUploadManager, 'upload_to_platform', side_effect=upload):
+            results = VideoUploadManager._upload_concurrently(self.post, statuses)
+
+        self.assertEqual([result['status'] for result in results], ['failed', 'success'])
+        self.assertIn('timed out', results[0]['message'])
+        youtube = UploadStatus.objects.get(video_post=self.post, platform=self.youtube)
+        self.assertEqual((youtube.status, youtube.leased_by), ('failed', lease_owner()))
+
+        # The thread may still be sending, so the upload is not due or claimed again
+        later = timezone.now() + datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS - 10)
+        self.assertFalse(UploadStatus.objects.filter(RetryPolicy.retryable_filter(later), pk=youtube.pk).exists())
+        UploadStatus.objects.filter(pk=youtube.pk).update(next_retry_at=timezone.now())
+        with mock.patch('video_uploader.services.upload_manager.PlatformServiceFactory.get_service') as get_service:
+            VideoUploadManager.upload_to_platform(self.post, self.youtube)
+        get_service.return_value.upload_video.assert_not_called()
+
+        # When the thread finishes, its result replaces the timeout
+        VideoUploadManager._finish(self.post, self.youtube, success=True, external_id='late', platform_outcome=False)
+        youtube.refresh_from_db()
+        self.assertEqual((youtube.status, youtube.external_id, youtube.leased_by), ('success', 'late', ''))
+
+
+class StatusTrackerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube, cls.vimeo = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+
+    def make_post(self):
+        post = make_post(self.user, [self.youtube, self.vimeo])
+        StatusTracker.sync_post(post.id)
+        return post
+
+    def stats(self):
+        return UserUploadStats.objects.filter(user=self.user).values(
+            'total_posts', 'successful_uploads', 'failed_uploads', 'pending_uploads').get()
+
+    def test_counter_deltas(self):
+        pending, success, failed = (VideoPost.STATUS_FLAGS[name] for name in ('pending', 'success', 'failed'))
+        self.assertEqual(counter_deltas(pending, pending | success), {'successful_uploads': 1})
+        self.assertEqual(counter_deltas(pending | success, success | failed),
+                         {'pending_uploads': -1, 'failed_uploads': 1})
+        self.assertEqual(counter_deltas(success, success), {})
+
+    def test_transitions_keep_counters(self):
+        post = self.make_post()
+        self.make_post()
+        self.assertEqual(self.stats(), {
+            'total_posts': 2, 'successful_uploads': 0, 'failed_uploads': 0, 'pending_uploads': 2})
+
+        transition(post, self.youtube, 'pending', 'success')
+        transition(post, self.vimeo, 'pending', 'failed')
+        self.assertEqual(VideoPost.objects.get(pk=post.pk).status, 'partial')
+        self.assertEqual(self.stats(), {
+            'total_posts': 2, 'successful_uploads': 1, 'failed_uploads': 1, 'pending_uploads': 1})
+
+        VideoPost.objects.get(pk=post.pk).delete()
+        self.assertEqual(self.stats(), {
+            'total_posts': 1, 'successful_uploads': 0, 'failed_uploads': 0, 'pending_uploads': 1})
+
+    def test_reconcile_repairs_drift(self):
+        post = self.make_post()
+        # Writes that bypassed StatusTracker
+        UploadStatus.objects.filter(video_post=post).update(status='success')
+        UserUploadStats.objects.filter(user=self.user).update(total_posts=7, failed_uploads=3)
+
+        call_command('reconcile_upload_stats', stdout=io.StringIO())
+        self.assertEqual(VideoPost.objects.get(pk=post.pk).status, 'success')
+        self.assertEqual(self.stats(), {
+            'total_posts': 1, 'successful_uploads': 1, 'failed_uploads': 0, 'pending_uploads': 0})
+
+
+@override_settings(
+    UPLOAD_RETRY_POLICY={'max_attempts': 5, 'base_delay': 30, 'max_delay': 100, 'jitter': True},
+    UPLOAD_CIRCUIT_BREAKER={'failure_threshold': 3, 'reset_timeout': 60},
+)
+class RetryPolicyTests(TestCase):
+    def test_backoff_bounds(self):
+        now = timezone.now()
+        for attempts, ceiling in [(1, 30), (2, 60), (3, 100), (4, 100)]:
+            with self.subTest(attempts=attempts):
+                for _ in range(20):
+                    delay = (RetryPolicy.next_retry_at(attempts, now) - now).total_seconds()
+                    self.assertTrue(0 <= delay <= ceiling, delay)
+                with mock.patch('random.uniform', side_effect=lambda low, high: high):
+                    self.assertEqual((RetryPolicy.next_retry_at(attempts, now) - now).total_seconds(), ceiling)
+        self.assertIsNone(RetryPolicy.next_retry_at(5, now))
+
+    @override_settings(UPLOAD_RETRY_POLICY={'max_attempts': 5, 'base_delay': 30, 'max_delay': 100, 'jitter': False})
+    def test_backoff_without_jitter(self):
+        now = timezone.now()
+        self.assertEqual([(RetryPolicy.next_retry_at(attempts, now) - now).total_seconds() for attempts in (1, 2, 3)],
+                         [30, 60, 100])
+
+    def test_circuit_breaker(self):
+        platform = Platform.objects.create(platform='vimeo')
+        for _ in range(2):
+            CircuitBreaker.record_failure(platform)
+        platform.refresh_from_db()
+        self.assertTrue(CircuitBreaker.allow(platform))
+
+        CircuitBreaker.record_failure(platform)
+        platform.refresh_from_db()
+        self.assertFalse(CircuitBreaker.allow(platform))
+
+        # After reset_timeout one trial upload is let through, the others wait for it
+        later = platform.circuit_open_until + datetime.timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertTrue(CircuitBreaker.allow(platform))
+            self.assertFalse(CircuitBreaker.allow(Platform.objects.get(pk=platform.pk)))
+
+        CircuitBreaker.record_success(platform)
+        platform.refresh_from_db()
+        self.assertEqual((platform.circuit_failures, platform.circuit_open_until), (0, None))
+        self.assertTrue(CircuitBreaker.allow(platform))
+
+
+@override_settings(
+    UPLOAD_PLATFORM_QUOTAS={'vimeo': {'cost': 10, 'limit': 10, 'window': 60 * 60}}, UPLOAD_EVENTS_ENABLED=False)
+class QuotaLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.vimeo = Platform.objects.create(platform='vimeo')
+
+    def test_reserve(self):
+        QuotaLedger.reserve(self.vimeo, self.user.id)
+        with self.assertRaises(QuotaExhausted) as raised:
+            QuotaLedger.reserve(self.vimeo, self.user.id)
+        self.assertEqual(raised.exception.retry_at, QuotaLedger.window(QuotaLedger.config(self.vimeo))[1])
+
+        QuotaLedger.refund(self.vimeo, self.user.id)
+        QuotaLedger.reserve(self.vimeo, self.user.id)
+
+    def test_exhausted_quota_defers_instead_of_failing(self):
+        QuotaLedger.reserve(self.vimeo, self.user.id)
+        post = make_post(self.user, [self.vimeo])
+        with mock.patch('video_uploader.services.upload_manager.PlatformServiceFactory.get_service') as get_service:
+            result = VideoUploadManager.upload_to_platform(post, self.vimeo)
+        get_service.return_value.upload_video.assert_not_called()
+        self.assertEqual(result['status'], 'pending')
+
+        resets_at = QuotaLedger.window(QuotaLedger.config(self.vimeo))[1]
+        upload_status = UploadStatus.objects.get(video_post=post)
+        self.assertEqual((upload_status.status, upload_status.attempts), ('pending', 0))
+        self.assertEqual(upload_status.next_retry_at, resets_at)
+        # The follow-up job waits for the next quota window
+        self.assertEqual(RetryScheduler.schedule(post).available_at, resets_at)
+
+
+@override_settings(UPLOAD_DEDUPLICATE=True, UPLOAD_EVENTS_ENABLED=False)
+class DeduplicationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='secret')
+        cls.bob = User.objects.create_user('bob', password='secret')
+        cls.vimeo = Platform.objects.create(platform='vimeo')
+
+    def upload(self, user):
+        post = make_post(user, [self.vimeo], content_hash='a' * 64)
+        with mock.patch('video_uploader.services.upload_manager.PlatformServiceFactory.get_service') as get_service:
+            get_service.return_value.upload_video.return_value = {
+                'success': True, 'external_id': f'{user.username}-video'}
+            VideoUploadManager.upload_to_platform(post, self.vimeo)
+        return get_service.return_value.upload_video.call_count, UploadStatus.objects.get(video_post=post).external_id
+
+    def test_reuse_is_limited_to_the_owner(self):
+        self.assertEqual(self.upload(self.alice), (1, 'alice-video'))
+        # The same bytes from another user go to that user's own channel
+        self.assertEqual(self.upload(self.bob), (1, 'bob-video'))
+        self.assertEqual(self.upload(self.alice), (0, 'alice-video'))
+
+
+class BackfillContentHashesTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.media_root = media_root
+        self.user = User.objects.create_user('owner', password='secret')
+
+    def legacy_post(self, name, content=None):
+        if content is not None:
+            os.makedirs(os.path.join(self.media_root, 'legacy'), exist_ok=True)
+            with open(os.path.join(self.media_root, 'legacy', name), 'wb') as f:
+                f.write(content)
+        return make_post(self.user, video_file=f'legacy/{name}')
+
+    def test_backfill_and_relink(self):
+        content = os.urandom(1000)
+        digest = hashlib.sha256(content).hexdigest()
+        # Two copies of one video, one post sharing a copy, one lost file, one unreadable file
+        duplicates = [self.legacy_post('a.mp4', content), self.legacy_post('b.mp4', content)]
+        duplicates.append(make_post(self.user, video_file='legacy/a.mp4'))
+        missing = self.legacy_post('missing.mp4')
+        broken = self.legacy_post('broken.mp4', b'broken')
+
+        def sha256(path):
+            if path.endswith('broken.mp4'):
+                raise PermissionError('Permission denied')
+            return file_sha256(path)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch('video_uploader.management.commands.backfill_content_hashes.file_sha256', side_effect=sha256):
+            call_command('backfill_content_hashes', '--relink', '--batch-size', '2', stdout=stdout, stderr=stderr)
+        self.assertIn('Hashed 3 video(s), 1 missing file(s), 1 failed', stdout.getvalue())
+        self.assertIn(f'Post {missing.id}: missing file', stderr.getvalue())
+        self.assertIn(f'Post {broken.id}: could not hash', stderr.getvalue())
+
+        name = f'videos/{digest[:2]}/{digest}.mp4'
+        for post in duplicates:
+            post.refresh_from_db()
+            self.assertEqual((post.content_hash, post.video_file.name), (digest, name))
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.media_root, 'legacy'))), ['broken.mp4'])
+        for post in (missing, broken):
+            post.refresh_from_db()
+            self.assertEqual(post.content_hash, '')
+
+
+@override_settings(UPLOAD_EVENTS_ENABLED=True, UPLOAD_EVENTS_HEARTBEAT=5, UPLOAD_EVENTS_RETENTION=600)
+class UploadEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube = Platform.objects.create(platform='youtube')
+        cls.post = make_post(cls.user, [cls.youtube])
+
+    def record_events(self, listener_seen=None):
+        """Kinds of the events a transition and a progress flush record"""
+        UploadEvent.objects.all().delete()
+        UploadEventListener.objects.all().delete()
+        if listener_seen is not None:
+            UploadEventListener.objects.create(origin='web:1', last_seen_at=timezone.now() - listener_seen)
+        upload_status = UploadStatus.objects.select_related('video_post', 'platform').get()
+        with mock.patch('video_uploader.services.events.presence', ListenerPresence()):
+            transition(self.post, self.youtube, ['pending', 'uploading'], 'uploading')
+            ProgressBuffer().record(upload_status, flush=True)
+        return sorted(UploadEvent.objects.values_list('kind', flat=True))
+
+    def test_events_are_only_recorded_for_listeners(self):
+        self.assertEqual(self.record_events(), [])
+        self.assertEqual(self.record_events(datetime.timedelta(seconds=1)), ['progress', 'status'])
+        # Status events stay available for clients resuming within the retention
+        self.assertEqual(self.record_events(datetime.timedelta(minutes=5)), ['status'])
+        self.assertEqual(self.record_events(datetime.timedelta(minutes=11)), [])
+
+    def test_prune(self):
+        UploadEventListener.objects.create(origin='web:1', last_seen_at=timezone.now())
+        event = UploadEvent.objects.create(
+            video_post=self.post, user=self.user, kind='status', payload={}, origin='worker:1')
+        UploadEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - datetime.timedelta(minutes=11))
+        UploadEvent.objects.create(video_post=self.post, user=self.user, kind='status', payload={}, origin='worker:1')
+        prune(timezone.now() + datetime.timedelta(minutes=5))
+        self.assertEqual(UploadEvent.objects.count(), 1)
+        self.assertEqual(UploadEventListener.objects.count(), 1)
+        prune(timezone.now() + datetime.timedelta(minutes=11))
+        self.assertFalse(UploadEventListener.objects.exists())
+
+
+@override_settings(
+    UPLOAD_EVENTS_ENABLED=True, UPLOAD_EVENTS_RELAY_INTERVAL=0.05, UPLOAD_EVENTS_BUFFER_SIZE=2,
+    UPLOAD_EVENTS_KEEPALIVE=5)
+class EventStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.other = User.objects.create_user('other', password='secret')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.post = make_post(cls.user)
+        cls.other_post = make_post(cls.other)
+        cls.events = [
+            UploadEvent.objects.create(
+                video_post=post, user=post.created_by, kind='status', payload={'post': post.id}, origin='worker:1')
+            for post in (cls.post, cls.other_post, cls.post)
+        ]
+
+    def tearDown(self):
+        # Streams unsubscribe once closed, when the event loop is shut down at the latest
+        self.assertFalse(broker.has_subscribers())
+
+    async def connect(self, url, **headers):
+        response = await self.async_client.get(url, headers={'Authorization': f'Token {self.token.key}', **headers})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.streaming_content
+
+    async def frames(self, content, count):
+        return [(await asyncio.wait_for(anext(content), 2)).decode() for _ in range(count)]
+
+    def frame(self, message):
+        return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+    async def test_token_auth(self):
+        self.assertEqual((await self.async_client.get('/api/events/')).status_code, 401)
+        response = await self.async_client.get('/api/events/', headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(
+            f'/api/video-posts/{self.other_post.id}/events/', headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_resume_replays_own_events_only(self):
+        first, _, last = [message(event) for event in self.events]
+        content = await self.connect('/api/events/', **{'Last-Event-ID': '0'})
+        self.assertEqual(await self.frames(content, 3), ['retry: 3000\n\n', self.frame(first), self.frame(last)])
+        await content.aclose()
+
+        content = await self.connect('/api/events/', **{'Last-Event-ID': str(first['id'])})
+        self.assertEqual(await self.frames(content, 2), ['retry: 3000\n\n', self.frame(last)])
+
+        # Live events: another user's post is not delivered, nor an event already replayed
+        live = {'id': last['id'] + 10, 'event': 'progress', 'data': {'post': self.post.id, 'bytes_sent': 10}}
+        broker.publish(topics(self.other.id, self.other_post.id), dict(live, id=last['id'] + 5))
+        broker.publish(topics(self.user.id, self.post.id), last)
+        broker.publish(topics(self.user.id, self.post.id), live)
+        self.assertEqual(await self.frames(content, 1), [self.frame(live)])
+        await content.aclose()
+
+    async def test_slow_consumer_is_told_what_it_missed(self):
+        content = await self.connect(f'/api/video-posts/{self.post.id}/events/')
+        self.assertEqual(await self.frames(content, 1), ['retry: 3000\n\n'])
+        live = [{'id': 100 + index, 'event': 'progress', 'data': {'bytes_sent': index}} for index in range(5)]
+        for event in live:
+            broker.publish(topics(self.user.id, self.post.id), event)
+        # The buffer holds two events, the three oldest are dropped
+        self.assertEqual(await self.frames(content, 3), [
+            'event: lagged\ndata: {"dropped": 3}\n\n', self.frame(live[3]), self.frame(live[4])])
+        await content.aclose()
+
+
+class VideoPostAdminQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        cls.platforms = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo', 'dailymotion')]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = make_post(self.admin, title=f'Post {i}')
+            for platform, status in zip(self.platforms, ['success', 'failed', 'uploading']):
+                UploadStatus.objects.create(video_post=post, platform=platform, status=status)
+
+    def changelist_queries(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:video_uploader_videopost_changelist') + query)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_query_count_is_constant(self):
+        self.add_posts(1)
+        baseline = self.changelist_queries()
+
+        self.add_posts(50)
+        self.assertEqual(self.changelist_queries(), baseline)
+
+    def test_filtered_changelist_query_count_is_constant(self):
+        self.add_posts(1)
+        baseline = self.changelist_queries('?upload_statuses__status__exact=failed')
+
+        self.add_posts(50)
+        self.assertEqual(self.changelist_queries('?upload_statuses__status__exact=failed'), baseline)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves ``server.payload`` with optional byte range support"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        payload = server.payload
+        server.requests.append(self.headers.get('Range'))
+        server.hosts.append(self.headers.get('Host'))
+        if self.path != '/clip.mp4':
+            self.send_response(302)
+            self.send_header('Location', '/clip.mp4')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = 0, len(payload)
+        status = 200
+        byte_range = self.headers.get('Range')
+        if server.ranges and byte_range and self.headers.get('If-Range', server.etag) == server.etag:
+            first, _, last = byte_range.removeprefix('bytes=').partition('-')
+            start, end = int(first), min(int(last) + 1, len(payload))
+            status = 206
+
+        self.send_response(status)
+        self.send_header('ETag', server.etag)
+        if server.length or status == 206:
+            self.send_header('Content-Length', str(end - start))
+        else:
+            self.close_connection = True
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(payload)}')
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        body = payload[start:end]
+        if server.drop_after and len(body) > server.drop_after:
+            # Simulate a dropped connection once, part way through the body
+            drop_after, server.drop_after = server.drop_after, 0
+            self.wfile.write(body[:drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@override_settings(
+    REMOTE_FETCH_SEGMENTS=3,
+    REMOTE_FETCH_MIN_SEGMENT_SIZE=64 * 1024,
+    REMOTE_FETCH_BLOCK_SIZE=16 * 1024,
+    REMOTE_FETCH_RETRIES=2,
+    REMOTE_FETCH_ALLOW_PRIVATE=True,
+    UPLOAD_EVENTS_ENABLED=False,
+)
+class RemoteFetcherTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+
+        self.server.payload = os.urandom(200 * 1024 + 7)
+        self.server.etag = '"v1"'
+        self.server.ranges = True
+        self.server.length = True
+        self.server.drop_after = 0
+        self.server.requests = []
+        self.server.hosts = []
+        user = User.objects.create_user('owner', password='secret')
+        self.post = make_post(user, video_url=f'http://127.0.0.1:{self.server.server_port}/clip.mp4')
+
+    def assertFetched(self):
+        name = RemoteFetcher.ensure(self.post)
+        digest = hashlib.sha256(self.server.payload).hexdigest()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.video_file.name, name)
+        self.assertEqual(self.post.content_hash, digest)
+        with self.post.video_file.open('rb') as f:
+            self.assertEqual(f.read(), self.server.payload)
+        self.assertEqual(self.post.remote_fetch.status, 'done')
+
+    def test_parallel_ranges(self):
+        self.assertFetched()
+        segments = [header for header in self.server.requests[1:] if header]
+        self.assertEqual(len(segments), 3)
+
+    def test_dropped_connection_resumes_segment(self):
+        self.server.drop_after = 10 * 1024
+        self.assertFetched()
+        self.assertEqual(len(self.server.requests), 1 + 3 + 1)
+
+    def test_without_range_support(self):
+        self.server.ranges = False
+        self.assertFetched()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_resumes_interrupted_fetch(self):
+        payload = self.server.payload
+        half = len(payload) // 2
+        fetch = RemoteFetch.objects.create(
+            video_post=self.post, url=self.post.video_url, total_bytes=len(payload),
+            validator='"v1"', segments=[[0, half, half], [half, len(payload), half]],
+        )
+        path = default_storage.path(fetch.partial_name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(payload[:half])
+            f.truncate(len(payload))
+
+        self.assertFetched()
+        self.assertEqual(self.server.requests[1:], [f'bytes={half}-{len(payload) - 1}'])
+
+    def test_changed_file_restarts(self):
+        payload = self.server.payload
+        RemoteFetch.objects.create(
+            video_post=self.post, url=self.post.video_url, total_bytes=len(payload),
+            validator='"v0"', segments=[[0, len(payload), 1000]],
+        )
+        self.assertFetched()
+
+    def test_redirect_hops_are_checked(self):
+        target = self.post.video_url
+        moved = self.post.video_url = target.replace('clip.mp4', 'old.mp4')
+        with mock.patch('video_uploader.services.remote_fetch.check_url', wraps=check_url) as checked:
+            self.assertFetched()
+        self.assertEqual([c.args[0] for c in checked.call_args_list], [moved, target])
+
+    def test_stream_without_length_is_capped(self):
+        self.server.ranges = False
+        self.server.length = False
+        with override_settings(REMOTE_FETCH_MAX_BYTES=100 * 1024):
+            with self.assertRaisesMessage(RemoteFetchError, 'larger than REMOTE_FETCH_MAX_BYTES'):
+                RemoteFetcher.ensure(self.post)
+        self.assertEqual(RemoteFetch.objects.get(video_post=self.post).status, 'failed')
+
+    @override_settings(REMOTE_FETCH_ALLOW_PRIVATE=False)
+    def test_private_address_is_refused(self):
+        with self.assertRaisesMessage(RemoteFetchError, 'non-public address'):
+            RemoteFetcher.ensure(self.post)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(RemoteFetch.objects.get(video_post=self.post).status, 'failed')
+
+    @override_settings(REMOTE_FETCH_ALLOW_PRIVATE=False)
+    def test_rebinding_host_gets_the_vetted_address(self):
+        self.post.video_url = f'http://video.example:{self.server.server_port}/clip.mp4'
+        # The name resolves to a public address for the check, then to loopback
+        answers = [[(None, None, None, '', ('93.184.216.34', 80))]]
+        resolve = mock.patch('socket.getaddrinfo', side_effect=lambda *args, **kwargs: (
+            answers.pop(0) if answers else [(None, None, None, '', ('127.0.0.1', self.server.server_port))]))
+        connect = mock.patch(
+            'video_uploader.services.remote_fetch.urllib3_connection.create_connection',
+            side_effect=ConnectionRefusedError('refused'))
+        with resolve, connect as connected, self.assertRaises(RemoteFetchError):
+            RemoteFetcher.ensure(self.post)
+        self.assertEqual({c.args[0][0] for c in connected.call_args_list}, {'93.184.216.34'})
+        self.assertEqual(self.server.requests, [])
+
+    def test_pinned_connections(self):
+        host = f'video.example:{self.server.server_port}'
+        session = requests.Session()
+        adapter = PinnedAdapter({'video.example': ['127.0.0.1']})
+        session.mount('http://', adapter)
+        # video.example is never resolved; Host still names it
+        with session.get(f'http://{host}/clip.mp4') as response:
+            self.assertEqual(response.content, self.server.payload)
+        self.assertEqual(self.server.hosts, [host])
+
+        # The connected address is checked again
+        adapter.close()
+        with override_settings(REMOTE_FETCH_ALLOW_PRIVATE=False):
+            with self.assertRaisesMessage(RemoteFetchError, 'non-public address'):
+                session.get(f'http://{host}/clip.mp4')
+            with self.assertRaisesMessage(RemoteFetchError, 'was not checked'):
+                session.get(f'http://localhost:{self.server.server_port}/clip.mp4')
+        self.assertEqual(len(self.server.hosts), 1)
+
+    def test_post_locks_are_released(self):
+        self.assertFetched()
+        self.assertEqual(len(remote_fetch._post_lock), 0)
+
+    @override_settings(REMOTE_FETCH_ALLOW_PRIVATE=False)
+    def test_check_url(self):
+        for url in ('ftp://example.com/clip.mp4', 'file:///etc/passwd', 'http://localhost/clip.mp4',
+                    'http://169.254.169.254/latest/meta-data', 'http://[::ffff:10.0.0.1]/clip.mp4'):
+            with self.subTest(url=url), self.assertRaises(RemoteFetchError):
+                check_url(url)
+        with mock.patch('socket.getaddrinfo', return_value=[(None, None, None, '', ('93.184.216.34', 80))]):
+            check_url('http://example.com/clip.mp4')
+
+
+class ResumableUploadHandler(BaseHTTPRequestHandler):
+    """A stand-in for YouTube's resumable upload protocol"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, headers=(), body=b''):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def acknowledged(self, received):
+        return [('Range', f'bytes=0-{len(received) - 1}')] if received else []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        session = f'/upload/session/{len(self.server.sessions)}'
+        self.server.sessions[session] = bytearray()
+        self.reply(200, [('Location', f'http://127.0.0.1:{self.server.server_port}{session}')])
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        received = self.server.sessions.get(self.path)
+        if received is None:
+            return self.reply(self.server.expired_status)
+        byte_range, _, total = self.headers['Content-Range'].removeprefix('bytes ').partition('/')
+        if byte_range == '*':
+            # Status query of a client resuming the session
+            return self.reply(308, self.acknowledged(received))
+        if int(byte_range.partition('-')[0]) != len(received):
+            return self.reply(400)
+        self.server.chunks.append(len(body))
+        if self.server.fail_chunk == len(self.server.chunks):
+            # Part of the chunk arrives before the connection breaks
+            received += body[:len(body) // 2]
+            return self.reply(503)
+        received += body
+        if len(received) < int(total):
+            return self.reply(308, self.acknowledged(received))
+        self.server.uploads.append(bytes(received))
+        self.reply(200, [('Content-Type', 'application/json')], b'{"id": "stub-video"}')
+
+
+@override_settings(YOUTUBE_UPLOAD_CHUNK_SIZE=256 * 1024, YOUTUBE_UPLOAD_NUM_RETRIES=0, UPLOAD_EVENTS_ENABLED=False)
+class YouTubeResumableUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ResumableUploadHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media_root, YOUTUBE_API_ENDPOINT=f'http://127.0.0.1:{self.server.server_port}'))
+        self.server.sessions = {}
+        self.server.chunks = []
+        self.server.uploads = []
+        self.server.fail_chunk = 0
+        self.server.expired_status = 404
+
+        self.data = os.urandom(4 * 256 * 1024 + 1000)
+        user = User.objects.create_user('owner', password='secret')
+        platform = Platform.objects.create(platform='youtube')
+        self.post = VideoPost(title='Post', description='Description', created_by=user)
+        self.post.video_file.save('clip.bin', ContentFile(self.data), save=False)
+        self.post.save()
+        create_statuses(self.post, [platform])
+        self.platform = platform
+        self.service = YouTubeService()
+        self.enterContext(mock.patch.object(self.service, 'get_credentials', return_value=Credentials('token')))
+
+    def upload(self):
+        upload_status = UploadStatus.objects.get(video_post=self.post)
+        return self.service.upload_video(self.post, self.platform, upload_status=upload_status), upload_status
+
+    def test_chunked_upload(self):
+        result, upload_status = self.upload()
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['external_id'], 'stub-video')
+        self.assertEqual(self.server.uploads, [self.data])
+        self.assertEqual(self.server.chunks, [256 * 1024] * 4 + [1000])
+        upload_status.refresh_from_db()
+        self.assertEqual((upload_status.bytes_sent, upload_status.resumable_uri), (len(self.data), ''))
+
+    def test_resumes_from_server_offset(self):
+        self.server.fail_chunk = 3
+        with self.assertLogs('video_uploader.services.youtube_service', 'WARNING'):
+            result, upload_status = self.upload()
+        self.assertFalse(result['success'])
+        upload_status.refresh_from_db()
+        self.assertTrue(upload_status.resumable_uri)
+        self.assertEqual(upload_status.bytes_sent, 2 * 256 * 1024)
+
+        # Half of the third chunk reached the server, the rest is sent from there
+        result, _ = self.upload()
+        self.assertTrue(result['success'], result)
+        self.assertEqual(self.server.uploads, [self.data])
+        self.assertEqual(len(self.server.sessions), 1)
+        self.assertEqual(sum(self.server.chunks[3:]), len(self.data) - 2 * 256 * 1024 - 256 * 1024 // 2)
+
+    def test_expired_session_restarts(self):
+        for status in (404, 410):
+            with self.subTest(status=status):
+                self.server.uploads = []
+                self.server.expired_status = status
+                UploadStatus.objects.filter(video_post=self.post).update(
+                    resumable_uri=f'http://127.0.0.1:{self.server.server_port}/upload/session/gone',
+                    bytes_sent=512 * 1024)
+                result, _ = self.upload()
+                self.assertTrue(result['success'], result)
+                self.assertEqual(self.server.uploads, [self.data])
+
+
+@override_settings(UPLOAD_SESSION_BLOCK_SIZE=100)
+class UploadSessionTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.user = User.objects.create_user('owner', password='secret')
+        self.client.force_authenticate(self.user)
+        self.data = os.urandom(1000)
+        response = self.client.post('/api/upload-sessions/', {
+            'filename': 'clip.bin', 'upload_length': len(self.data), 'title': 'Post', 'description': 'Description',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.url = response['Location']
+
+    def patch(self, offset, body):
+        return self.client.patch(
+            self.url, body, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def offset(self):
+        return int(self.client.get(self.url)['Upload-Offset'])
+
+    def test_offsets(self):
+        response = self.patch(0, self.data[:400])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '400')
+        self.assertEqual(self.offset(), 400)
+
+        # A chunk sent at a stale offset is refused with the stored one
+        response = self.patch(0, self.data[:400])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '400')
+
+        response = self.patch(400, self.data[400:])
+        self.assertEqual(response.status_code, 201, response.content)
+        post = VideoPost.objects.get(pk=response.json()['id'])
+        with post.video_file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(post.content_hash, hashlib.sha256(self.data).hexdigest())
+
+    def test_resume_after_partial_patch(self):
+        session = UploadSession.objects.get()
+        # The connection drops 350 bytes into a 600 byte chunk
+        self.assertEqual(UploadSessionManager.append(session, 0, io.BytesIO(self.data[:350]), length=600), 350)
+        self.assertEqual(self.offset(), 350)
+
+        response = self.patch(350, self.data[350:])
+        self.assertEqual(response.status_code, 201, response.content)
+        with VideoPost.objects.get().video_file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+
+class UploadSessionRaceTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        user = User.objects.create_user('owner', password='secret')
+        self.data = os.urandom(1000)
+        self.session = UploadSessionManager.start(user, 'clip.bin', len(self.data), {})
+
+    def test_overlapping_patches(self):
+        first_writing, second_waiting, release = threading.Event(), threading.Event(), threading.Event()
+        data = self.data
+
+        class SlowStream:
+            def __init__(self):
+                self.chunks = [data[:300], data[300:]]
+
+            def read(self, size):
+                if len(self.chunks) == 1:
+                    first_writing.set()
+                    release.wait(5)
+                return self.chunks.pop(0) if self.chunks else b''
+
+        flock = fcntl.flock
+
+        def watched_flock(fd, operation):
+            if first_writing.is_set():
+                second_waiting.set()
+            return flock(fd, operation)
+
+        results = {}
+
+        def patch(name, session, stream):
+            try:
+                results[name] = UploadSessionManager.append(session, 0, stream)
+            except OffsetMismatch as e:
+                results[name] = e.expected
+            finally:
+                connection.close()
+
+        # Both PATCHes start from a session read at offset 0
+        stale = UploadSession.objects.get(pk=self.session.pk)
+        with mock.patch('video_uploader.services.upload_sessions.fcntl.flock', side_effect=watched_flock):
+            first = threading.Thread(target=patch, args=('first', self.session, SlowStream()))
+            first.start()
+            self.assertTrue(first_writing.wait(5))
+            second = threading.Thread(target=patch, args=('second', stale, io.BytesIO(os.urandom(1000))))
+            second.start()
+            self.assertTrue(second_waiting.wait(5))
+            release.set()
+            first.join(5)
+            second.join(5)
+
+        self.assertEqual(results, {'first': 1000, 'second': 1000})
+        with open(default_storage.path(self.session.partial_name), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).offset, 1000)
+
+
+class VideoPostListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube, cls.vimeo = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+        cls.posts = [make_post(cls.user, [cls.vimeo if index % 2 else cls.youtube]) for index in range(7)]
+        for post in cls.posts[:3]:
+            transition(post, cls.youtube if post.upload_statuses.filter(platform=cls.youtube).exists() else cls.vimeo,
+                       'pending', 'failed')
+        make_post(User.objects.create_user('other', password='secret'), [cls.youtube])
+        # Posts created in the same instant are told apart by id
+        VideoPost.objects.update(created_at=timezone.now())
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def ids(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        page = response.json()
+        return [post['id'] for post in page['results']], page, len(queries)
+
+    def test_pages_split_ties_by_id(self):
+        newest_first = sorted((post.id for post in self.posts), reverse=True)
+        for page_size in (1, 2, 3, 7):
+            with self.subTest(page_size=page_size):
+                seen, pages = [], []
+                url = f'/api/video-posts/?page_size={page_size}'
+                while url:
+                    ids, page, _ = self.ids(url)
+                    self.assertLessEqual(len(ids), page_size)
+                    seen += ids
+                    pages.append(ids)
+                    url = page['next']
+                self.assertEqual(seen, newest_first)
+
+                # previous walks back over the same pages
+                while page['previous']:
+                    ids, page, _ = self.ids(page['previous'])
+                    pages.pop()
+                    self.assertEqual(ids, pages[-1])
+
+    def test_bad_cursor(self):
+        cursor = base64.b64encode(b'p=yesterday|1').decode()
+        self.assertEqual(self.client.get('/api/video-posts/', {'cursor': cursor}).status_code, 404)
+
+    def test_filters(self):
+        failed = {post.id for post in self.posts[:3]}
+        vimeo = {post.id for index, post in enumerate(self.posts) if index % 2}
+        self.assertEqual(set(self.ids('/api/video-posts/?status=failed')[0]), failed)
+        self.assertEqual(set(self.ids('/api/video-posts/?platform=VIMEO')[0]), vimeo)
+        self.assertEqual(set(self.ids('/api/video-posts/?status=failed&platform=vimeo')[0]), failed & vimeo)
+
+    def test_query_count_is_constant(self):
+        baseline = self.ids('/api/video-posts/?page_size=1')[2]
+        self.assertEqual(self.ids('/api/video-posts/?page_size=7')[2], baseline)
+        self.assertEqual(self.ids('/api/video-posts/?page_size=7&platform=vimeo')[2], baseline)
+
+
+class BulkCreateTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.youtube, cls.vimeo = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def item(self, **data):
+        return {
+            'title': 'Post', 'description': 'Description', 'video_url': 'https://example.com/video.mp4',
+            'platform_ids': [self.youtube.id, self.vimeo.id], **data,
+        }
+
+    def test_mixed_batch_reports_errors_per_item(self):
+        response = self.client.post('/api/video-posts/bulk_create/', {'posts': [
+            self.item(),
+            self.item(title=''),
+            self.item(video_url='ftp://example.com/video.mp4'),
+            self.item(video_url=None),
+            self.item(title='Vimeo only', video_url='ftp://example.com/video.mp4', platform_ids=[self.vimeo.id]),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+        body = response.json()
+
+        self.assertEqual([item['index'] for item in body['created']], [0, 4])
+        errors = {item['index']: item['errors'] for item in body['errors']}
+        self.assertEqual(list(errors), [1, 2, 3])
+        self.assertIn('title', errors[1])
+        self.assertIn('video_url', errors[2])
+        self.assertIn('video_file', errors[3])
+
+        posts = VideoPost.objects.filter(pk__in=[item['id'] for item in body['created']])
+        self.assertEqual(UploadStatus.objects.filter(video_post__in=posts).count(), 3)
+        self.assertEqual(UploadJob.objects.filter(video_post__in=posts, status='queued').count(), 2)
+        self.assertEqual(UserUploadStats.objects.get(user=self.user).total_posts, 2)
+
+    def test_all_invalid_batch_is_rejected(self):
+        response = self.client.post(
+            '/api/video-posts/bulk_create/', {'posts': [self.item(title=''), 'not a post']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['index'] for item in response.json()['errors']], [0, 1])
+        self.assertFalse(VideoPost.objects.exists())
+
+    def test_single_create_applies_platform_rules(self):
+        response = self.client.post(
+            '/api/video-posts/', self.item(video_url='ftp://example.com/video.mp4'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('video_url', response.json())
+        self.assertFalse(VideoPost.objects.exists())
+
+        response = self.client.post(
+            '/api/video-posts/', self.item(video_url='ftp://example.com/video.mp4', platform_ids=[self.vimeo.id]),
+            format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.enterContext(override_settings(METRICS_MULTIPROCESS_DIR=self.directory))
+        self.registry = Registry()
+        self.jobs = self.registry.register(Counter('jobs_total', 'Jobs', ['outcome']))
+        self.wait = self.registry.register(Histogram('wait_seconds', 'Wait', buckets=(1, 10)))
+
+    def test_merges_threads_and_process_snapshots(self):
+        self.jobs.inc(outcome='done')
+        self.wait.observe(0.5)
+        thread = threading.Thread(target=lambda: (self.jobs.inc(2, outcome='done'), self.wait.observe(5)))
+        thread.start()
+        thread.join()
+        # A snapshot written by another worker process
+        with open(os.path.join(self.directory, 'other-host-1.json'), 'w') as f:
+            json.dump([['jobs_total', ['done'], [4]], ['jobs_total', ['failed'], [1]],
+                       ['wait_seconds', [], [0, 0, 1, 20.0]]], f)
+
+        lines = self.registry.expose().splitlines()
+        self.assertIn('jobs_total{outcome="done"} 7', lines)
+        self.assertIn('jobs_total{outcome="failed"} 1', lines)
+        self.assertIn('wait_seconds_bucket{le="1"} 1', lines)
+        self.assertIn('wait_seconds_bucket{le="10"} 2', lines)
+        self.assertIn('wait_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('wait_seconds_sum 25.5', lines)
+
+    def test_flush_writes_own_snapshot(self):
+        self.jobs.inc(3, outcome='done')
+        self.registry.flush(force=True)
+        other = Registry()
+        other.register(Counter('jobs_total', 'Jobs', ['outcome']))
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIn('jobs_total{outcome="done"} 3', other.expose().splitlines())
+
+    def test_exited_processes_are_folded_into_the_retired_file(self):
+        process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        host = socket.gethostname()
+        dead = os.path.join(self.directory, f'{host}-{process.stdout.strip()}.json')
+        with open(dead, 'w') as f:
+            json.dump([['jobs_total', ['done'], [4]]], f)
+        with open(os.path.join(self.directory, f'{host}-retired.json'), 'w') as f:
+            json.dump([['jobs_total', ['done'], [1]]], f)
+
+        for _ in range(2):
+            self.assertIn('jobs_total{outcome="done"} 5', self.registry.expose().splitlines())
+        self.assertEqual(glob.glob(os.path.join(self.directory, '*.json')),
+                         [os.path.join(self.directory, f'{host}-retired.json')])
+
+    def test_retire(self):
+        self.jobs.inc(3, outcome='done')
+        self.registry.retire()
+        self.assertEqual(glob.glob(os.path.join(self.directory, '*.json')),
+                         [os.path.join(self.directory, f'{socket.gethostname()}-retired.json')])
+        other = Registry()
+        other.register(Counter('jobs_total', 'Jobs', ['outcome']))
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIn('jobs_total{outcome="done"} 3', other.expose().splitlines())
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE upload_jobs_total counter', response.content)
+
+
+class PlatformServiceFactoryTests(TestCase):
+    def setUp(self):
+        registry = dict(PlatformServiceFactory.registry)
+        for name, value in [('registry', registry), ('services', {}), ('_discovered', False)]:
+            self.enterContext(mock.patch.object(PlatformServiceFactory, name, value))
+
+    def test_importing_the_app_leaves_googleapiclient_unloaded(self):
+        code = (
+            'import sys, django; django.setup()\n'
+            'from django.urls import get_resolver; get_resolver().url_patterns\n'
+            'import video_uploader.admin, video_uploader.services.job_queue, video_uploader.services.upload_manager\n'
+            'print(sorted(name for name in sys.modules if name.startswith("googleapiclient")))\n'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='social_video_uploader.settings')
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    @override_settings(UPLOAD_PLATFORM_SERVICES={
+        'TikTok': 'video_uploader.services.platform_services.DailymotionService',
+        'vimeo': 'video_uploader.services.platform_services.DailymotionService',
+    })
+    def test_setting_adds_and_replaces_services(self):
+        self.assertIsInstance(PlatformServiceFactory.get_service('tiktok'), DailymotionService)
+        self.assertIsInstance(PlatformServiceFactory.get_service('vimeo'), DailymotionService)
+        self.assertIsNone(PlatformServiceFactory.get_service('myspace'))
+
+    def test_entry_points(self):
+        group = PlatformServiceFactory.ENTRY_POINT_GROUP
+        plugins = [
+            EntryPoint('PeerTube', 'video_uploader.services.platform_services:DailymotionService', group),
+            EntryPoint('vimeo', 'video_uploader.services.platform_services:DailymotionService', group),
+            # Only loaded when its platform is asked for
+            EntryPoint('broken', 'not_installed.services:Service', group),
+        ]
+        with mock.patch('video_uploader.services.platform_services.entry_points', return_value=plugins) as found:
+            self.assertIsInstance(PlatformServiceFactory.get_service('peertube'), DailymotionService)
+            # A plugin does not replace a built-in platform
+            self.assertIsInstance(PlatformServiceFactory.get_service('vimeo'), VimeoService)
+            self.assertIs(PlatformServiceFactory.get_service('PeerTube'), PlatformServiceFactory.get_service('peertube'))
+        found.assert_called_once_with(group=group)
+
+
+class YouTubeServiceTests(TestCase):
+    def setUp(self):
+        self.service = YouTubeService()
+
+    def test_client_is_built_offline(self):
+        with mock.patch('socket.socket.connect', side_effect=OSError('network used')), \
+                mock.patch('socket.getaddrinfo', side_effect=OSError('network used')):
+            client = self.service._build_client(Credentials('token'))
+        self.assertTrue(callable(client.videos))
+
+    def cache_requests(self, cache, result):
+        return registry.collect().get(('upload_cache_requests_total', (cache, result)), [0])[0]
+
+    def test_missing_credentials_raise_instead_of_prompting(self):
+        with mock.patch.object(self.service, '_run_oauth_flow') as oauth_flow:
+            with self.assertRaises(YouTubeAuthError):
+                self.service.get_credentials(-1)
+            expired = mock.Mock(valid=False, refresh_token='refresh', expiry=None)
+            with mock.patch.object(self.service, '_load_credentials', return_value=expired), \
+                    mock.patch.object(self.service, '_refresh', return_value=False):
+                with self.assertRaises(YouTubeAuthError):
+                    self.service.get_credentials(-1)
+        oauth_flow.assert_not_called()
+
+    def test_user_locks_are_released(self):
+        credentials = mock.Mock(valid=True, expiry=None)
+        for user_id in range(3):
+            with mock.patch.object(self.service, '_load_credentials', return_value=credentials):
+                self.assertIs(self.service.get_credentials(user_id), credentials)
+        self.assertEqual(len(self.service._user_lock), 0)
+
+    def test_clients_are_pooled_per_user(self):
+        credentials = Credentials('token')
+        self.service.credentials.set(1, credentials)
+        hits = self.cache_requests('youtube_credentials', 'hit')
+        with mock.patch.object(self.service, '_build_client', side_effect=lambda credentials: object()) as build:
+            with self.service.authenticated_service(1) as first:
+                # A concurrent upload of the same user gets a client of its own
+                with self.service.authenticated_service(1) as second:
+                    self.assertIsNot(first, second)
+
+            # Later uploads, from any thread, reuse the idle clients
+            used = []
+            thread = threading.Thread(
+                target=lambda: used.append(self.service.authenticated_service(1).__enter__()))
+            thread.start()
+            thread.join()
+            self.assertIn(used[0], (first, second))
+            self.assertEqual(build.call_count, 2)
+
+            # Clients of replaced credentials are not reused
+            self.service.credentials.set(1, Credentials('new token'))
+            with self.service.authenticated_service(1) as client:
+                self.assertNotIn(client, (first, second))
+        self.assertEqual(self.cache_requests('youtube_credentials', 'hit') - hits, 4)
+
+
+class QueryBudgetMixin:
+    """assertWithinQueryBudget() checks a request against the action's declared query budget"""
+
+    def assertWithinQueryBudget(self, view_class, action, method, url, data=None):
+        budget = query_budget(view_class, action)
+        self.assertIsNotNone(budget, f'{view_class.__name__}.{action} declares no query budget')
+        with QueryProfile() as profile:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        queries = '\n'.join(sql for sql, _ in profile.queries)
+        self.assertLessEqual(
+            profile.count, budget,
+            f'{view_class.__name__}.{action} ran {profile.count} queries, budget {budget}:\n{queries}')
+        return response
+
+
+class QueryBudgetTests(QueryBudgetMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.platforms = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo', 'dailymotion')]
+        cls.platform_ids = [platform.id for platform in cls.platforms]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def post_data(self, index=0):
+        return {
+            'title': f'Post {index}', 'description': 'Description',
+            'video_url': 'https://example.com/video.mp4', 'platform_ids': self.platform_ids,
+        }
+
+    def test_every_action_has_a_budget(self):
+        for view_class, actions in [
+            (VideoPostViewSet, ['list', 'retrieve', 'create', 'update', 'partial_update', 'destroy']),
+            (PlatformViewSet, ['list', 'retrieve']),
+        ]:
+            for action in actions + [extra.__name__ for extra in view_class.get_extra_actions()]:
+                with self.subTest(view=view_class.__name__, action=action):
+                    self.assertIsNotNone(query_budget(view_class, action))
+
+    def test_video_post_actions(self):
+        # Enough posts that a per-row query would blow every budget
+        for index in range(10):
+            self.assertWithinQueryBudget(
+                VideoPostViewSet, 'create', 'post', '/api/video-posts/', self.post_data(index))
+        post_id = VideoPost.objects.latest('id').id
+        UploadStatus.objects.filter(video_post_id=post_id).update(status='failed')
+        detail = f'/api/video-posts/{post_id}/'
+
+        self.assertWithinQueryBudget(VideoPostViewSet, 'list', 'get', '/api/video-posts/')
+        self.assertWithinQueryBudget(VideoPostViewSet, 'list', 'get', '/api/video-posts/?platform=vimeo')
+        self.assertWithinQueryBudget(VideoPostViewSet, 'retrieve', 'get', detail)
+        self.assertWithinQueryBudget(VideoPostViewSet, 'partial_update', 'patch', detail, {'title': 'Renamed'})
+        response = self.assertWithinQueryBudget(VideoPostViewSet, 'update', 'put', detail, {
+            'title': 'Renamed', 'description': 'Description', 'video_url': 'https://example.com/other.mp4',
+        })
+        self.assertEqual(len(response.json()['upload_statuses']), 3)
+        self.assertWithinQueryBudget(VideoPostViewSet, 'retry_upload', 'post', f'{detail}retry_upload/')
+        self.assertWithinQueryBudget(VideoPostViewSet, 'upload_stats', 'get', '/api/video-posts/upload_stats/')
+        self.assertWithinQueryBudget(VideoPostViewSet, 'bulk_create', 'post', '/api/video-posts/bulk_create/', {
+            'posts': [self.post_data(index) for index in range(10)],
+        })
+        self.assertWithinQueryBudget(VideoPostViewSet, 'destroy', 'delete', detail)
+
+    def test_platform_actions(self):
+        self.assertWithinQueryBudget(PlatformViewSet, 'list', 'get', '/api/platforms/')
+        self.assertWithinQueryBudget(PlatformViewSet, 'retrieve', 'get', f'/api/platforms/{self.platform_ids[0]}/')
+        self.assertWithinQueryBudget(PlatformViewSet, 'quotas', 'get', '/api/platforms/quotas/')
+
+    @override_settings(
+        UPLOAD_PLATFORM_QUOTAS={'vimeo': {'cost': 1, 'limit': 100, 'window': 60 * 60}},
+        UPLOAD_DEDUPLICATE=True, UPLOAD_EVENTS_ENABLED=False)
+    def test_platform_upload(self):
+        vimeo = self.platforms[1]
+        # The first upload of a quota window also creates its ledger rows
+        for index in range(2):
+            post = make_post(self.user, [vimeo], content_hash=f'{index}' * 64)
+            upload_status = UploadStatus.objects.get(video_post=post)
+            with mock.patch('video_uploader.services.upload_manager.PlatformServiceFactory.get_service') as get_service:
+                get_service.return_value.upload_video.return_value = {'success': True, 'external_id': f'video-{index}'}
+                with QueryProfile() as profile:
+                    result = VideoUploadManager.upload_to_platform(post, vimeo, upload_status)
+            self.assertEqual(result['status'], 'success')
+            queries = '\n'.join(sql for sql, _ in profile.queries)
+            self.assertLessEqual(
+                profile.count, VideoUploadManager.query_budget,
+                f'upload_to_platform ran {profile.count} queries, budget {VideoUploadManager.query_budget}:\n{queries}')
+
+    @override_settings(QUERY_PROFILING=True)
+    def test_profiling_header(self):
+        with self.assertLogs('video_uploader.middleware', 'INFO') as logs:
+            response = self.client.get('/api/video-posts/')
+        self.assertRegex(response['X-Query-Profile'], r'^count=\d+; time_ms=[\d.]+; duplicates=\d+; budget=3$')
+        self.assertEqual(logs.records[0].query_profile['budget'], 3)
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def make_mp4(faststart=False, chunks=(b'A' * 100, b'B' * 100)):
+    """A minimal MP4: one 1280x720 avc1 track of 12.5 s whose chunks are ``chunks``"""
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomavc1')
+    mdat = box(b'mdat', b''.join(chunks))
+
+    def moov(offsets):
+        mvhd = box(b'mvhd', struct.pack('>4xIIII', 0, 0, 1000, 12500) + bytes(80))
+        tkhd = box(b'tkhd', struct.pack('>4x5I', 0, 0, 1, 0, 12500) + bytes(8 + 8 + 36)
+                   + struct.pack('>II', 1280 << 16, 720 << 16))
+        hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(13))
+        stsd = box(b'stsd', struct.pack('>4xI', 1) + box(b'avc1', bytes(78)))
+        stco = box(b'stco', struct.pack(f'>4xI{len(offsets)}I', len(offsets), *offsets))
+        stbl = box(b'stbl', stsd + stco)
+        trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', stbl)))
+        return box(b'moov', mvhd + trak)
+
+    placeholder = len(moov([0] * len(chunks)))
+    mdat_start = len(ftyp) + (placeholder if faststart else 0)
+    offsets, position = [], mdat_start + 8
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    if faststart:
+        return ftyp + moov(offsets) + mdat
+    return ftyp + mdat + moov(offsets)
+
+
+class MediaProbeTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def write(self, name, data):
+        path = os.path.join(self.media_root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def chunk_offsets(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        moov = next((payload, end) for kind, _, payload, end in _boxes(data, 0, len(data)) if kind == b'moov')
+        stbl = _child(data, *_child(data, *_child(data, *_child(data, *moov, b'trak'), b'mdia'), b'minf'), b'stbl')
+        stco = _child(data, *stbl, b'stco')
+        count = struct.unpack_from('>I', data, stco[0] + 4)[0]
+        return data, struct.unpack_from(f'>{count}I', data, stco[0] + 8)
+
+    def test_probe(self):
+        info = probe_path(self.write('slow.mp4', make_mp4()))
+        self.assertEqual(info['brand'], 'isom')
+        self.assertEqual(info['duration'], 12.5)
+        self.assertEqual((info['width'], info['height'], info['video_codec']), (1280, 720, 'avc1'))
+        self.assertFalse(info['faststart'])
+        self.assertTrue(probe_path(self.write('fast.mp4', make_mp4(faststart=True)))['faststart'])
+
+    def test_truncated_file_is_rejected(self):
+        with self.assertRaises(InvalidMedia):
+            probe_path(self.write('cut.mp4', make_mp4()[:-40]))
+        with self.assertRaises(InvalidMedia):
+            probe_path(self.write('no_moov.mp4', make_mp4()[:-1][:240]))
+
+    def test_rewrite_faststart(self):
+        source = self.write('slow.mp4', make_mp4())
+        destination = os.path.join(self.media_root, 'fast.mp4')
+        self.assertTrue(rewrite_faststart(source, destination))
+
+        self.assertTrue(probe_path(destination)['faststart'])
+        self.assertEqual(os.path.getsize(destination), os.path.getsize(source))
+        data, offsets = self.chunk_offsets(destination)
+        self.assertEqual([data[offset:offset + 100] for offset in offsets], [b'A' * 100, b'B' * 100])
+        self.assertFalse(rewrite_faststart(destination, os.path.join(self.media_root, 'again.mp4')))
+
+    def test_create_rejects_broken_file_and_stores_media_info(self):
+        user = User.objects.create_user('owner', password='secret')
+        platform = Platform.objects.create(platform='vimeo')
+        self.client.force_authenticate(user)
+
+        def create(data):
+            return self.client.post('/api/video-posts/', {
+                'title': 'Post', 'description': 'Description', 'platform_ids': [platform.id],
+                'video_file': SimpleUploadedFile('clip.mp4', data, content_type='video/mp4'),
+            }, format='multipart')
+
+        response = create(make_mp4()[:-40])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('video_file', response.json())
+
+        response = create(make_mp4())
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertEqual(response.json()['media_info']['duration'], 12.5)
+        self.assertEqual(VideoPost.objects.get().media_info['height'], 720)
+
+
+class RemoteStorage(FileSystemStorage):
+    """A storage without local paths, like an object store"""
+
+    opened = 0
+
+    def path(self, name):
+        raise NotImplementedError
+
+    def size(self, name):
+        return os.path.getsize(os.path.join(self.location, name))
+
+    def _open(self, name, mode='rb'):
+        RemoteStorage.opened += 1
+        return open(os.path.join(self.location, name), mode)
+
+
+@override_settings(MEDIA_SOURCE_BLOCK_SIZE=1000)
+class MediaSourceTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.data = os.urandom(10 * 1000 + 123)
+        user = User.objects.create_user('owner', password='secret')
+        self.post = VideoPost(title='Post', description='Description', created_by=user)
+        self.post.video_file.save('clip.bin', ContentFile(self.data), save=False)
+
+    def test_local_file_is_mapped_once(self):
+        with MediaSource.open(self.post) as source, MediaSource.open(self.post) as other:
+            self.assertIs(source, other)
+            self.assertTrue(source.local)
+            self.assertEqual(b''.join(source.chunks()), self.data)
+            self.assertEqual(source.read_at(9990, 500), self.data[9990:10490])
+        self.assertEqual(MediaSource._sources, {})
+
+    def test_remote_storage_is_read_once(self):
+        storage = RemoteStorage(location=settings.MEDIA_ROOT)
+        self.post.video_file.storage = storage
+        RemoteStorage.opened = 0
+        with MediaSource.open(self.post) as source:
+            self.assertFalse(source.local)
+            readers = [source.reader() for _ in range(3)]
+            for reader in readers:
+                reader.seek(-123, os.SEEK_END)
+                self.assertEqual(reader.read(), self.data[-123:])
+                reader.seek(0)
+                self.assertEqual(reader.read(5000), self.data[:5000])
+        self.assertEqual(RemoteStorage.opened, 1)
+
+
+class ScheduledPublishingTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.platforms = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+        self.publish_at = timezone.now() + datetime.timedelta(hours=1)
+
+    def create_post(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/video-posts/', {
+                'title': 'Post', 'description': 'Description', 'video_url': 'https://example.com/video.mp4',
+                'platform_ids': [platform.id for platform in self.platforms], **data,
+            }, format='json')
+        self.assertEqual(response.status_code, 202, response.content)
+        return VideoPost.objects.get(pk=response.json()['id'])
+
+    def test_scheduled_post_is_queued_when_due(self):
+        post = self.create_post(publish_at=self.publish_at.isoformat())
+        self.assertFalse(UploadJob.objects.filter(video_post=post).exists())
+        self.assertFalse(post.upload_statuses.filter(RetryPolicy.retryable_filter()).exists())
+        self.assertEqual(PublishDispatcher.next_due(), self.publish_at)
+
+        self.assertEqual(PublishDispatcher.release_due(), 0)
+        self.assertEqual(PublishDispatcher.release_due(now=self.publish_at), 2)
+        self.assertEqual(UploadJob.objects.filter(video_post=post, status='queued').count(), 1)
+        self.assertIsNone(PublishDispatcher.next_due())
+        self.assertEqual(post.upload_statuses.filter(RetryPolicy.retryable_filter()).count(), 2)
+
+    def test_unscheduled_post_is_queued_at_once(self):
+        post = self.create_post(publish_at=(timezone.now() - datetime.timedelta(minutes=1)).isoformat())
+        self.assertTrue(UploadJob.objects.filter(video_post=post).exists())
+        self.assertIsNone(PublishDispatcher.next_due())
+
+    def test_release_in_batches_earliest_first(self):
+        later = self.create_post(publish_at=(self.publish_at + datetime.timedelta(minutes=1)).isoformat())
+        earlier = self.create_post(publish_at=self.publish_at.isoformat())
+        now = self.publish_at + datetime.timedelta(hours=1)
+        self.assertEqual(PublishDispatcher.release_due(now=now, limit=2), 2)
+        self.assertEqual(list(UploadJob.objects.values_list('video_post', flat=True)), [earlier.id])
+        self.assertEqual(PublishDispatcher.release_due(now=now, limit=2), 2)
+        self.assertEqual(UploadJob.objects.filter(video_post=later).count(), 1)
+
+    def test_rescheduling(self):
+        post = self.create_post(publish_at=self.publish_at.isoformat())
+        sooner = self.publish_at - datetime.timedelta(minutes=30)
+        self.client.patch(f'/api/video-posts/{post.id}/', {'publish_at': sooner.isoformat()}, format='json')
+        self.assertEqual(PublishDispatcher.next_due(), sooner)
+
+        self.client.patch(f'/api/video-posts/{post.id}/', {'publish_at': None}, format='json')
+        self.assertIsNone(PublishDispatcher.next_due())
+        self.assertTrue(UploadJob.objects.filter(video_post=post).exists())
+
+    def test_moving_into_the_past_releases_at_once(self):
+        post = self.create_post(publish_at=self.publish_at.isoformat())
+        past = timezone.now() - datetime.timedelta(minutes=1)
+        with mock.patch('video_uploader.services.publishing.DispatcherWakeup.send') as send:
+            self.client.patch(f'/api/video-posts/{post.id}/', {'publish_at': past.isoformat()}, format='json')
+        self.assertTrue(UploadJob.objects.filter(video_post=post).exists())
+        self.assertIsNone(PublishDispatcher.next_due())
+        send.assert_not_called()
+
+    @override_settings(PUBLISH_RECHECK_INTERVAL=60)
+    def test_dispatcher_sleeps_until_next_due(self):
+        timeouts = []
+
+        class Wakeup:
+            def wait(self, timeout, stop_event):
+                timeouts.append(timeout)
+                stop_event.set()
+
+            def close(self):
+                pass
+
+        self.create_post(publish_at=self.publish_at.isoformat())
+        run_dispatcher(wakeup=Wakeup())
+        self.assertEqual(timeouts, [60])
+
+        with mock.patch('video_uploader.services.publishing.DispatcherWakeup.send') as send:
+            self.create_post(publish_at=(timezone.now() + datetime.timedelta(seconds=5)).isoformat())
+        send.assert_called_once()
+        run_dispatcher(wakeup=Wakeup())
+        self.assertLessEqual(timeouts[1], 5)
+
+
+@override_settings(PUBLISH_RECHECK_INTERVAL=60)
+class DispatcherWakeupTests(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(PUBLISH_WAKEUP_SOCKET=os.path.join(directory, 'dispatcher.sock')))
+        self.user = User.objects.create_user('owner', password='secret')
+        self.post = make_post(self.user, [Platform.objects.create(platform='youtube')])
+        self.post.upload_statuses.update(publish_at=timezone.now() + datetime.timedelta(hours=1))
+
+    def start_dispatcher(self):
+        stop_event = threading.Event()
+
+        def dispatch():
+            try:
+                run_dispatcher(stop_event)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=dispatch)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(stop_event.set)
+        for _ in range(50):
+            if os.path.exists(settings.PUBLISH_WAKEUP_SOCKET):
+                break
+            time.sleep(0.1)
+        return stop_event, thread
+
+    def test_earlier_deadline_wakes_the_dispatcher(self):
+        self.start_dispatcher()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        started = timezone.now()
+        sooner = started + datetime.timedelta(seconds=1)
+        response = client.patch(f'/api/video-posts/{self.post.id}/', {'publish_at': sooner.isoformat()}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        for _ in range(100):
+            if UploadJob.objects.filter(video_post=self.post).exists():
+                break
+            time.sleep(0.1)
+        # Released about when due, not after the 60 second re-check
+        self.assertTrue(UploadJob.objects.filter(video_post=self.post).exists())
+        self.assertLess((timezone.now() - started).total_seconds(), 10)
+        self.assertIsNone(PublishDispatcher.next_due())
+
+    def test_socket_is_removed_on_stop(self):
+        stop_event, thread = self.start_dispatcher()
+        self.assertTrue(os.path.exists(settings.PUBLISH_WAKEUP_SOCKET))
+        stop_event.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(settings.PUBLISH_WAKEUP_SOCKET))
+
+
+@override_settings(UPLOAD_PROGRESS_FLUSH_INTERVAL=60)
+class StatusTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.platforms = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+        cls.post = make_post(cls.user, cls.platforms)
+        create_statuses(cls.post, cls.platforms)
+
+    def test_initial_rows_are_created_once(self):
+        self.assertEqual(list(self.post.upload_statuses.values_list('status', flat=True)), ['pending', 'pending'])
+
+    def test_transition_writes_only_changed_columns(self):
+        youtube = self.platforms[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(transition(self.post, youtube, 'pending', 'uploading', attempts=1))
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "video_uploader_uploadstatus"'))
+        self.assertIn('"status" IN', update)
+        self.assertNotIn('"external_id"', update)
+        self.assertNotIn('"error_message"', update)
+        self.assertEqual(VideoPost.objects.get(pk=self.post.pk).status, 'uploading')
+
+        # A row that already moved on is left alone
+        self.assertFalse(transition(self.post, youtube, 'pending', 'uploading'))
+        self.assertEqual(UploadStatus.objects.get(video_post=self.post, platform=youtube).attempts, 1)
+
+    def test_claimed_upload_is_not_uploaded_twice(self):
+        vimeo = self.platforms[1]
+        upload_status = UploadStatus.objects.get(video_post=self.post, platform=vimeo)
+        transition(self.post, vimeo, 'pending', 'uploading')
+        with mock.patch('video_uploader.services.upload_manager.PlatformServiceFactory.get_service') as get_service:
+            result = VideoUploadManager.upload_to_platform(self.post, vimeo, upload_status)
+        get_service.return_value.upload_video.assert_not_called()
+        self.assertEqual(result['status'], 'uploading')
+
+    def test_progress_is_flushed_in_one_update(self):
+        buffer = ProgressBuffer()
+        statuses = list(self.post.upload_statuses.all())
+        for sent in (100, 200):
+            for upload_status in statuses:
+                upload_status.bytes_sent = sent
+                buffer.record(upload_status)
+        self.assertEqual(sum(self.post.upload_statuses.values_list('bytes_sent', flat=True)), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 1)
+        self.assertEqual(list(self.post.upload_statuses.values_list('bytes_sent', flat=True)), [200, 200])
+
+
+class LeaseReaperTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('owner', password='secret')
+        cls.platforms = [Platform.objects.create(platform=name) for name in ('youtube', 'vimeo')]
+        cls.post = make_post(cls.user, cls.platforms)
+
+    def claim(self, platform, attempts=1, expires_in=60, owner='dead-host:1'):
+        transition(
+            self.post, platform, 'pending', 'uploading', attempts=attempts, leased_by=owner,
+            lease_expires_at=timezone.now() + datetime.timedelta(seconds=expires_in))
+
+    def test_expired_uploads_are_requeued_or_failed(self):
+        youtube, vimeo = self.platforms
+        self.claim(youtube, expires_in=-1)
+        self.claim(vimeo, attempts=settings.UPLOAD_RETRY_POLICY['max_attempts'], expires_in=-1)
+        job = UploadJob.objects.create(
+            video_post=self.post, status='running', locked_by='dead-host:1:0', available_at=timezone.now())
+
+        with self.assertLogs('video_uploader.services.leases', 'WARNING'):
+            self.assertEqual(LeaseReaper.reap(), (1, 1))
+        statuses = dict(self.post.upload_statuses.values_list('platform__platform', 'status'))
+        self.assertEqual(statuses, {'youtube': 'pending', 'vimeo': 'failed'})
+        self.assertEqual(VideoPost.objects.get(pk=self.post.pk).status, 'failed')
+        self.assertTrue(UploadJob.objects.filter(video_post=self.post, status='queued').exists())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(LeaseReaper.reap(), (0, 0))
+
+    def test_live_leases_are_kept(self):
+        youtube = self.platforms[0]
+        self.claim(youtube, expires_in=-1)
+        UploadStatus.objects.filter(platform=youtube).update(leased_by=lease_owner())
+        with keeper.hold(UploadStatus.objects.get(platform=youtube)):
+            self.assertEqual(keeper.renew(), 1)
+        self.assertEqual(LeaseReaper.reap(), (0, 0))
+        self.assertEqual(UploadStatus.objects.get(platform=youtube).status, 'uploading')
+
+    def test_job_killed_outside_an_upload_is_recovered(self):
+        # The worker died before claiming any upload, so no lease ever expires
+        stalled = timezone.now() - datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS + 1)
+        job = UploadJob.objects.create(
+            video_post=self.post, status='running', locked_by='dead-host:1:0', locked_at=stalled, attempts=1)
+        with self.assertLogs('video_uploader.services.leases', 'WARNING'):
+            self.assertEqual(LeaseReaper.reap(), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.locked_at), ('queued', '', None))
+
+        # A job that keeps dying is given up on
+        UploadJob.objects.filter(pk=job.pk).update(
+            status='running', locked_at=stalled, attempts=settings.UPLOAD_RETRY_POLICY['max_attempts'])
+        with self.assertLogs('video_uploader.services.leases', 'WARNING'):
+            self.assertEqual(LeaseReaper.reap_jobs(), (0, 1))
+        self.assertEqual(UploadJob.objects.get(pk=job.pk).status, 'failed')
+
+    def test_running_job_is_kept_alive(self):
+        stalled = timezone.now() - datetime.timedelta(seconds=settings.UPLOAD_LEASE_SECONDS + 1)
+        job = UploadJob.objects.create(
+            video_post=self.post, status='running', locked_by=f'{lease_owner()}:0', locked_at=stalled)
+        with keeper.hold_job(job):
+            self.assertEqual(keeper.renew(), 1)
+        self.assertEqual(LeaseReaper.reap_jobs(), (0, 0))
+        self.assertEqual(UploadJob.objects.get(pk=job.pk).status, 'running')
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plans')
+    def test_scans_use_partial_indexes(self):
+        expired = UploadStatus.objects.filter(LeaseReaper.expired_filter()).values('id').explain()
+        self.assertIn('uploadstatus_lease_idx', expired)
+        due = UploadStatus.objects.filter(publish_at__isnull=False, publish_at__lte=timezone.now()).explain()
+        self.assertIn('uploadstatus_publish_at_idx', due)
+
+    def test_finished_upload_releases_its_lease(self):
+        youtube = self.platforms[0]
+        self.claim(youtube, owner=lease_owner())
+        VideoUploadManager._finish(self.post, youtube, success=True, external_id='abc', platform_outcome=False)
+        upload_status = UploadStatus.objects.get(platform=youtube)
+        self.assertEqual((upload_status.leased_by, upload_status.lease_expires_at), ('', None))
+
+    def test_late_result_after_takeover_is_dropped(self):
+        youtube = self.platforms[0]
+        # This worker stalls past its lease, the reaper re-queues the upload and another worker claims it
+        self.claim(youtube, owner=lease_owner(), expires_in=-1)
+        with self.assertLogs('video_uploader.services.leases', 'WARNING'):
+            LeaseReaper.reap()
+        self.assertTrue(transition(
+            self.post, youtube, 'pending', 'uploading', attempts=F('attempts') + 1, leased_by='other-host:1',
+            lease_expires_at=lease_expiry()))
+
+        with self.assertLogs('video_uploader.services.upload_manager', 'WARNING'):
+            result = VideoUploadManager._finish(
+                self.post, youtube, success=True, external_id='late', platform_outcome=False)
+        self.assertEqual(result['status'], 'uploading')
+        upload_status = UploadStatus.objects.get(platform=youtube)
+        self.assertEqual(
+            (upload_status.status, upload_status.external_id, upload_status.leased_by, upload_status.attempts),
+            ('uploading', '', 'other-host:1', 2))
+
+    def test_retry_upload_resets_stalled_uploads(self):
+        self.claim(self.platforms[0], expires_in=-1)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/video-posts/{self.post.id}/retry_upload/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(set(self.post.upload_statuses.values_list('status', flat=True)), {'pending'})
+
+
+class FairShareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.heavy = User.objects.create_user('heavy', password='secret')
+        cls.light = User.objects.create_user('light', password='secret')
+
+    def queue(self, user, count, available_at=None):
+        posts = VideoPost.objects.bulk_create([
+            VideoPost(title=f'Post {index}', description='Description',
+                      video_url='https://example.com/video.mp4', created_by=user)
+            for index in range(count)
+        ])
+        UploadJobQueue.enqueue_many([post.id for post in posts], available_at=available_at)
+
+    def claim_users(self, count):
+        users = []
+        for index in range(count):
+            job = UploadJobQueue.claim(f'worker-{index}')
+            users.append(job.user_id)
+        return users
+
+    def test_later_user_is_not_starved(self):
+        self.queue(self.heavy, 50)
+        self.queue(self.light, 2)
+        # Interleaved with the heavy user's backlog instead of behind it
+        self.assertEqual(self.claim_users(4), [self.heavy.id, self.light.id, self.heavy.id, self.light.id])
+
+    def test_parked_job_gives_no_credit(self):
+        self.queue(self.light, 1, available_at=timezone.now() + datetime.timedelta(days=1))
+        self.queue(self.heavy, 50)
+        self.claim_users(40)
+        # The light user's new jobs start level with the backlog, not at the parked job's tag
+        self.queue(self.light, 2)
+        self.assertEqual(self.claim_users(4), [self.heavy.id, self.light.id, self.heavy.id, self.light.id])
+
+    def test_weights(self):
+        UploadShare.objects.create(user=self.light, weight=2)
+        self.queue(self.heavy, 10)
+        self.queue(self.light, 10)
+        users = self.claim_users(9)
+        self.assertEqual(users.count(self.light.id), 6)
+
+    def test_concurrency_cap(self):
+        UploadShare.objects.create(user=self.heavy, max_running=1)
+        self.queue(self.heavy, 5)
+        self.queue(self.light, 1)
+        self.assertEqual(self.claim_users(2), [self.heavy.id, self.light.id])
+        self.assertIsNone(UploadJobQueue.claim('worker-3'))
+
+    @override_settings(UPLOAD_FAIR_SHARE_MAX_RUNNING=2)
+    def test_default_cap(self):
+        self.queue(self.heavy, 5)
+        self.assertEqual(len(self.claim_users(2)), 2)
+        self.assertIsNone(UploadJobQueue.claim('worker-3'))
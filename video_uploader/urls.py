@@ -1,12 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import streams, views
 
 
 router = DefaultRouter()
 router.register(r'video-posts', views.VideoPostViewSet, basename='videopost')
 router.register(r'platforms', views.PlatformViewSet)
+router.register(r'upload-sessions', views.UploadSessionViewSet, basename='uploadsession')
 
 urlpatterns = [
+    path('api/events/', streams.user_events, name='upload-events'),
+    path('api/video-posts/<int:pk>/events/', streams.post_events, name='videopost-events'),
     path('api/', include(router.urls)),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,9 +1,24 @@
-from rest_framework import viewsets
+import copy
+import hmac
+import io
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.http import HttpResponse
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import VideoPost, Platform
-from .serializers import VideoPostSerializer, PlatformSerializer
-from .services.upload_manager import VideoUploadManager
+from .models import VideoPost, Platform, UploadSession, UserUploadStats
+from .pagination import VideoPostCursorPagination
+from .serializers import VideoPostSerializer, PlatformSerializer, UploadSessionSerializer
+from .services.bulk_posts import BulkVideoPostCreator
+from .services.job_queue import UploadJobQueue
+from .services.leases import LeaseReaper
+from .services.metrics import registry
+from .services.quota import QuotaLedger
+from .services.status_tracker import StatusTracker
+from .services.upload_sessions import OffsetMismatch, UploadSessionManager
 from rest_framework.permissions import IsAuthenticated
 
 
@@ -11,41 +26,212 @@ class PlatformViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Platform.objects.filter(is_active=True)
     serializer_class = PlatformSerializer
     permission_classes = [IsAuthenticated]
+    # Most queries an action may run, enforced by QueryBudgetTests;
+    # quotas runs two per platform
+    query_budgets = {
+        'list': 1,
+        'retrieve': 1,
+        'quotas': 7,
+    }
+    
+    @action(detail=False, methods=['get'])
+    def quotas(self, request):
+        """Remaining quota per platform and projected drain time of the upload queue"""
+        return Response([
+            QuotaLedger.report(platform, credential=request.user.id)
+            for platform in self.get_queryset()
+        ])
 
 
 class VideoPostViewSet(viewsets.ModelViewSet):
     serializer_class = VideoPostSerializer
     permission_classes = [IsAuthenticated]
     
+    pagination_class = VideoPostCursorPagination
+    # Most queries an action may run, enforced by QueryBudgetTests. Each is
+    # the sum of the action's query plan, none of which grows with the number
+    # of posts or platforms. A user's first post also inserts their stats
+    # and fair-share rows (+3).
+    query_budgets = {
+        # Posts, their statuses, their platforms
+        'list': 3,
+        'retrieve': 3,
+        # Platforms, owner check, post, stats, statuses, fair-share tag (3),
+        # job, then the response's statuses and platforms
+        'create': 11 + 3,
+        # Post (3), owner check, UPDATE, platforms for validate_platforms
+        'update': 6,
+        'partial_update': 6,
+        # Post (3), six dependent tables, the post, stats
+        'destroy': 11,
+        # Post (3), transaction (2), reset, StatusTracker (3), then a queued
+        # job is reused (1) or a new one tagged and inserted (5)
+        'retry_upload': 3 + 2 + 1 + 3 + 5,
+        # Platforms, transaction (2), posts, statuses, fair-share tag (3),
+        # jobs, stats
+        'bulk_create': 10 + 3,
+        'upload_stats': 1,
+    }
+    
     def get_queryset(self):
-        return VideoPost.objects.filter(created_by=self.request.user)
+        queryset = VideoPost.objects.filter(created_by=self.request.user)
+        
+        # Both filters are served by the (created_by, status, created_at, id)
+        # and UploadStatus (platform, video_post) indexes
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        platform_filter = self.request.query_params.get('platform')
+        if platform_filter:
+            queryset = queryset.filter(upload_statuses__platform__platform=platform_filter.lower())
+        
+        # overall_status is computed from the prefetched statuses, no per-row query
+        return queryset.prefetch_related('upload_statuses__platform')
+    
+    def create(self, request, *args, **kwargs):
+        # Uploads run on the worker pool, so creation only accepts the work
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+    
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        # The response lists the new statuses, fetch them with their platforms at once
+        prefetch_related_objects([serializer.instance], 'upload_statuses__platform')
+    
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # UpdateModelMixin drops the instance's prefetched statuses after this
+        # call; updating a post does not change them, so respond with a copy
+        # that keeps them
+        serializer.instance = copy.copy(serializer.instance)
     
     @action(detail=True, methods=['post'])
     def retry_upload(self, request, pk=None):
         """Retry failed uploads for a specific video post"""
         video_post = self.get_object()
         
-        # Reset failed uploads to pending
-        video_post.upload_statuses.filter(status='failed').update(status='pending')
+        # Reset failed uploads, and uploads whose worker died, to pending;
+        # successful platforms are left alone. A timed-out upload whose
+        # thread is still sending keeps its lease, the retry waits for it.
+        with transaction.atomic():
+            video_post.upload_statuses.filter(Q(status='failed') | LeaseReaper.expired_filter()).update(
+                status='pending', attempts=0, next_retry_at=None)
+            StatusTracker.sync_post(video_post.id)
+        
+        # Queue upload process
+        job = UploadJobQueue.enqueue(video_post)
         
-        # Trigger upload process
-        results = VideoUploadManager.upload_to_platforms(video_post)
+        return Response({
+            'message': 'Upload retry queued',
+            'job_id': job.id
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """Create a batch of video posts, reporting errors per item"""
+        items = request.data.get('posts') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty list of posts.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.VIDEO_POST_BULK_MAX_ITEMS:
+            return Response({'detail': f'At most {settings.VIDEO_POST_BULK_MAX_ITEMS} posts per batch.'},
+                            status=status.HTTP_400_BAD_REQUEST)
         
+        created, errors = BulkVideoPostCreator(request).run(items)
         return Response({
-            'message': 'Upload retry initiated',
-            'results': results
-        })
+            'created': created,
+            'errors': errors
+        }, status=status.HTTP_202_ACCEPTED if created else status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
     def upload_stats(self, request):
         """Get upload statistics"""
-        user_posts = self.get_queryset()
+        # Counters are maintained on every status transition, see StatusTracker
+        stats = UserUploadStats.objects.filter(user=request.user).values(
+            'total_posts', 'successful_uploads', 'failed_uploads', 'pending_uploads'
+        ).first() or {
+            'total_posts': 0,
+            'successful_uploads': 0,
+            'failed_uploads': 0,
+            'pending_uploads': 0,
+        }
         
-        stats = {
-            'total_posts': user_posts.count(),
-            'successful_uploads': user_posts.filter(upload_statuses__status='success').distinct().count(),
-            'failed_uploads': user_posts.filter(upload_statuses__status='failed').distinct().count(),
-            'pending_uploads': user_posts.filter(upload_statuses__status='pending').distinct().count(),
+        return Response(stats)
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable chunked upload of a video file.
+
+    POST creates a session, HEAD/GET report the stored ``Upload-Offset`` and
+    PATCH appends the raw request body at the ``Upload-Offset`` header. The
+    VideoPost is created and queued when the last byte arrives.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return UploadSession.objects.filter(created_by=self.request.user)
+    
+    def _offset_headers(self, session):
+        return {
+            'Upload-Offset': str(session.offset),
+            'Upload-Length': str(session.upload_length),
+            'Cache-Control': 'no-store',
         }
+    
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response['Location'] = f"{request.path}{response.data['id']}/"
+        response['Upload-Offset'] = '0'
+        return response
+    
+    def retrieve(self, request, *args, **kwargs):
+        session = self.get_object()
+        serializer = self.get_serializer(session)
+        return Response(serializer.data, headers=self._offset_headers(session))
+    
+    def partial_update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.video_post_id:
+            return Response({'detail': 'Upload already completed.'}, status=status.HTTP_409_CONFLICT)
+        
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({'detail': 'A numeric Upload-Offset header is required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read the raw body straight from the WSGI stream; touching
+        # request.data would make Django buffer the whole chunk first
+        length = request.META.get('CONTENT_LENGTH')
+        length = int(length) if length else None
+        try:
+            UploadSessionManager.append(session, offset, request.stream or io.BytesIO(), length)
+        except OffsetMismatch as e:
+            return Response({'detail': str(e)}, status=status.HTTP_409_CONFLICT,
+                            headers={'Upload-Offset': str(e.expected)})
+        
+        if not session.is_complete:
+            return Response(status=status.HTTP_204_NO_CONTENT, headers=self._offset_headers(session))
         
-        return Response(stats)
\ No newline at end of file
+        video_post = UploadSessionManager.finalize(session, request)
+        serializer = VideoPostSerializer(video_post, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=self._offset_headers(session))
+    
+    def destroy(self, request, *args, **kwargs):
+        UploadSessionManager.discard(self.get_object())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def metrics(request):
+    """Upload metrics in the Prometheus text format"""
+    if settings.METRICS_TOKEN:
+        keyword, _, token = request.headers.get('Authorization', '').partition(' ')
+        if keyword != 'Bearer' or not hmac.compare_digest(token.strip(), settings.METRICS_TOKEN):
+            return HttpResponse(status=401)
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')